@@ -1,109 +1,80 @@
-import json
-import pandas as pd
-from datetime import datetime
-
-def json_to_excel():
-    input_file = "C:/Final_Prog/Input/202205.json"
-    output_excel = "C:/Final_Prog/Output/202205_filtrada.xlsx"
-    output_csv_temp = "C:/Final_Prog/Output/estaciones_planas.csv"
-    rows = []
-
-    with open(input_file, "r", encoding="latin-1") as f:
-        for line in f:
-            if line.strip():
-                record = json.loads(line)
-                timestamp = record["_id"]
-                for idx, station in enumerate(record["stations"]):
-                    flat_row = {
-                        "timestamp": timestamp,
-                        "entry_id": idx,
-                        **station
-                    }
-                    rows.append(flat_row)
-
-    df = pd.DataFrame(rows)
-
-    # Convertir timestamp a datetime
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors='coerce')
+import argparse
+import os
 
-    # Mapear días de la semana en español
-    dias_semana = {
-        0: "Lunes",
-        1: "Martes",
-        2: "Miércoles",
-        3: "Jueves",
-        4: "Viernes",
-        5: "Sábado",
-        6: "Domingo"
-    }
-    df["weekday"] = df["timestamp"].dt.dayofweek.map(dias_semana)
-
-    df.to_excel(output_excel, index=False)
-    df.to_csv(output_csv_temp, index=False, encoding="utf-8")
-    print(f"✅ Archivos exportados:\n- Excel: {output_excel}\n- CSV temporal: {output_csv_temp}")
-
-def filtrar_todas_entradas_a_las_14(input_excel, output_excel):
-    df = pd.read_excel(input_excel)
-    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-    df_filtrado = df[df['timestamp'].dt.hour == 14]
-    df_filtrado.to_excel(output_excel, index=False)
-    print(f"✅ Archivo filtrado guardado con todas las entradas de las 14h: {output_excel}")
+import pandas as pd
 
-def exportar_columnas_reducidas(input_excel, output_excel):
+from almacen import CAPA_BRUTA, CAPA_FILTRADA, CARPETA_DATASET, CARPETA_SALIDA, escribir_capa, exportar_excel, leer_capa
+from ingesta import VENTANA_14H, añadir_argumentos_ventana, imprimir_estadisticas, ingestar_lote, ventana_desde_argumentos
+from instrumentacion import activar_desde_argumentos, añadir_argumentos_instrumentacion, cerrar_desde_argumentos, etapa
+
+def json_a_dataset(entradas, base=CARPETA_DATASET, procesos=None, ventana=VENTANA_14H):
+    # Ingesta por bloques de uno o varios ficheros (o carpetas / patrones glob) repartida
+    # entre procesos; cada bloque se escribe en la capa bruta en cuanto se llena.
+    # Los snapshots fuera de la ventana se descartan al leer (ventana=None: todos)
+    if isinstance(entradas, str):
+        entradas = [entradas]
+    stats = ingestar_lote(entradas, CAPA_BRUTA, base, procesos=procesos, ventana=ventana)
+    imprimir_estadisticas(stats)
+    print(f"✅ Capa '{CAPA_BRUTA}' actualizada con los meses {stats['meses']}")
+    return stats["meses"]
+
+def exportar_columnas_reducidas(df):
+    # day, weekday e in_use ya vienen calculados y tipados de la ingesta (esquema.py)
     columnas_deseadas = [
-        "timestamp", "weekday", "id", "name", "total_bases", "free_bases",
+        "timestamp", "day", "weekday", "id", "name", "total_bases", "free_bases", "in_use",
         "number", "longitude", "latitude", "address", "dock_bikes"
     ]
 
-    df = pd.read_excel(input_excel)
-
-    # Asegurarse de que las columnas necesarias existen para calcular in_use
-    if "total_bases" in df.columns and "free_bases" in df.columns:
-        df["in_use"] = df["total_bases"] - df["free_bases"]
-    else:
-        print("❌ No se encontraron las columnas necesarias para calcular 'in_use'.")
-        df["in_use"] = None
-
-    # Insertar 'in_use' justo después de 'free_bases'
-    columnas_finales = []
-    for col in columnas_deseadas:
-        columnas_finales.append(col)
-        if col == "free_bases":
-            columnas_finales.append("in_use")
-
-    columnas_presentes = [col for col in columnas_finales if col in df.columns]
-    df_reducido = df[columnas_presentes]
-
-    df_reducido.to_excel(output_excel, index=False)
-    print(f"✅ Archivo Excel con columnas reducidas exportado: {output_excel}")
+    with etapa("filtrado.reducir", len(df)):
+        columnas_presentes = [col for col in columnas_deseadas if col in df.columns]
+        df_reducido = df[columnas_presentes]
+    print(f"✅ Columnas reducidas: {columnas_presentes}")
+    return df_reducido
 
 def separar_por_comas_excel(input_file, output_file):
     df = pd.read_excel(input_file)
-    new_df = pd.DataFrame()
+    partes = []
 
     for col in df.columns:
-        if df[col].dtype == object and df[col].astype(str).str.contains(",", na=False).any():
-            split_cols = df[col].astype(str).str.split(",", expand=True)
+        texto = df[col].astype(str) if df[col].dtype == object else None
+        if texto is not None and texto.str.contains(",", na=False).any():
+            split_cols = texto.str.split(",", expand=True)
             split_cols.columns = [f"{col}_{i+1}" for i in range(split_cols.shape[1])]
-            new_df = pd.concat([new_df, split_cols], axis=1)
+            partes.append(split_cols)
         else:
-            new_df[col] = df[col]
+            partes.append(df[[col]])
+
+    # Un único concat al final en lugar de ir creciendo el DataFrame columna a columna
+    new_df = pd.concat(partes, axis=1)
 
     new_df.to_excel(output_file, index=False)
     print(f"✅ Archivo Excel con columnas separadas exportado: {output_file}")
 
 if __name__ == "__main__":
-    json_to_excel()
-    input_excel = "C:/Final_Prog/Output/202205_filtrada.xlsx"
-    filtered_excel = "C:/Final_Prog/Output/estaciones_filtradas_14h.xlsx"
-    filtrar_todas_entradas_a_las_14(input_excel, filtered_excel)
-    reduced_excel = "C:/Final_Prog/Output/estaciones_reducidas.xlsx"
-    exportar_columnas_reducidas(filtered_excel, reduced_excel)
-    output_excel_final = "C:/Final_Prog/Output/202205_filtrada.xlsx"
-    separar_por_comas_excel(reduced_excel, output_excel_final)
-
-
-
-
-
-
+    parser = argparse.ArgumentParser(description="Ingesta de los JSON mensuales de BiciMAD al dataset")
+    parser.add_argument("entradas", nargs="*", default=["C:/Final_Prog/Input"],
+                        help="Ficheros .json, carpetas o patrones glob")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos en paralelo (por defecto, todos los núcleos)")
+    añadir_argumentos_ventana(parser)
+    parser.add_argument("--excel", action="store_true", help="Exportar también un informe Excel por mes")
+    añadir_argumentos_instrumentacion(parser)
+    args = parser.parse_args()
+    activar_desde_argumentos(args)
+
+    ventana = ventana_desde_argumentos(args)
+    print(f"Ventana de ingesta: {ventana}")
+
+    meses = json_a_dataset(args.entradas, procesos=args.procesos, ventana=ventana)
+    if not meses:
+        print("⚠️ Ningún snapshot dentro de la ventana: no hay meses que filtrar")
+    # Mes a mes, igual que la etapa de filtrado del pipeline: la memoria depende del
+    # mes más grande y no de todos los ingeridos
+    for year, month in meses:
+        df_reducido = exportar_columnas_reducidas(leer_capa(CAPA_BRUTA, meses=[(year, month)]))
+        escribir_capa(df_reducido, CAPA_FILTRADA)
+        if args.excel:
+            exportar_excel(df_reducido, os.path.join(CARPETA_SALIDA, f"{year}{month:02d}_filtrada.xlsx"))
+    if meses:
+        print(f"✅ Capa '{CAPA_FILTRADA}' actualizada con los meses {meses}")
+
+    cerrar_desde_argumentos(args)
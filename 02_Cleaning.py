@@ -1,56 +1,56 @@
-import pandas as pd
+import argparse
 import os
-from sklearn.preprocessing import LabelEncoder
 
-# Ruta de la carpeta
-folder_path = r"C:\Final_Prog\Output"
+from almacen import CAPA_FILTRADA, CAPA_LIMPIA, CARPETA_DATASET, CARPETA_SALIDA, escribir_capa, exportar_excel, leer_capa, particiones
+from esquema import aplicar_esquema
+from estaciones import COLUMNAS_DIMENSION, actualizar_estaciones, codificar, unir_estaciones
+from instrumentacion import activar_desde_argumentos, añadir_argumentos_instrumentacion, cerrar_desde_argumentos, etapa
 
-# Verifica si la carpeta existe
-if not os.path.exists(folder_path):
-    print(f"La carpeta no existe: {folder_path}")
-else:
-    print(f"Buscando archivos en: {folder_path}")
+# Exportar también cada mes limpio a Excel como informe final (opcional)
+exportar_informe_excel = False
 
-    archivos_excel = [f for f in os.listdir(folder_path) if f.endswith(".xlsx")]
 
-    if not archivos_excel:
-        print("No se encontraron archivos .xlsx en la carpeta.")
-    else:
-        print(f"Archivos encontrados: {archivos_excel}\n")
+def limpiar(df, base=CARPETA_DATASET):
+    # Las columnas llegan tipadas y con day/weekday/in_use de la ingesta (esquema.py);
+    # solo las capas filtradas anteriores al esquema necesitan conversión
+    with etapa("limpieza.esquema", len(df)):
+        df = aplicar_esquema(df)
 
-        for filename in archivos_excel:
-            file_path = os.path.join(folder_path, filename)
-            print(f"Procesando: {file_path}")
+    # Codificar ID de estación con el código estable de la tabla de estaciones; nombre,
+    # dirección y coordenadas quedan en esa tabla y no se repiten en cada fila
+    with etapa("limpieza.estaciones", len(df)):
+        estaciones = actualizar_estaciones(df, base)
+        return codificar(df, estaciones)
 
-            try:
-                # Leer archivo Excel
-                df = pd.read_excel(file_path)
 
-                # Convertir 'timestamp' a datetime
-                df['timestamp'] = pd.to_datetime(df['timestamp'])
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Limpieza de la capa filtrada")
+    añadir_argumentos_instrumentacion(parser)
+    args = parser.parse_args()
+    activar_desde_argumentos(args)
 
-                # Separar características temporales
-                df['day'] = df['timestamp'].dt.day
-                df['weekday'] = df['timestamp'].dt.weekday  # 0=Lunes, 6=Domingo
+    meses = particiones(CAPA_FILTRADA, CARPETA_DATASET)
 
-                # Reemplazar comas en coordenadas si es necesario
-                if df['longitude'].dtype == 'object':
-                    df['longitude'] = df['longitude'].astype(str).str.replace(',', '.').astype(float)
-                    df['latitude'] = df['latitude'].astype(str).str.replace(',', '.').astype(float)
+    if not meses:
+        print(f"No se encontraron meses en la capa '{CAPA_FILTRADA}' de {CARPETA_DATASET}")
+    else:
+        print(f"Meses encontrados: {meses}\n")
 
-                # Codificar ID de estación
-                le = LabelEncoder()
-                df['station_id'] = le.fit_transform(df['id'])
+        for year, month in meses:
+            print(f"Procesando: {year}-{month:02d}")
 
-                # Guardar archivo con nuevo nombre
-                name_part = os.path.splitext(filename)[0]
-                cleaned_name = f"{name_part}_cleaned.xlsx"
-                cleaned_path = os.path.join(folder_path, cleaned_name)
+            try:
+                with etapa(f"limpieza.{year}-{month:02d}"):
+                    df = leer_capa(CAPA_FILTRADA, meses=[(year, month)])
+                    df = limpiar(df)
+                    escribir_capa(df, CAPA_LIMPIA)
+                print(f"Guardado: capa '{CAPA_LIMPIA}' {year}-{month:02d}\n")
 
-                df.to_excel(cleaned_path, index=False)
-                print(f"Guardado: {cleaned_path}\n")
+                if exportar_informe_excel:
+                    cleaned_path = os.path.join(CARPETA_SALIDA, f"{year}{month:02d}_filtrada_cleaned.xlsx")
+                    exportar_excel(unir_estaciones(df, COLUMNAS_DIMENSION), cleaned_path)
 
             except Exception as e:
-                print(f"Error procesando {filename}: {e}")
-
+                print(f"Error procesando {year}-{month:02d}: {e}")
 
+    cerrar_desde_argumentos(args)
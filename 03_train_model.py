@@ -1,90 +1,181 @@
-import pandas as pd
+import argparse
+import json
 import os
-import matplotlib.pyplot as plt
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.neural_network import MLPRegressor
-from xgboost import XGBRegressor
-from sklearn.metrics import mean_squared_error, r2_score
-from sklearn.preprocessing import LabelEncoder
-
-# Ruta de la carpeta
-folder_path = r"C:\Final_Prog\Output"
-
-# Combinar todos los archivos .xlsx que contengan '_cleaned'
-all_data = []
-
-for file in os.listdir(folder_path):
-    if file.endswith('_cleaned.xlsx'):
-        path = os.path.join(folder_path, file)
-        df = pd.read_excel(path)
-
-        # Asegurar tipos correctos si vienen mal
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df['day'] = df['timestamp'].dt.day
-        df['weekday'] = df['timestamp'].dt.weekday
-
-        if df['longitude'].dtype == 'object':
-            df['longitude'] = df['longitude'].astype(str).str.replace(',', '.').astype(float)
-            df['latitude'] = df['latitude'].astype(str).str.replace(',', '.').astype(float)
-
-        # Codificar IDs si no está hecho
-        if 'station_id' not in df.columns:
-            le = LabelEncoder()
-            df['station_id'] = le.fit_transform(df['id'])
-
-        all_data.append(df)
-
-# Unir todos los DataFrames
-full_df = pd.concat(all_data, ignore_index=True)
-
-# Variables predictoras y objetivo
-features = ['day', 'weekday', 'total_bases', 'longitude', 'latitude', 'station_id']
-X = full_df[features]
-y = full_df['in_use']
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-# Dividir en entrenamiento y prueba
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-# Entrenar modelos
-models = {
-    'Random Forest': RandomForestRegressor(random_state=42),
-    'Neural Network': MLPRegressor(hidden_layer_sizes=(100, 50), max_iter=500, random_state=42),
-    'XGBoost': XGBRegressor(random_state=42, verbosity=0)
-}
-
-results = {}
+import numpy as np
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import train_test_split
 
-for name, model in models.items():
+from almacen import CARPETA_DATASET, CARPETA_SALIDA
+from calidad import leer_entrenamiento
+from ingesta import memoria_pico_mb
+from modelo import FEATURES, OBJETIVO, cargar_hiperparametros
+
+# Comparación de modelos: cada candidato se entrena en su propio proceso (en paralelo) y
+# además de la precisión se mide lo que cuesta: tiempo de entrenamiento, latencia de
+# predicción, tamaño del modelo y memoria máxima
+INFORME_PATH = os.path.join(CARPETA_SALIDA, "comparacion_modelos.json")
+MAX_ITERACIONES = 1000
+PARADA_TEMPRANA = 20
+
+
+def crear_modelo(nombre, hilos):
+    # Árboles por histogramas y parada temprana con el conjunto de validación
+    if nombre == 'Random Forest':
+        from sklearn.ensemble import RandomForestRegressor
+        return RandomForestRegressor(random_state=42, n_jobs=hilos)
+    if nombre == 'Hist Gradient Boosting':
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        return HistGradientBoostingRegressor(max_iter=MAX_ITERACIONES, early_stopping=True,
+                                             n_iter_no_change=PARADA_TEMPRANA, random_state=42)
+    if nombre == 'Neural Network':
+        from sklearn.neural_network import MLPRegressor
+        return MLPRegressor(hidden_layer_sizes=(100, 50), max_iter=500, early_stopping=True,
+                            n_iter_no_change=PARADA_TEMPRANA, random_state=42)
+    if nombre == 'XGBoost':
+        from xgboost import XGBRegressor
+        # Los hiperparámetros de ajuste.py, si existen; el número de árboles lo decide la parada temprana
+        ajustados = {k: v for k, v in cargar_hiperparametros().items() if k != 'n_estimators'}
+        return XGBRegressor(**ajustados, tree_method='hist', n_estimators=MAX_ITERACIONES, early_stopping_rounds=PARADA_TEMPRANA,
+                            random_state=42, verbosity=0, n_jobs=hilos)
+    raise ValueError(f"Modelo desconocido: {nombre}")
+
+
+MODELOS = ['Random Forest', 'Hist Gradient Boosting', 'Neural Network', 'XGBoost']
+
+
+def cargar_datos(base=CARPETA_DATASET, muestra=None):
+    # Entrenamiento / validación / prueba (70 / 10 / 20), siempre con la misma semilla
+    # Sin las filas de los tramos anómalos de calidad.py
+    full_df = leer_entrenamiento(FEATURES + [OBJETIVO], base=base)
+    if muestra:
+        full_df = full_df.sample(frac=muestra, random_state=42)
+    X, y = full_df[FEATURES], full_df[OBJETIVO]
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, test_size=0.125, random_state=42)
+    return X_train, X_val, X_test, y_train, y_val, y_test
+
+
+def _entrenar(nombre, model, X_train, y_train, X_val, y_val):
+    if nombre == 'XGBoost':
+        model.fit(X_train, y_train, eval_set=[(X_val, y_val)], verbose=False)
+        return model.best_iteration + 1
+    if nombre == 'Hist Gradient Boosting':
+        model.fit(X_train, y_train, X_val=X_val, y_val=y_val)
+        return model.n_iter_
     model.fit(X_train, y_train)
-    predictions = model.predict(X_test)
-    mse = mean_squared_error(y_test, predictions)
-    r2 = r2_score(y_test, predictions)
-    results[name] = {'MSE': mse, 'R2': r2}
+    # El MLP separa su propia validación (validation_fraction) para la parada temprana
+    return getattr(model, 'n_iter_', None)
 
-# Mostrar resultados en consola
-print("\nResultados comparativos:")
-for model_name, metrics in results.items():
-    print(f"{model_name}: MSE = {metrics['MSE']:.2f}, R2 = {metrics['R2']:.2f}")
 
-# Graficar comparación
-labels = list(results.keys())
-mse_values = [results[m]['MSE'] for m in labels]
-r2_values = [results[m]['R2'] for m in labels]
-
-plt.figure(figsize=(12, 5))
-
-plt.subplot(1, 2, 1)
-plt.bar(labels, mse_values, color='skyblue')
-plt.title("MSE por modelo")
-plt.ylabel("Mean Squared Error")
-
-plt.subplot(1, 2, 2)
-plt.bar(labels, r2_values, color='lightgreen')
-plt.title("R2 por modelo")
-plt.ylabel("R-squared")
-
-plt.tight_layout()
-plt.show()
+def evaluar_modelo(tarea):
+    # Worker: carga los datos, entrena un candidato y mide precisión y coste
+    nombre, base, muestra, hilos = tarea
+    X_train, X_val, X_test, y_train, y_val, y_test = cargar_datos(base, muestra)
+    model = crear_modelo(nombre, hilos)
 
+    inicio = time.perf_counter()
+    iteraciones = _entrenar(nombre, model, X_train, y_train, X_val, y_val)
+    segundos_entrenamiento = time.perf_counter() - inicio
 
+    inicio = time.perf_counter()
+    predictions = model.predict(X_test)
+    segundos_prediccion = time.perf_counter() - inicio
+
+    # Latencia de una consulta suelta, como las que hace la app
+    tiempos = []
+    for i in range(min(100, len(X_test))):
+        inicio = time.perf_counter()
+        model.predict(X_test.iloc[i:i + 1])
+        tiempos.append(time.perf_counter() - inicio)
+
+    return nombre, {
+        'MSE': float(mean_squared_error(y_test, predictions)),
+        'R2': float(r2_score(y_test, predictions)),
+        'iteraciones': None if iteraciones is None else int(iteraciones),
+        'segundos_entrenamiento': round(segundos_entrenamiento, 3),
+        'us_por_fila_lote': round(segundos_prediccion / len(X_test) * 1e6, 3),
+        'ms_consulta_unitaria': round(float(np.median(tiempos)) * 1000, 3),
+        'tamaño_mb': round(len(pickle.dumps(model)) / (1024 * 1024), 3),
+        'memoria_pico_mb': memoria_pico_mb(),
+        'filas': {'entrenamiento': len(X_train), 'validacion': len(X_val), 'prueba': len(X_test)},
+    }
+
+
+def comparar_modelos(modelos=MODELOS, base=CARPETA_DATASET, procesos=None, muestra=None):
+    procesos = min(procesos or os.cpu_count() or 1, len(modelos))
+    hilos = max(1, (os.cpu_count() or 1) // procesos)
+    tareas = [(nombre, base, muestra, hilos) for nombre in modelos]
+    # Un proceso nuevo por modelo: así la memoria máxima de cada uno no se mezcla con la de otros
+    with ProcessPoolExecutor(max_workers=procesos, max_tasks_per_child=1) as pool:
+        results = dict(pool.map(evaluar_modelo, tareas))
+    return {
+        'creado': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'features': FEATURES,
+        'objetivo': OBJETIVO,
+        'procesos': procesos,
+        'hilos_por_modelo': hilos,
+        'muestra': muestra,
+        'modelos': results,
+    }
+
+
+def guardar_informe(informe, ruta=INFORME_PATH):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    os.replace(ruta + ".tmp", ruta)
+
+
+def graficar(results):
+    import matplotlib.pyplot as plt
+
+    labels = list(results.keys())
+    plt.figure(figsize=(15, 5))
+
+    plt.subplot(1, 3, 1)
+    plt.bar(labels, [results[m]['MSE'] for m in labels], color='skyblue')
+    plt.title("MSE por modelo")
+    plt.ylabel("Mean Squared Error")
+
+    plt.subplot(1, 3, 2)
+    plt.bar(labels, [results[m]['R2'] for m in labels], color='lightgreen')
+    plt.title("R2 por modelo")
+    plt.ylabel("R-squared")
+
+    plt.subplot(1, 3, 3)
+    plt.bar(labels, [results[m]['segundos_entrenamiento'] for m in labels], color='salmon')
+    plt.title("Tiempo de entrenamiento")
+    plt.ylabel("Segundos")
+
+    plt.tight_layout()
+    plt.show()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara modelos por precisión y coste")
+    parser.add_argument("--modelos", nargs="+", choices=MODELOS, default=MODELOS)
+    parser.add_argument("--procesos", type=int, help="Modelos entrenados a la vez (por defecto, uno por núcleo)")
+    parser.add_argument("--muestra", type=float, help="Fracción de filas a usar (p. ej. 0.1)")
+    parser.add_argument("--base", default=CARPETA_DATASET)
+    parser.add_argument("--salida", default=INFORME_PATH)
+    parser.add_argument("--grafico", action="store_true", help="Mostrar además el gráfico comparativo")
+    args = parser.parse_args()
+
+    informe = comparar_modelos(args.modelos, args.base, args.procesos, args.muestra)
+    guardar_informe(informe, args.salida)
+
+    # Mostrar resultados en consola
+    print("\nResultados comparativos:")
+    for model_name, metrics in informe['modelos'].items():
+        print(f"{model_name}: MSE = {metrics['MSE']:.2f}, R2 = {metrics['R2']:.2f}, "
+              f"entrenamiento = {metrics['segundos_entrenamiento']:.1f} s, "
+              f"consulta = {metrics['ms_consulta_unitaria']:.2f} ms, "
+              f"tamaño = {metrics['tamaño_mb']:.1f} MB, memoria = {metrics['memoria_pico_mb'] or 0:.0f} MB")
+    print(f"✅ Informe guardado en {args.salida}")
+
+    if args.grafico:
+        graficar(informe['modelos'])
@@ -1,66 +1,64 @@
 import streamlit as st
-import pandas as pd
 import os
-import joblib
-from xgboost import XGBRegressor
-from sklearn.preprocessing import LabelEncoder
+import time
+
+from directo import ESTADO_PATH, cargar_estado
+from espacial import CERCANAS, construir_indice, donde_coger_bici
+from modelo import MODELO_PATH
+from prediccion import ESTACIONES_AÑO, LLUVIAS, PREDICCIONES_PATH, TEMPERATURAS, cargar_tabla, disponibilidad, tipo_de_dia
+from servicio import PAQUETE_PATH, cargar_paquete, publicar_paquete
+
+inicio_arranque = time.perf_counter()
 
 st.set_page_config(page_title="Predicción de Bicis", layout="centered")
 
 # Rutas
-folder_path = r"C:\Final_Prog\Output"
-modelo_path = os.path.join(folder_path, "modelo_xgboost_entrenado.joblib")
+modelo_path = MODELO_PATH
 
 @st.cache_resource
-def cargar_modelo_y_datos():
-    if not os.path.exists(modelo_path):
-        all_data = []
-        for file in os.listdir(folder_path):
-            if file.endswith('_cleaned.xlsx'):
-                df = pd.read_excel(os.path.join(folder_path, file))
-                df['timestamp'] = pd.to_datetime(df['timestamp'])
-                df['day'] = df['timestamp'].dt.day
-                df['weekday'] = df['timestamp'].dt.weekday
-
-                if df['longitude'].dtype == 'object':
-                    df['longitude'] = df['longitude'].astype(str).str.replace(',', '.').astype(float)
-                    df['latitude'] = df['latitude'].astype(str).str.replace(',', '.').astype(float)
-
-                if 'station_id' not in df.columns:
-                    le = LabelEncoder()
-                    df['station_id'] = le.fit_transform(df['id'])
-
-                all_data.append(df)
-
-        df = pd.concat(all_data, ignore_index=True)
-        X = df[['day', 'weekday', 'total_bases', 'longitude', 'latitude', 'station_id']]
-        y = df['in_use']
-
-        model = XGBRegressor(random_state=42, verbosity=0)
-        model.fit(X, y)
-        joblib.dump(model, modelo_path)
+def cargar_datos():
+    # Solo el paquete de servicio que publica el pipeline; si no existe se genera una vez
+    if not os.path.exists(PAQUETE_PATH):
+        publicar_paquete(PAQUETE_PATH)
+    return cargar_paquete(PAQUETE_PATH)
+
+def publicar_modelo_si_falta():
+    # Sin modelo publicado: se publica la versión activa del registro y, si no hay
+    # registro, se entrena uno completo (solo la primera vez)
+    if os.path.exists(modelo_path):
+        return
+    from registro_modelos import RegistroModelos, entrenar_completo
+
+    registro = RegistroModelos()
+    if registro.activa is not None:
+        registro.activar(registro.activa['version'], modelo_path)
     else:
-        model = joblib.load(modelo_path)
-        all_data = []
-        for file in os.listdir(folder_path):
-            if file.endswith('_cleaned.xlsx'):
-                df = pd.read_excel(os.path.join(folder_path, file))
-                df['timestamp'] = pd.to_datetime(df['timestamp'])
-                df['day'] = df['timestamp'].dt.day
-                df['weekday'] = df['timestamp'].dt.weekday
-                all_data.append(df)
-        df = pd.concat(all_data, ignore_index=True)
-
-    return model, df
-
-model, data = cargar_modelo_y_datos()
+        entrenar_completo(registro, destino=modelo_path)
+
+@st.cache_resource(max_entries=1)
+def cargar_predicciones(version_modelo):
+    # Tabla de predicciones precalculada por el pipeline; se carga al pedir la primera
+    # predicción y solo se recalcula (con el modelo) si el modelo ha cambiado. La caché
+    # depende de la fecha del fichero del modelo: al activar otra versión se usa en la
+    # siguiente consulta sin reiniciar la app
+    return cargar_tabla(modelo_path, station_info, PREDICCIONES_PATH)
+
+@st.cache_resource(max_entries=1)
+def cargar_medias_directo(version_estado):
+    # Medias que mantiene directo.py con los snapshots que van llegando; se releen solo
+    # cuando cambia el fichero de estado
+    return cargar_estado(ESTADO_PATH)[0].media_por_estacion()
 
-station_info = data.groupby('name').agg({
-    'station_id': 'first',
-    'total_bases': 'first',
-}).reset_index()
+@st.cache_resource
+def cargar_indice():
+    # Índice espacial de las estaciones con su distrito (en caché tras el primer cálculo)
+    return construir_indice(station_info)
 
-mean_usage = data.groupby('name')['in_use'].mean().to_dict()
+paquete = cargar_datos()
+station_info = paquete['station_info']
+mean_usage = paquete['mean_usage']
+if os.path.exists(ESTADO_PATH):
+    mean_usage = {**mean_usage, **cargar_medias_directo(os.path.getmtime(ESTADO_PATH))}
 
 # Interfaz principal
 st.title("Bicinator, predictor de uso y disponibilidad")
@@ -76,10 +74,7 @@ with col2:
     station_name = st.selectbox("🏙️ Estación", sorted(station_info['name'].unique()))
 
 # Asignación automática del tipo de día
-if weekday <= 4:
-    tipo_dia = "Laborable"
-else:
-    tipo_dia = "Fin de semana"
+tipo_dia = tipo_de_dia(weekday)
 
 station_data = station_info[station_info['name'] == station_name].iloc[0]
 station_id = station_data['station_id']
@@ -90,65 +85,62 @@ st.info(f"📍 ID estación: `{station_id}` | 🔧 Total de bases: `{total_bases
 # 🌦️ Expansión de condiciones externas (opcionales)
 with st.expander("🧪 Ajustes avanzados (factores externos)"):
     st.markdown(f"🗓️ Tipo de día detectado automáticamente: **{tipo_dia}**")
-    temperatura = st.selectbox("Temperatura", ["", "Normal (10-30°C)", "Menor a 10°C", "Mayor a 30°C"], index=0)
-    lluvia = st.selectbox("Precipitaciones", ["", "Sin lluvia", "Lluvia leve", "Lluvia intensa"], index=0)
-    estacion = st.selectbox("Estación del año", ["", "Primavera o verano", "Otoño o invierno"], index=0)
+    temperatura = st.selectbox("Temperatura", TEMPERATURAS, index=0)
+    lluvia = st.selectbox("Precipitaciones", LLUVIAS, index=0)
+    estacion = st.selectbox("Estación del año", ESTACIONES_AÑO, index=0)
 
 # Botón de predicción
-if st.button("🔮 Predecir bicicletas en uso"):
-    input_df = pd.DataFrame([{
-        'day': day,
-        'weekday': weekday,
-        'total_bases': total_bases,
-        'longitude': 0,
-        'latitude': 0,
-        'station_id': station_id
-    }])
-
-    pred = model.predict(input_df)[0]
-    pred_base = int(round(pred))
-
-    # Calcular ajustes solo si se ha seleccionado una opción
-    factor = 1.0
-
-    if tipo_dia == "Fin de semana":
-        factor *= 0.90
-    elif tipo_dia == "Laborable":
-        factor *= 0.95
-
-    if temperatura == "Menor a 10°C":
-        factor *= 0.80
-    elif temperatura == "Mayor a 30°C":
-        factor *= 0.85
-
-    if lluvia == "Lluvia leve":
-        factor *= 0.75
-    elif lluvia == "Lluvia intensa":
-        factor *= 0.60
-
-    if estacion == "Primavera o verano":
-        factor *= 0.85
-    elif estacion == "Otoño o invierno":
-        factor *= 0.95
-
-    pred_ajustada = int(round(pred_base * factor))
-    disponibles = total_bases - pred_ajustada
+if st.button("🔮 Predecir bicicletas disponibles"):
+    # Predicción base y ajustada (tipo de día y factores externos) de la tabla precalculada
+    publicar_modelo_si_falta()
+    tabla = cargar_predicciones(os.path.getmtime(modelo_path))
+    pred_base, pred_ajustada = tabla.predecir(station_id, day, weekday, temperatura, lluvia, estacion)
+    bicis, bases_libres = disponibilidad(total_bases, pred_ajustada)
 
     # Mostrar resultados
-    media = mean_usage.get(station_name, 0)
+    media = mean_usage.get(int(station_id), 0)
     if pred_ajustada > total_bases:
         st.error("🚫 La estimación supera la capacidad de la estación.")
     else:
-        estado = "✅ Uso habitual"
+        estado = "✅ Disponibilidad habitual"
         if pred_ajustada < media * 0.5:
-            estado = "⬇️ Menor uso de lo habitual"
+            estado = "⬇️ Menos bicis de lo habitual"
         elif pred_ajustada > media * 1.2:
-            estado = "🔥 Alta demanda"
+            estado = "⬆️ Más bicis de lo habitual"
 
         st.markdown("### 📊 Resultados")
-        st.success(f"**Predicción base**: {pred_base} bicis en uso\n\n"
-                   f"**Predicción ajustada**: {pred_ajustada} bicis en uso\n\n"
-                   f"🅿️ Bicis disponibles: {disponibles}")
-        st.markdown(f"**{estado}** *(Media histórica: {media:.1f} bicis en uso)*")
+        st.success(f"**Predicción base**: {pred_base} bases ocupadas\n\n"
+                   f"**Predicción ajustada**: {pred_ajustada} bases ocupadas\n\n"
+                   f"🚲 Bicis disponibles: {bicis} | 🅿️ Bases libres: {bases_libres}")
+        st.markdown(f"**{estado}** *(Media histórica: {media:.1f} bases ocupadas)*")
+
+# 📍 Búsqueda por ubicación: estaciones cercanas con bicis (o bases libres) previstas
+st.markdown("---")
+st.markdown("### 📍 ¿Dónde cojo una bici?")
+col3, col4 = st.columns(2)
+with col3:
+    longitude = st.number_input("Longitud", value=float(station_info['longitude'].mean()), format="%.5f")
+    latitude = st.number_input("Latitud", value=float(station_info['latitude'].mean()), format="%.5f")
+with col4:
+    k = st.slider("Estaciones", 1, 10, CERCANAS)
+    dejar = st.radio("Quiero", ["Coger una bici", "Dejar una bici"], horizontal=True) == "Dejar una bici"
+
+if st.button("🔎 Buscar estaciones cercanas"):
+    # Mismo día y factores externos que arriba, con la tabla de predicciones precalculada
+    publicar_modelo_si_falta()
+    tabla = cargar_predicciones(os.path.getmtime(modelo_path))
+    inicio_busqueda = time.perf_counter()
+    cercanas = donde_coger_bici(
+        cargar_indice(), lambda ids: tabla.predecir_estaciones(ids, day, weekday, temperatura, lluvia, estacion)[1],
+        longitude, latitude, k, dejar)
+    if cercanas.empty:
+        st.warning("No hay estaciones con disponibilidad prevista.")
+    else:
+        st.dataframe(cercanas[['name', 'distrito', 'distancia_m', 'bicis', 'bases_libres', 'total_bases']],
+                     hide_index=True)
+        st.map(cercanas[['latitude', 'longitude']])
+    st.caption(f"⏱️ Búsqueda: {(time.perf_counter() - inicio_busqueda) * 1000:.1f} ms")
+
+st.caption(f"⏱️ Arranque: {(time.perf_counter() - inicio_arranque) * 1000:.0f} ms")
 
 #abrir la aplicación: streamlit run 04_app.py
\ No newline at end of file
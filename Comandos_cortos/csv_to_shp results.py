@@ -1,6 +1,5 @@
 import geopandas as gpd
 import pandas as pd
-from shapely.geometry import Point
 import os
 
 # Ruta base
@@ -26,7 +25,7 @@ for i in range(1, 10):
             continue
 
         # CORREGIDO: intercambiamos los valores, ya que están invertidos
-        geometry = [Point(lat, lon) for lat, lon in zip(df['latitude'], df['longitude'])]
+        geometry = gpd.points_from_xy(df['latitude'], df['longitude'])
 
         gdf = gpd.GeoDataFrame(df, geometry=geometry, crs="EPSG:4326")
 
@@ -0,0 +1,124 @@
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from almacen import CAPA_AGREGADOS, CAPA_LIMPIA, CARPETA_DATASET, abrir_capa, leer_capa, particiones, ruta_capa
+from instrumentacion import etapa
+
+# Cubo de agregados: suma, conteo, mínimo y máximo de cada métrica por estación x día de
+# la semana x hora, un fichero por mes de la capa limpia. Se recalculan solo los meses
+# nuevos o que han cambiado, y cualquier informe (uso por día de la semana, media por
+# estación...) se obtiene sumando celdas del cubo en vez de releer los datos
+METRICAS = ("in_use", "dock_bikes", "free_bases")
+CLAVES = ["station_id", "weekday", "hour"]
+ESTADISTICOS = ("suma", "n", "min", "max")
+FICHERO_MES = "agregados.parquet"
+
+
+def _ruta_mes(year, month, base):
+    return os.path.join(ruta_capa(CAPA_AGREGADOS, base), f"year={year}", f"month={month}", FICHERO_MES)
+
+
+def _carpeta_limpia(year, month, base):
+    return os.path.join(ruta_capa(CAPA_LIMPIA, base), f"year={year}", f"month={month}")
+
+
+def agregar_mes(df):
+    # df: station_id, timestamp y métricas de un mes. Una fila por celda con datos
+    ts = df["timestamp"]
+    valores = pd.DataFrame({m: df[m].astype("float64") if m in df.columns else np.nan for m in METRICAS})
+    valores["station_id"] = df["station_id"].to_numpy()
+    valores["weekday"] = ts.dt.weekday.astype("int8").to_numpy()
+    valores["hour"] = ts.dt.hour.astype("int8").to_numpy()
+    grupos = valores.groupby(CLAVES, sort=True)
+    columnas = {}
+    for m in METRICAS:
+        columnas[f"{m}_suma"] = grupos[m].sum()
+        columnas[f"{m}_n"] = grupos[m].count().astype("int32")
+        columnas[f"{m}_min"] = grupos[m].min().astype("float32")
+        columnas[f"{m}_max"] = grupos[m].max().astype("float32")
+    return pd.DataFrame(columnas).reset_index()
+
+
+def _mes_desactualizado(year, month, base):
+    # Sin agregar, o algún fichero del mes limpio es posterior a su agregado
+    ruta = _ruta_mes(year, month, base)
+    if not os.path.exists(ruta):
+        return True
+    carpeta = _carpeta_limpia(year, month, base)
+    modificado = max((os.path.getmtime(os.path.join(raiz, f)) for raiz, _, ficheros in os.walk(carpeta)
+                      for f in ficheros), default=0)
+    return modificado > os.path.getmtime(ruta)
+
+
+def actualizar_agregados(base=CARPETA_DATASET, meses=None):
+    # Agrega los meses indicados (por defecto, los que falten o estén desactualizados) y
+    # borra los de meses que ya no están en la capa limpia. Devuelve los meses agregados
+    disponibles = particiones(CAPA_LIMPIA, base)
+    for year, month in particiones(CAPA_AGREGADOS, base):
+        if (year, month) not in disponibles:
+            # La carpeta entera: si queda vacía, particiones() sigue listando el mes
+            shutil.rmtree(os.path.dirname(_ruta_mes(year, month, base)))
+    if meses is None:
+        meses = [mes for mes in disponibles if _mes_desactualizado(*mes, base)]
+    if not meses:
+        return []
+
+    esquema = abrir_capa(CAPA_LIMPIA, base).schema.names
+    columnas = ["station_id", "timestamp"] + [m for m in METRICAS if m in esquema]
+    for year, month in meses:
+        inicio = time.perf_counter()
+        df = leer_capa(CAPA_LIMPIA, columnas=columnas, meses=[(year, month)], base=base)
+        with etapa(f"agregados.{year}-{month:02d}", len(df)) as medida:
+            agregado = agregar_mes(df)
+            medida.salida(len(agregado))
+        ruta = _ruta_mes(year, month, base)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        agregado.to_parquet(ruta + ".tmp", index=False)
+        os.replace(ruta + ".tmp", ruta)
+        print(f"✅ Agregados {year}-{month:02d}: {len(df)} filas -> {len(agregado)} celdas "
+              f"({time.perf_counter() - inicio:.2f} s)")
+    return meses
+
+
+def cargar_agregados(base=CARPETA_DATASET, meses=None):
+    # El cubo completo (o solo esos meses) en formato largo, con year y month
+    if not particiones(CAPA_AGREGADOS, base):
+        return pd.DataFrame(columns=["year", "month"] + CLAVES)
+    columnas = ["year", "month"] + CLAVES + [f"{m}_{e}" for m in METRICAS for e in ESTADISTICOS]
+    return leer_capa(CAPA_AGREGADOS, columnas=columnas, meses=meses, base=base)
+
+
+def rollup(agregados, por=("weekday",), metrica="in_use", **filtros):
+    # Suma las celdas del cubo agrupando por las columnas de `por` (cualquiera de year,
+    # month, station_id, weekday, hour; vacío = total). filtros: columna=lista de valores
+    for columna, valores in filtros.items():
+        agregados = agregados[agregados[columna].isin(list(valores))]
+    por = list(por)
+    grupos = agregados.groupby(por, sort=True) if por else agregados.groupby(np.zeros(len(agregados), dtype=np.int8))
+    resultado = pd.DataFrame({
+        "suma": grupos[f"{metrica}_suma"].sum(),
+        "n": grupos[f"{metrica}_n"].sum(),
+        "min": grupos[f"{metrica}_min"].min(),
+        "max": grupos[f"{metrica}_max"].max(),
+    })
+    resultado["media"] = resultado["suma"] / resultado["n"].where(resultado["n"] > 0)
+    return resultado if por else resultado.reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cubo de agregados de la capa limpia")
+    parser.add_argument("--todos", action="store_true", help="Recalcular todos los meses")
+    parser.add_argument("--por", nargs="*", default=["weekday"], help="Columnas del rollup a mostrar")
+    parser.add_argument("--metrica", default="in_use", choices=METRICAS)
+    parser.add_argument("--base", default=CARPETA_DATASET)
+    args = parser.parse_args()
+
+    actualizar_agregados(args.base, particiones(CAPA_LIMPIA, args.base) if args.todos else None)
+    inicio = time.perf_counter()
+    print(rollup(cargar_agregados(args.base), args.por, args.metrica))
+    print(f"⏱️ {(time.perf_counter() - inicio) * 1000:.1f} ms")
@@ -0,0 +1,227 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from almacen import CARPETA_DATASET, CARPETA_SALIDA
+from calidad import leer_entrenamiento
+from modelo import FEATURES, HIPERPARAMETROS_PATH, OBJETIVO
+
+# Búsqueda de hiperparámetros de XGBoost por successive halving: se prueban muchas
+# configuraciones con pocos árboles y solo la mejor fracción pasa a la siguiente ronda
+# con más árboles. Cada proceso del pool construye una vez las matrices cuantizadas
+# (QuantileDMatrix) de cada pliegue y las reutiliza en todas sus pruebas. La validación
+# respeta el tiempo: se entrena con el pasado y se valida con el bloque siguiente. Cada
+# prueba terminada se añade al fichero de pruebas, así que una búsqueda interrumpida
+# continúa donde se quedó
+CARPETA_AJUSTE = os.path.join(CARPETA_SALIDA, "ajuste")
+FICHERO_PRUEBAS = "pruebas.jsonl"
+CONFIGURACIONES = 27
+RONDAS_MIN = 50
+FACTOR = 3
+PLIEGUES = 2
+PARADA_TEMPRANA = 20
+MAX_BIN = 256
+
+
+def muestrear_configuracion(rng):
+    # Espacio de búsqueda (nombres de XGBRegressor; xgb.train los acepta igual)
+    return {
+        "learning_rate": round(float(10 ** rng.uniform(math.log10(0.02), math.log10(0.3))), 4),
+        "max_depth": int(rng.integers(3, 11)),
+        "min_child_weight": round(float(10 ** rng.uniform(0, math.log10(20))), 3),
+        "subsample": round(float(rng.uniform(0.6, 1.0)), 3),
+        "colsample_bytree": round(float(rng.uniform(0.6, 1.0)), 3),
+        "reg_lambda": round(float(10 ** rng.uniform(-1, 1)), 3),
+        "gamma": round(float(rng.uniform(0, 1)), 3),
+    }
+
+
+def pliegues_temporales(timestamps, n_pliegues=PLIEGUES):
+    # Se parten los días en n_pliegues + 1 bloques consecutivos; el pliegue i entrena con
+    # los bloques 0..i y valida con el i+1. Devuelve (fin_entrenamiento, fin_validacion)
+    # como posiciones en los datos ordenados por fecha
+    dias = np.unique(timestamps.astype("datetime64[D]"))
+    if len(dias) < n_pliegues + 1:
+        raise ValueError(f"Hacen falta al menos {n_pliegues + 1} días de datos para {n_pliegues} pliegues")
+    cortes = [dias[round(len(dias) * i / (n_pliegues + 1))] for i in range(1, n_pliegues + 1)]
+    posiciones = [int(np.searchsorted(timestamps, np.datetime64(c, "us"))) for c in cortes] + [len(timestamps)]
+    return [(posiciones[i], posiciones[i + 1]) for i in range(n_pliegues)]
+
+
+def preparar_datos(base, carpeta, muestra=None, n_pliegues=PLIEGUES):
+    # Datos ordenados por fecha en .npy (los procesos los abren sin copiarlos) y huella
+    # para saber si las pruebas guardadas son de estos mismos datos
+    df = leer_entrenamiento(FEATURES + [OBJETIVO, "timestamp"], base=base)
+    df = df[df[OBJETIVO].notna()]
+    if muestra:
+        df = df.sample(frac=muestra, random_state=42)
+    df = df.sort_values("timestamp", kind="stable")
+    timestamps = df["timestamp"].to_numpy("datetime64[us]")
+    X = df[FEATURES].to_numpy(np.float32)
+    y = df[OBJETIVO].to_numpy(np.float32)
+    pliegues = pliegues_temporales(timestamps, n_pliegues)
+
+    os.makedirs(carpeta, exist_ok=True)
+    np.save(os.path.join(carpeta, "X.npy"), X)
+    np.save(os.path.join(carpeta, "y.npy"), y)
+    huella = hashlib.sha256()
+    for parte in (X, y, timestamps.view(np.int64), np.array(pliegues)):
+        huella.update(np.ascontiguousarray(parte).tobytes())
+    return pliegues, huella.hexdigest()[:16]
+
+
+# --- Worker: matrices cuantizadas por pliegue, construidas una vez por proceso ---
+
+_MATRICES = None
+
+
+def _iniciar_worker(carpeta, pliegues, hilos):
+    global _MATRICES
+    import xgboost as xgb
+
+    X = np.load(os.path.join(carpeta, "X.npy"), mmap_mode="r")
+    y = np.load(os.path.join(carpeta, "y.npy"), mmap_mode="r")
+    matrices = []
+    for fin_entrenamiento, fin_validacion in pliegues:
+        entrenamiento = xgb.QuantileDMatrix(X[:fin_entrenamiento], y[:fin_entrenamiento], max_bin=MAX_BIN,
+                                            feature_names=FEATURES, nthread=hilos)
+        validacion = xgb.QuantileDMatrix(X[fin_entrenamiento:fin_validacion], y[fin_entrenamiento:fin_validacion],
+                                         ref=entrenamiento, feature_names=FEATURES, nthread=hilos)
+        matrices.append((entrenamiento, validacion))
+    _MATRICES = (matrices, hilos)
+
+
+def evaluar_prueba(tarea):
+    # Entrena la configuración en cada pliegue con como mucho `rondas` árboles (parada
+    # temprana) y devuelve el MSE medio de validación
+    import xgboost as xgb
+
+    clave, configuracion, rondas = tarea
+    matrices, hilos = _MATRICES
+    parametros = {"tree_method": "hist", "max_bin": MAX_BIN, "seed": 42, "nthread": hilos,
+                  "objective": "reg:squarederror", "eval_metric": "rmse", **configuracion}
+    inicio = time.perf_counter()
+    errores, iteraciones = [], []
+    for entrenamiento, validacion in matrices:
+        booster = xgb.train(parametros, entrenamiento, num_boost_round=rondas, evals=[(validacion, "validacion")],
+                            early_stopping_rounds=PARADA_TEMPRANA, verbose_eval=False)
+        errores.append(booster.best_score ** 2)
+        iteraciones.append(booster.best_iteration + 1)
+    return {"clave": clave, "configuracion": configuracion, "rondas": rondas,
+            "mse": round(float(np.mean(errores)), 5), "mse_pliegues": [round(float(e), 5) for e in errores],
+            "iteraciones": int(np.max(iteraciones)), "segundos": round(time.perf_counter() - inicio, 3)}
+
+
+# --- Búsqueda ---
+
+def _clave_prueba(huella, configuracion, rondas):
+    return hashlib.sha256(json.dumps([huella, configuracion, rondas], sort_keys=True).encode()).hexdigest()[:16]
+
+
+def cargar_pruebas(ruta):
+    pruebas = {}
+    if os.path.exists(ruta):
+        with open(ruta, encoding="utf-8") as f:
+            for linea in f:
+                # Una última línea a medias (proceso interrumpido) se ignora
+                try:
+                    prueba = json.loads(linea)
+                except json.JSONDecodeError:
+                    continue
+                pruebas[prueba["clave"]] = prueba
+        # Que las pruebas nuevas empiecen en su propia línea
+        with open(ruta, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+    return pruebas
+
+
+def buscar(base=CARPETA_DATASET, carpeta=CARPETA_AJUSTE, configuraciones=CONFIGURACIONES, rondas_min=RONDAS_MIN,
+           factor=FACTOR, n_pliegues=PLIEGUES, procesos=None, muestra=None, semilla=42):
+    pliegues, huella = preparar_datos(base, carpeta, muestra, n_pliegues)
+    ruta_pruebas = os.path.join(carpeta, FICHERO_PRUEBAS)
+    pruebas = cargar_pruebas(ruta_pruebas)
+    rng = np.random.default_rng(semilla)
+    candidatas = [muestrear_configuracion(rng) for _ in range(configuraciones)]
+
+    procesos = procesos or min(os.cpu_count() or 1, configuraciones)
+    hilos = max(1, (os.cpu_count() or 1) // procesos)
+    rondas, escalon, resultados = rondas_min, 0, []
+    pool = None
+    try:
+        while candidatas:
+            tareas = [(_clave_prueba(huella, c, rondas), c, rondas) for c in candidatas]
+            resultados = [pruebas[clave] for clave, _, _ in tareas if clave in pruebas]
+            pendientes = [t for t in tareas if t[0] not in pruebas]
+            if pendientes and pool is None:
+                pool = ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_worker,
+                                           initargs=(carpeta, pliegues, hilos))
+            inicio = time.perf_counter()
+            with open(ruta_pruebas, "a", encoding="utf-8") as f:
+                for futuro in as_completed([pool.submit(evaluar_prueba, t) for t in pendientes]):
+                    prueba = futuro.result()
+                    f.write(json.dumps(prueba) + "\n")
+                    f.flush()
+                    pruebas[prueba["clave"]] = prueba
+                    resultados.append(prueba)
+            resultados.sort(key=lambda p: p["mse"])
+            print(f"📊 Escalón {escalon}: {len(tareas)} configuraciones x {rondas} rondas "
+                  f"({len(tareas) - len(pendientes)} ya hechas) en {time.perf_counter() - inicio:.1f} s; "
+                  f"mejor MSE {resultados[0]['mse']}")
+            if len(candidatas) == 1:
+                break
+            candidatas = [p["configuracion"] for p in resultados[:max(1, len(candidatas) // factor)]]
+            rondas *= factor
+            escalon += 1
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return resultados[0], huella
+
+
+def guardar_mejor(mejor, huella, ruta=HIPERPARAMETROS_PATH):
+    # Formato que lee modelo.cargar_hiperparametros: parámetros de XGBRegressor con el
+    # número de árboles en el que paró la validación
+    datos = {
+        "creado": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "parametros": {**mejor["configuracion"], "n_estimators": mejor["iteraciones"], "max_bin": MAX_BIN},
+        "mse_validacion": mejor["mse"],
+        "mse_pliegues": mejor["mse_pliegues"],
+        "huella_datos": huella,
+    }
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(datos, f, indent=2, ensure_ascii=False)
+    os.replace(ruta + ".tmp", ruta)
+    print(f"✅ Mejor configuración (MSE {mejor['mse']}) guardada en {ruta}: {datos['parametros']}")
+    return datos
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ajuste de hiperparámetros de XGBoost por successive halving")
+    parser.add_argument("--configuraciones", type=int, default=CONFIGURACIONES, help="Configuraciones iniciales")
+    parser.add_argument("--rondas-min", type=int, default=RONDAS_MIN, help="Árboles en el primer escalón")
+    parser.add_argument("--factor", type=int, default=FACTOR, help="Se queda 1/factor y multiplica los árboles")
+    parser.add_argument("--pliegues", type=int, default=PLIEGUES, help="Pliegues temporales de validación")
+    parser.add_argument("--procesos", type=int, help="Procesos del pool (por defecto, uno por núcleo)")
+    parser.add_argument("--muestra", type=float, help="Fracción de filas a usar (p. ej. 0.1)")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--base", default=CARPETA_DATASET)
+    parser.add_argument("--carpeta", default=CARPETA_AJUSTE, help="Datos preparados y pruebas hechas")
+    parser.add_argument("--salida", default=HIPERPARAMETROS_PATH, help="Donde la leen el entrenamiento y la app")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    mejor, huella = buscar(args.base, args.carpeta, args.configuraciones, args.rondas_min, args.factor,
+                           args.pliegues, args.procesos, args.muestra, args.semilla)
+    guardar_mejor(mejor, huella, args.salida)
+    print(f"⏱️ Búsqueda completa en {time.perf_counter() - inicio:.1f} s")
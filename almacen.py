@@ -0,0 +1,265 @@
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from esquema import aplicar_esquema
+from instrumentacion import etapa
+
+# Rutas
+CARPETA_SALIDA = r"C:\Final_Prog\Output"
+CARPETA_DATASET = os.path.join(CARPETA_SALIDA, "dataset")
+
+# Capas del dataset: cada etapa lee la anterior y escribe la suya
+CAPA_BRUTA = "bruta"        # 01_Filtrado: todas las estaciones de los snapshots de la ventana de ingesta
+CAPA_FILTRADA = "filtrada"  # 01_Filtrado: columnas reducidas
+CAPA_LIMPIA = "limpia"      # 02_Cleaning: con variables del modelo
+CAPA_CAMBIOS = "cambios"    # cambios.py: estado de cada estación solo cuando cambia (todas las horas)
+CAPA_INSTANTES = "instantes"  # cambios.py: fechas de todos los snapshots, para reconstruir las series
+CAPA_AGREGADOS = "agregados"  # agregados.py: suma/conteo/mín/máx por estación x mes x día de la semana x hora
+CAPA_GIS = "gis"            # exportar_gis.py: GeoParquet por mes de cada capa exportada (gis/limpia, gis/bruta)
+
+# Filas por grupo de Parquet: las estadísticas de cada grupo permiten saltarlo al filtrar
+FILAS_POR_GRUPO = 64_000
+
+
+def ruta_capa(capa, base=CARPETA_DATASET):
+    return os.path.join(base, capa)
+
+
+def _columnas_particion(por_hora):
+    return ["year", "month", "hour"] if por_hora else ["year", "month"]
+
+
+def _añadir_particiones(df, por_hora):
+    ts = df["timestamp"]
+    nuevas = {"year": ts.dt.year.astype("int16"), "month": ts.dt.month.astype("int8")}
+    if por_hora:
+        nuevas["hour"] = ts.dt.hour.astype("int8")
+    return df.assign(**nuevas)
+
+
+def _ruta_particion(ruta, valores, columnas):
+    return os.path.join(ruta, *[f"{col}={val}" for col, val in zip(columnas, valores)])
+
+
+def _borrar_meses(ruta, meses):
+    # Borrar los meses que se van a reescribir (con todas sus horas si las hay)
+    for year, month in meses:
+        carpeta = _ruta_particion(ruta, (year, month), ["year", "month"])
+        if os.path.isdir(carpeta):
+            shutil.rmtree(carpeta)
+
+
+def _escribir(df, ruta, por_hora, nombre):
+    # Los registros sin timestamp válido no tienen partición
+    df = df[df["timestamp"].notna()].sort_values("timestamp", kind="stable")
+    df = _añadir_particiones(df, por_hora)
+    columnas = _columnas_particion(por_hora)
+    esquema = pa.schema([(col, pa.from_numpy_dtype(df[col].dtype)) for col in columnas])
+    ds.write_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        ruta,
+        format="parquet",
+        partitioning=ds.partitioning(esquema, flavor="hive"),
+        basename_template=f"{nombre}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        max_rows_per_group=FILAS_POR_GRUPO,
+        min_rows_per_group=min(FILAS_POR_GRUPO, len(df)),
+    )
+
+
+def _meses(df):
+    ts = df["timestamp"].dropna()
+    return set(zip(ts.dt.year.tolist(), ts.dt.month.tolist()))
+
+
+def escribir_capa(df, capa, base=CARPETA_DATASET, por_hora=False):
+    # Reescribe en la capa los meses presentes en df; el resto de meses no se toca
+    if df.empty:
+        return set()
+    ruta = ruta_capa(capa, base)
+    with etapa(f"escribir_capa.{capa}", len(df)):
+        meses = _meses(df)
+        _borrar_meses(ruta, meses)
+        _escribir(df, ruta, por_hora, "parte")
+    return meses
+
+
+class EscritorParticionado:
+    # Destino de ingesta por bloques: cada bloque se escribe como un fichero más de su
+    # partición. Los meses se vacían la primera vez que aparecen (salvo limpiar=False)
+
+    def __init__(self, capa, base=CARPETA_DATASET, por_hora=False, prefijo="parte", limpiar=True):
+        self.ruta = ruta_capa(capa, base)
+        self.por_hora = por_hora
+        self.prefijo = prefijo
+        self.limpiar = limpiar
+        self.meses = set()
+        self._n = 0
+
+    def escribir(self, df):
+        if df.empty:
+            return
+        meses = _meses(df)
+        if self.limpiar:
+            _borrar_meses(self.ruta, meses - self.meses)
+        _escribir(df, self.ruta, self.por_hora, f"{self.prefijo}-{self._n:05d}")
+        self.meses |= meses
+        self._n += 1
+
+    def cerrar(self):
+        pass
+
+
+def mover_particiones(capa, base_origen, base_destino, meses):
+    # Sustituye los meses indicados de la capa destino por los de la capa origen
+    origen = ruta_capa(capa, base_origen)
+    destino = ruta_capa(capa, base_destino)
+    _borrar_meses(destino, meses)
+    for year, month in meses:
+        carpeta = _ruta_particion(origen, (year, month), ["year", "month"])
+        nueva = _ruta_particion(destino, (year, month), ["year", "month"])
+        if os.path.isdir(carpeta):
+            os.makedirs(os.path.dirname(nueva), exist_ok=True)
+            shutil.move(carpeta, nueva)
+
+
+def _filtro_meses(meses):
+    # Sin meses no se lee nada (None dejaría pasar la capa entera)
+    filtro = ds.scalar(False) if not meses else None
+    for year, month in meses:
+        cond = (ds.field("year") == int(year)) & (ds.field("month") == int(month))
+        filtro = cond if filtro is None else filtro | cond
+    return filtro
+
+
+def _unificar_esquemas(esquemas):
+    try:
+        return pa.unify_schemas(esquemas, promote_options="permissive")
+    except pa.ArrowTypeError:
+        # Tipos sin promoción común (weekday de texto en ficheros anteriores a esquema.py
+        # junto a weekday int8): esas columnas se leen como texto y aplicar_esquema las rehace
+        tipos = {}
+        for esquema in esquemas:
+            for campo in esquema:
+                tipos.setdefault(campo.name, []).append(campo.type)
+        campos = []
+        for nombre, lista in tipos.items():
+            try:
+                campos.append(pa.unify_schemas([pa.schema([(nombre, t)]) for t in lista],
+                                               promote_options="permissive").field(0))
+            except pa.ArrowTypeError:
+                campos.append(pa.field(nombre, pa.string()))
+        return pa.schema(campos)
+
+
+def abrir_capa(capa, base=CARPETA_DATASET):
+    ruta = ruta_capa(capa, base)
+    dataset = ds.dataset(ruta, format="parquet", partitioning="hive")
+    # Los ficheros pueden venir de orígenes distintos (p. ej. Excel migrados con in_use
+    # decimal): se unifica el esquema promoviendo los tipos en lugar de fallar al leer
+    esquemas = [fragmento.physical_schema.remove_metadata() for fragmento in dataset.get_fragments()]
+    if len(set(esquemas)) > 1:
+        esquema = _unificar_esquemas(esquemas)
+        for campo in dataset.schema:
+            if campo.name not in esquema.names:
+                esquema = esquema.append(campo)
+        dataset = ds.dataset(ruta, schema=esquema, format="parquet", partitioning="hive")
+    return dataset
+
+
+def leer_capa(capa, columnas=None, meses=None, horas=None, filtro=None, base=CARPETA_DATASET):
+    # columnas: proyección; meses: lista de (año, mes); horas: lista de horas del timestamp;
+    # filtro: expresión de pyarrow.dataset adicional. Los grupos de filas que no cumplen
+    # el filtro según sus estadísticas no se llegan a leer
+    dataset = abrir_capa(capa, base)
+    condiciones = []
+    if meses is not None:
+        condiciones.append(_filtro_meses(meses))
+    if horas is not None:
+        if "hour" in dataset.schema.names:
+            condiciones.append(ds.field("hour").isin(list(horas)))
+        else:
+            condiciones.append(pc.hour(ds.field("timestamp")).isin(list(horas)))
+    if filtro is not None:
+        condiciones.append(filtro)
+    expresion = None
+    for cond in condiciones:
+        if cond is None:
+            continue
+        expresion = cond if expresion is None else expresion & cond
+    with etapa(f"leer_capa.{capa}") as medida:
+        tabla = dataset.to_table(columns=columnas, filter=expresion)
+        df = tabla.to_pandas()
+        # Las columnas de partición no forman parte de los datos
+        if columnas is None:
+            df = df.drop(columns=[c for c in ("year", "month", "hour") if c in df.columns])
+        medida.salida(len(df))
+    return df
+
+
+def leer_capa_por_lotes(capa, columnas=None, meses=None, tam_lote=250_000, base=CARPETA_DATASET):
+    # Como leer_capa pero devolviendo DataFrames de como mucho tam_lote filas, mes a mes:
+    # la memoria depende del tamaño del lote y no del de la capa
+    dataset = abrir_capa(capa, base)
+    for year, month in meses if meses is not None else particiones(capa, base):
+        for lote in dataset.to_batches(columns=columnas, filter=_filtro_meses([(year, month)]), batch_size=tam_lote):
+            if lote.num_rows:
+                yield lote.to_pandas()
+
+
+def particiones(capa, base=CARPETA_DATASET):
+    # Meses (año, mes) disponibles en la capa
+    ruta = ruta_capa(capa, base)
+    if not os.path.isdir(ruta):
+        return []
+    meses = []
+    for carpeta_year in os.listdir(ruta):
+        if not carpeta_year.startswith("year="):
+            continue
+        for carpeta_month in os.listdir(os.path.join(ruta, carpeta_year)):
+            if carpeta_month.startswith("month="):
+                meses.append((int(carpeta_year[5:]), int(carpeta_month[6:])))
+    return sorted(meses)
+
+
+def exportar_excel(df, output_excel):
+    # Informe final opcional: el Excel ya no se usa entre etapas
+    with etapa("exportar_excel", len(df)):
+        df.to_excel(output_excel, index=False)
+    print(f"✅ Informe Excel exportado: {output_excel}")
+
+
+def _unir_columnas_separadas(df):
+    # Deshacer la separación por comas de separar_por_comas_excel (address_1, address_2...)
+    for col in ("name", "address"):
+        partes = sorted(c for c in df.columns if c.startswith(f"{col}_") and c[len(col) + 1:].isdigit())
+        if col in df.columns or not partes:
+            continue
+        unida = df[partes[0]].astype(str)
+        for parte in partes[1:]:
+            resto = df[parte].dropna().astype(str)
+            unida.loc[resto.index] = unida.loc[resto.index] + "," + resto
+        df = df.drop(columns=partes).assign(**{col: unida})
+    return df
+
+
+def importar_excels(carpeta=CARPETA_SALIDA, capa=CAPA_LIMPIA, sufijo="_cleaned.xlsx", base=CARPETA_DATASET):
+    # Migrar al dataset los Excel generados con la versión anterior del pipeline. Se
+    # particiona por el timestamp de los datos, no por el nombre del fichero, así que dos
+    # Excel pueden acabar en el mismo mes: cada mes se vacía solo la primera vez
+    escritor = EscritorParticionado(capa, base, prefijo="excel")
+    for filename in sorted(os.listdir(carpeta)):
+        if filename.endswith(sufijo):
+            df = pd.read_excel(os.path.join(carpeta, filename))
+            df = aplicar_esquema(_unir_columnas_separadas(df))
+            escritor.escribir(df)
+            print(f"✅ {filename} -> capa '{capa}' {sorted(_meses(df))}")
+
+
+if __name__ == "__main__":
+    importar_excels()
@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from almacen import CAPA_BRUTA, CAPA_FILTRADA, CAPA_LIMPIA, CARPETA_SALIDA, escribir_capa, leer_capa, particiones
+from datos_sinteticos import generar
+from ingesta import VENTANA_14H, VentanaTemporal, ingestar_lote, memoria_pico_mb
+from pipeline import CARPETA_CODIGO, cargar_etapa
+
+# Benchmark de todo el flujo sobre datos sintéticos: genera los JSON, los pasa por la
+# ingesta, el filtrado, la limpieza, el entrenamiento y la predicción como lo hace la app,
+# y guarda los tiempos en JSON para comparar entre commits
+CARPETA_BENCHMARKS = os.path.join(CARPETA_SALIDA, "benchmarks")
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=CARPETA_CODIGO,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Cronometro:
+    # Mide cada etapa y guarda segundos, filas y filas por segundo
+
+    def __init__(self):
+        self.etapas = {}
+
+    def medir(self, nombre, funcion, *args, **kwargs):
+        inicio = time.perf_counter()
+        resultado, filas, extra = funcion(*args, **kwargs)
+        segundos = time.perf_counter() - inicio
+        self.etapas[nombre] = {
+            "segundos": round(segundos, 4),
+            "filas": filas,
+            "filas_por_segundo": round(filas / segundos, 1) if filas and segundos > 0 else None,
+            **extra,
+        }
+        print(f"⏱️  {nombre}: {segundos:.2f} s" + (f", {filas} filas" if filas else ""))
+        return resultado
+
+
+def _ingesta(ficheros, base, procesos, ventana):
+    stats = ingestar_lote(ficheros, CAPA_BRUTA, base, procesos=procesos, ventana=ventana)
+    return stats["meses"], stats["filas"], {"procesos": procesos}
+
+
+def _filtrado(meses, base):
+    filtrado = cargar_etapa("01_Filtrado.py")
+    df = filtrado.exportar_columnas_reducidas(leer_capa(CAPA_BRUTA, meses=meses, base=base))
+    escribir_capa(df, CAPA_FILTRADA, base)
+    return None, len(df), {}
+
+
+def _limpieza(base):
+    limpieza = cargar_etapa("02_Cleaning.py")
+    filas = 0
+    for mes in particiones(CAPA_FILTRADA, base):
+        df = limpieza.limpiar(leer_capa(CAPA_FILTRADA, meses=[mes], base=base), base)
+        escribir_capa(df, CAPA_LIMPIA, base)
+        filas += len(df)
+    return None, filas, {}
+
+
+def _entrenamiento(base):
+    from estaciones import leer_capa_con_estaciones
+    from modelo import FEATURES, OBJETIVO, entrenar_xgboost
+
+    df = leer_capa_con_estaciones(CAPA_LIMPIA, FEATURES + [OBJETIVO], base=base)
+    return entrenar_xgboost(df), len(df), {}
+
+
+def _comparacion(base, modelos, procesos):
+    # 03_train_model.py se lanza como script: su pool de procesos necesita importarlo por nombre
+    salida = os.path.join(base, "comparacion_modelos.json")
+    orden = [sys.executable, os.path.join(CARPETA_CODIGO, "03_train_model.py"), "--base", base,
+             "--salida", salida, "--modelos", *modelos]
+    if procesos:
+        orden += ["--procesos", str(procesos)]
+    subprocess.run(orden, check=True, stdout=subprocess.DEVNULL)
+    with open(salida, encoding="utf-8") as f:
+        informe = json.load(f)
+    filas = sum(next(iter(informe["modelos"].values()))["filas"].values())
+    return None, filas, {"modelos": informe["modelos"]}
+
+
+def _paquete(base):
+    from servicio import construir_paquete
+
+    paquete = construir_paquete(base)
+    return paquete, len(paquete["station_info"]), {}
+
+
+def _prediccion_unitaria(model, station_info, consultas, semilla=42):
+    # Como lo hacía la app: un DataFrame de una fila y un model.predict por consulta
+    from modelo import FEATURES
+
+    rng = np.random.default_rng(semilla)
+    filas = station_info.iloc[rng.integers(0, len(station_info), consultas)]
+    tiempos = []
+    for (_, estacion), day, weekday in zip(filas.iterrows(), rng.integers(1, 32, consultas),
+                                           rng.integers(0, 7, consultas)):
+        inicio = time.perf_counter()
+        X = pd.DataFrame([{'day': day, 'weekday': weekday, 'total_bases': estacion['total_bases'],
+                           'longitude': estacion['longitude'], 'latitude': estacion['latitude'],
+                           'station_id': estacion['station_id']}])[FEATURES]
+        model.predict(X)
+        tiempos.append(time.perf_counter() - inicio)
+    ms = np.array(tiempos) * 1000
+    return None, consultas, {"p50_ms": round(float(np.percentile(ms, 50)), 3),
+                             "p99_ms": round(float(np.percentile(ms, 99)), 3)}
+
+
+def _prediccion_lote(model, station_info):
+    from prediccion import predecir_lote
+
+    pred = predecir_lote(model, station_info)
+    return None, pred.size, {}
+
+
+def _tabla(model, station_info, consultas, semilla=42):
+    from prediccion import ESCENARIOS, TablaPredicciones
+
+    tabla = TablaPredicciones.construir(model, station_info)
+    rng = np.random.default_rng(semilla)
+    station_ids = station_info["station_id"].to_numpy()[rng.integers(0, len(station_info), consultas)]
+    escenarios = rng.integers(0, len(ESCENARIOS), consultas)
+    inicio = time.perf_counter()
+    for station_id, day, weekday, escenario in zip(station_ids, rng.integers(1, 32, consultas),
+                                                   rng.integers(0, 7, consultas), escenarios):
+        tabla.predecir(station_id, day, weekday, *ESCENARIOS[escenario])
+    us = (time.perf_counter() - inicio) / consultas * 1e6
+    return tabla, tabla.ajustada.size, {"us_por_consulta": round(us, 3)}
+
+
+def ejecutar_benchmark(carpeta, n_estaciones=264, minutos=15, n_meses=1, procesos=None, ventana=VENTANA_14H,
+                       modelos=(), consultas=200):
+    # Ejecuta todas las etapas sobre una carpeta de trabajo vacía y devuelve los resultados
+    entrada = os.path.join(carpeta, "entrada")
+    base = os.path.join(carpeta, "dataset")
+    cronometro = Cronometro()
+
+    def _generacion():
+        ficheros = generar(entrada, n_estaciones, minutos, n_meses)
+        return ficheros, None, {"bytes": sum(os.path.getsize(f) for f in ficheros)}
+
+    ficheros = cronometro.medir("generacion", _generacion)
+
+    meses = cronometro.medir("ingesta", _ingesta, ficheros, base, procesos, ventana)
+    cronometro.medir("filtrado", _filtrado, meses, base)
+    cronometro.medir("limpieza", _limpieza, base)
+    model = cronometro.medir("entrenamiento", _entrenamiento, base)
+    if modelos:
+        cronometro.medir("comparacion", _comparacion, base, list(modelos), procesos)
+    station_info = cronometro.medir("paquete", _paquete, base)["station_info"]
+    cronometro.medir("prediccion_unitaria", _prediccion_unitaria, model, station_info, consultas)
+    cronometro.medir("prediccion_lote", _prediccion_lote, model, station_info)
+    cronometro.medir("tabla_predicciones", _tabla, model, station_info, consultas * 100)
+
+    return {
+        "creado": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": _commit(),
+        "entorno": {"python": platform.python_version(), "sistema": platform.platform(),
+                    "nucleos": os.cpu_count(), "pandas": pd.__version__, "numpy": np.__version__},
+        "parametros": {"estaciones": n_estaciones, "minutos": minutos, "meses": n_meses,
+                       "procesos": procesos, "ventana": repr(ventana), "modelos": list(modelos)},
+        "etapas": cronometro.etapas,
+        "segundos_total": round(sum(e["segundos"] for e in cronometro.etapas.values()), 4),
+        "memoria_pico_mb": memoria_pico_mb(),
+    }
+
+
+def comparar_resultados(anterior, actual, umbral=1.10):
+    # Etapas que han ido más lentas que en el resultado anterior (más de un 10% por defecto)
+    print(f"\nComparación {anterior.get('commit')} → {actual.get('commit')}:")
+    regresiones = []
+    for etapa, medida in actual["etapas"].items():
+        previa = anterior["etapas"].get(etapa)
+        if not previa or not previa["segundos"]:
+            continue
+        ratio = medida["segundos"] / previa["segundos"]
+        marca = "❌" if ratio > umbral else "✅"
+        print(f"{marca} {etapa}: {previa['segundos']:.2f} s → {medida['segundos']:.2f} s (x{ratio:.2f})")
+        if ratio > umbral:
+            regresiones.append(etapa)
+    return regresiones
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del flujo completo con datos sintéticos")
+    parser.add_argument("--estaciones", type=int, default=264)
+    parser.add_argument("--minutos", type=int, default=15, help="Minutos entre snapshots")
+    parser.add_argument("--meses", type=int, default=1)
+    parser.add_argument("--procesos", type=int, default=None)
+    parser.add_argument("--todas", action="store_true", help="Ingerir todas las horas, no solo las 14h")
+    parser.add_argument("--modelos", nargs="*", default=[],
+                        help="Modelos de 03_train_model.py a comparar también (p. ej. XGBoost 'Random Forest')")
+    parser.add_argument("--consultas", type=int, default=200, help="Consultas unitarias para medir la latencia")
+    parser.add_argument("--carpeta", help="Carpeta de trabajo (por defecto, una temporal que se borra al final)")
+    parser.add_argument("--salida", help="Fichero JSON de resultados")
+    parser.add_argument("--comparar-con", help="Resultado anterior con el que comparar")
+    args = parser.parse_args()
+
+    carpeta = args.carpeta or tempfile.mkdtemp(prefix="benchmark_bicimad_")
+    try:
+        ventana = VentanaTemporal() if args.todas else VENTANA_14H
+        resultado = ejecutar_benchmark(carpeta, args.estaciones, args.minutos, args.meses, args.procesos,
+                                       ventana, args.modelos, args.consultas)
+    finally:
+        if not args.carpeta:
+            shutil.rmtree(carpeta, ignore_errors=True)
+
+    salida = args.salida or os.path.join(
+        CARPETA_BENCHMARKS, f"{time.strftime('%Y%m%d_%H%M%S')}_{resultado['commit'] or 'sin_commit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"\n✅ Resultados guardados en {salida} ({resultado['segundos_total']:.1f} s en total)")
+
+    if args.comparar_con:
+        with open(args.comparar_con, encoding="utf-8") as f:
+            if comparar_resultados(json.load(f), resultado):
+                sys.exit(1)
@@ -0,0 +1,272 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from almacen import CAPA_BRUTA, CAPA_FILTRADA, CAPA_LIMPIA, CARPETA_DATASET, abrir_capa, leer_capa, particiones
+from espacial import RADIO_TIERRA_M
+from estaciones import leer_capa_con_estaciones, leer_estaciones
+from instrumentacion import etapa
+from modelo import FEATURES, OBJETIVO
+
+# Control de calidad de los snapshots: recorre la capa mes a mes (ordenada por estación y
+# fecha, todo con operaciones de arrays) y guarda una tabla compacta de tramos anómalos,
+# una fila por estación, tipo y tramo [desde, hasta]:
+#   estado_constante   las bases no cambian en HORAS_CONSTANTE horas (sensor colgado)
+#   conteo_imposible   dock_bikes + free_bases > total_bases; valor: el mayor exceso
+#   negativo           algún conteo (o in_use) menor que cero; valor: el más negativo
+#   conteo_nulo        el snapshot no trae total_bases, free_bases o dock_bikes
+#   sin_datos          la estación falta en snapshots en los que sí están las demás
+#   salto_coordenadas  la estación se mueve más de SALTO_M metros entre dos snapshots
+# El estado del último tramo de cada estación pasa al mes siguiente, así que un sensor
+# colgado a caballo entre dos meses se detecta igual. El entrenamiento descarta las
+# filas que caen en los tramos de EXCLUIR_ENTRENAMIENTO
+FICHERO_ANOMALIAS = "anomalias.parquet"
+HORAS_CONSTANTE = 48
+MIN_SNAPSHOTS_CONSTANTE = 3
+SALTO_M = 100
+CONTEOS = ["total_bases", "free_bases", "dock_bikes", "in_use"]
+# Columnas que definen el estado para estado_constante
+ESTADO = ["total_bases", "free_bases", "dock_bikes"]
+EXCLUIR_ENTRENAMIENTO = ("estado_constante", "conteo_imposible", "negativo", "conteo_nulo")
+# Tipos cuyo valor es el mínimo del tramo (en el resto, el máximo)
+VALOR_MINIMO = ("negativo",)
+COLUMNAS_TABLA = ["station_id", "tipo", "desde", "hasta", "snapshots", "valor"]
+
+
+def ruta_anomalias(base=CARPETA_DATASET):
+    return os.path.join(base, FICHERO_ANOMALIAS)
+
+
+def _vacia():
+    return pd.DataFrame({"station_id": pd.Series(dtype="int16"), "tipo": pd.Series(dtype="str"),
+                         "desde": pd.Series(dtype="datetime64[us]"), "hasta": pd.Series(dtype="datetime64[us]"),
+                         "snapshots": pd.Series(dtype="int32"), "valor": pd.Series(dtype="float32")})
+
+
+def _tabla(tipo, station_id, desde, hasta, snapshots, valor):
+    return pd.DataFrame({"station_id": np.asarray(station_id, dtype=np.int16), "tipo": tipo,
+                         "desde": np.asarray(desde, dtype="datetime64[us]"),
+                         "hasta": np.asarray(hasta, dtype="datetime64[us]"),
+                         "snapshots": np.asarray(snapshots, dtype=np.int32),
+                         "valor": np.asarray(valor, dtype=np.float32)})
+
+
+def _tramos_marcados(tipo, station_id, timestamp, marcado, valor, agregar=np.maximum):
+    # Filas marcadas consecutivas de una misma estación -> un tramo; valor: el más
+    # extremo del tramo según agregar (máximo, o mínimo para los negativos)
+    filas = np.flatnonzero(marcado)
+    if not len(filas):
+        return None
+    nuevo = np.r_[True, (np.diff(filas) > 1) | (station_id[filas[1:]] != station_id[filas[:-1]])]
+    inicios = np.flatnonzero(nuevo)
+    fines = np.r_[inicios[1:], len(filas)] - 1
+    return _tabla(tipo, station_id[filas[inicios]], timestamp[filas[inicios]], timestamp[filas[fines]],
+                  fines - inicios + 1, agregar.reduceat(valor[filas], inicios))
+
+
+def _inicios_estado(station_id, estado):
+    # Primera fila de cada tramo con el mismo estado: donde cambia la estación o alguna columna
+    return np.flatnonzero(np.r_[True, (station_id[1:] != station_id[:-1]) | (estado[1:] != estado[:-1]).any(axis=1)])
+
+
+def _estado_constante(station_id, timestamp, inicios, peso, horas):
+    fines = np.r_[inicios[1:], len(station_id)] - 1
+    duracion = (timestamp[fines] - timestamp[inicios]) / np.timedelta64(1, "h")
+    snapshots = np.add.reduceat(peso, inicios)
+    colgados = (duracion >= horas) & (snapshots >= MIN_SNAPSHOTS_CONSTANTE)
+    return _tabla("estado_constante", station_id[inicios[colgados]], timestamp[inicios[colgados]],
+                  timestamp[fines[colgados]], snapshots[colgados], duracion[colgados])
+
+
+def _sin_datos(station_id, timestamp, instantes):
+    # Huecos en la posición de cada snapshot de la estación dentro de los del mes
+    posicion = np.searchsorted(instantes, timestamp)
+    hueco = np.flatnonzero((station_id[1:] == station_id[:-1]) & (np.diff(posicion) > 1))
+    faltan = posicion[hueco + 1] - posicion[hueco] - 1
+    return _tabla("sin_datos", station_id[hueco], instantes[posicion[hueco] + 1],
+                  instantes[posicion[hueco + 1] - 1], faltan, faltan)
+
+
+def _saltos(station_id, timestamp, longitude, latitude, salto_m):
+    # Distancia equirectangular entre snapshots consecutivos de la misma estación
+    misma = station_id[1:] == station_id[:-1]
+    latitud = np.radians((latitude[1:] + latitude[:-1]) / 2)
+    dx = np.radians(np.diff(longitude)) * np.cos(latitud) * RADIO_TIERRA_M
+    dy = np.radians(np.diff(latitude)) * RADIO_TIERRA_M
+    distancia = np.r_[0, np.where(misma, np.hypot(dx, dy), 0)]
+    return _tramos_marcados("salto_coordenadas", station_id, timestamp, distancia > salto_m, distancia)
+
+
+def escanear_mes(df, arrastre=None, horas=HORAS_CONSTANTE, salto_m=SALTO_M):
+    # df: station_id, timestamp y las columnas de CONTEOS / coordenadas que tenga la capa.
+    # arrastre: última fila de cada estación del mes anterior, con timestamp = inicio de
+    # su último tramo de estado y peso = snapshots del tramo. Devuelve (anomalías, arrastre)
+    df = df[df["station_id"].notna() & df["timestamp"].notna()]
+    instantes = np.unique(df["timestamp"].to_numpy("datetime64[us]"))
+    df = df.assign(peso=np.int32(1), arrastrada=False)
+    if arrastre is not None and len(arrastre):
+        df = pd.concat([arrastre[arrastre["station_id"].isin(df["station_id"].unique())], df], ignore_index=True)
+    # Se ordenan los arrays y no el DataFrame: es lo que más tarda en un mes completo
+    station_id = df["station_id"].to_numpy(np.int16)
+    timestamp = df["timestamp"].to_numpy("datetime64[us]")
+    orden = np.lexsort((timestamp, station_id))
+    station_id, timestamp = station_id[orden], timestamp[orden]
+    col = {c: df[c].to_numpy()[orden] for c in df.columns if c not in ("station_id", "timestamp")}
+    propias = ~col["arrastrada"].astype(bool)
+    tablas = []
+
+    estado = [c for c in ESTADO if c in col]
+    if estado:
+        inicios = _inicios_estado(station_id, np.column_stack([col[c] for c in estado]))
+        tablas.append(_estado_constante(station_id, timestamp, inicios, col["peso"], horas))
+    if {"dock_bikes", "free_bases", "total_bases"} <= col.keys():
+        # En float: los conteos que faltan llegan como NaN y no cuentan como exceso
+        exceso = col["dock_bikes"].astype(np.float64) + col["free_bases"] - col["total_bases"]
+        tablas.append(_tramos_marcados("conteo_imposible", station_id, timestamp, propias & (exceso > 0), exceso))
+    conteos = [c for c in CONTEOS if c in col]
+    if conteos:
+        minimo = np.fmin.reduce([col[c].astype(np.float64) for c in conteos])
+        tablas.append(_tramos_marcados("negativo", station_id, timestamp, propias & (minimo < 0), minimo, np.minimum))
+    nulos = [c for c in ESTADO if c in col]
+    if nulos:
+        faltan = np.sum([pd.isna(col[c]) for c in nulos], axis=0)
+        tablas.append(_tramos_marcados("conteo_nulo", station_id, timestamp, propias & (faltan > 0), faltan))
+    tablas.append(_sin_datos(station_id[propias], timestamp[propias], instantes))
+    if {"longitude", "latitude"} <= col.keys():
+        tablas.append(_saltos(station_id, timestamp, col["longitude"].astype(np.float64),
+                              col["latitude"].astype(np.float64), salto_m))
+
+    # Arrastre: la última fila de cada estación con el inicio y los snapshots de su último tramo
+    arrastre = None
+    if estado:
+        ultima = np.flatnonzero(np.r_[station_id[1:] != station_id[:-1], True])
+        tramo = np.searchsorted(inicios, ultima, side="right") - 1
+        arrastre = pd.DataFrame({"station_id": station_id[ultima], "timestamp": timestamp[inicios[tramo]],
+                                 **{c: v[ultima] for c, v in col.items()}})
+        arrastre["peso"] = np.add.reduceat(col["peso"], inicios)[tramo]
+        arrastre["arrastrada"] = True
+    tablas = [t for t in tablas if t is not None and len(t)]
+    return (pd.concat(tablas, ignore_index=True) if tablas else _vacia()), arrastre
+
+
+def unir_tramos(anomalias, por=("station_id", "tipo")):
+    # Junta los tramos que se solapan o se tocan (p. ej. un estado constante que ya se
+    # detectó al final del mes anterior y sigue en este)
+    if anomalias.empty:
+        return anomalias
+    por = list(por)
+    anomalias = anomalias.sort_values(por + ["desde"], kind="stable").reset_index(drop=True)
+    otro_grupo = np.r_[True, (anomalias[por].to_numpy()[1:] != anomalias[por].to_numpy()[:-1]).any(axis=1)]
+    # Fin acumulado del grupo hasta la fila anterior: si la fila empieza después, tramo nuevo
+    grupo = otro_grupo.cumsum()
+    fin_anterior = anomalias["hasta"].groupby(grupo).cummax().groupby(grupo).shift()
+    nuevo = otro_grupo | (anomalias["desde"] > fin_anterior).to_numpy()
+    grupos = anomalias.groupby(nuevo.cumsum(), sort=False)
+    unidos = grupos.agg(**{c: (c, "first") for c in por}, desde=("desde", "min"), hasta=("hasta", "max"))
+    if "snapshots" in anomalias.columns:
+        # Los tramos de estado constante se repiten completos (el arrastre vuelve a contar
+        # los snapshots del mes anterior): se queda el más largo. Los demás no comparten
+        # snapshots y se suman
+        repetidos = (unidos["tipo"] == "estado_constante").to_numpy()
+        unidos["snapshots"] = np.where(repetidos, grupos["snapshots"].max(), grupos["snapshots"].sum()).astype("int32")
+        minimo = unidos["tipo"].isin(VALOR_MINIMO).to_numpy()
+        unidos["valor"] = np.where(minimo, grupos["valor"].min(), grupos["valor"].max()).astype("float32")
+    return unidos.reset_index(drop=True)
+
+
+def escanear(capa=CAPA_BRUTA, base=CARPETA_DATASET, horas=HORAS_CONSTANTE, salto_m=SALTO_M):
+    # Todos los meses de la capa, en orden, pasando el arrastre de uno al siguiente
+    disponibles = set(abrir_capa(capa, base).schema.names)
+    columnas = ["timestamp"] + [c for c in ("station_id", "id", *CONTEOS, "longitude", "latitude") if c in disponibles]
+    codigos = leer_estaciones(base).set_index("id")["station_id"] if "station_id" not in disponibles else None
+    partes, arrastre, filas = [], None, 0
+    for year, month in particiones(capa, base):
+        df = leer_capa(capa, columnas=columnas, meses=[(year, month)], base=base)
+        with etapa(f"calidad.{year}-{month:02d}", len(df)) as medida:
+            if codigos is not None:
+                df["station_id"] = df.pop("id").map(codigos)
+            anomalias, arrastre = escanear_mes(df, arrastre, horas, salto_m)
+            medida.salida(len(anomalias))
+        partes.append(anomalias)
+        filas += len(df)
+    anomalias = unir_tramos(pd.concat(partes, ignore_index=True)) if partes else _vacia()
+    return anomalias[COLUMNAS_TABLA], filas
+
+
+def guardar_anomalias(anomalias, base=CARPETA_DATASET):
+    ruta = ruta_anomalias(base)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    anomalias.to_parquet(ruta + ".tmp", index=False)
+    os.replace(ruta + ".tmp", ruta)
+    return ruta
+
+
+def leer_anomalias(base=CARPETA_DATASET):
+    ruta = ruta_anomalias(base)
+    return pd.read_parquet(ruta) if os.path.exists(ruta) else _vacia()
+
+
+def filtrar_anomalias(df, anomalias, tipos=EXCLUIR_ENTRENAMIENTO):
+    # Quita de df (station_id, timestamp) las filas que caen dentro de algún tramo de
+    # esos tipos. Para cada fila basta mirar el último tramo de su estación que empieza
+    # antes que ella (merge_asof), porque los tramos unidos no se solapan
+    tramos = anomalias[anomalias["tipo"].isin(list(tipos))]
+    if tramos.empty or df.empty:
+        return df
+    tramos = unir_tramos(tramos[["station_id", "desde", "hasta"]], por=("station_id",))
+    filas = pd.DataFrame({"station_id": df["station_id"].to_numpy(np.int16),
+                          "timestamp": df["timestamp"].to_numpy("datetime64[us]"),
+                          "fila": np.arange(len(df))}).sort_values("timestamp", kind="stable")
+    tramos = tramos.astype({"station_id": np.int16}).sort_values("desde", kind="stable")
+    unidas = pd.merge_asof(filas, tramos, left_on="timestamp", right_on="desde", by="station_id")
+    dentro = np.zeros(len(df), dtype=bool)
+    dentro[unidas["fila"].to_numpy()] = (unidas["hasta"] >= unidas["timestamp"]).to_numpy()
+    return df[~dentro]
+
+
+def leer_entrenamiento(columnas=None, base=CARPETA_DATASET, excluir=EXCLUIR_ENTRENAMIENTO, **filtros):
+    # Filas de la capa limpia para entrenar (por defecto FEATURES + OBJETIVO) sin las de
+    # los tramos anómalos; filtros: los de leer_capa (meses...)
+    # Sin objetivo (conteos nulos desde la ingesta) tampoco sirven, como en
+    # entrenamiento_lotes y ajuste
+    columnas = list(columnas) if columnas is not None else FEATURES + [OBJETIVO]
+    anomalias = leer_anomalias(base)
+    extra = [c for c in ("station_id", "timestamp", OBJETIVO) if c not in columnas]
+    if not excluir or anomalias.empty:
+        extra = [c for c in extra if c == OBJETIVO]
+    df = leer_capa_con_estaciones(CAPA_LIMPIA, columnas + extra, base=base, **filtros)
+    df = df[df[OBJETIVO].notna()]
+    if excluir and not anomalias.empty:
+        with etapa("calidad.filtrar", len(df)) as medida:
+            df = filtrar_anomalias(df, anomalias, excluir)
+            medida.salida(len(df))
+    return df[columnas]
+
+
+def imprimir_resumen(anomalias):
+    if anomalias.empty:
+        print("✅ Sin anomalías")
+        return
+    resumen = anomalias.groupby("tipo").agg(tramos=("station_id", "size"), estaciones=("station_id", "nunique"),
+                                            snapshots=("snapshots", "sum"))
+    print(f"📊 Anomalías:\n{resumen.to_string()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Control de calidad de los snapshots y tabla de tramos anómalos")
+    parser.add_argument("--capa", default=CAPA_BRUTA, choices=[CAPA_BRUTA, CAPA_FILTRADA, CAPA_LIMPIA],
+                        help="Capa a revisar (la limpia no tiene coordenadas por snapshot)")
+    parser.add_argument("--horas-constante", type=float, default=HORAS_CONSTANTE,
+                        help="Horas sin cambios para considerar una estación colgada")
+    parser.add_argument("--salto-m", type=float, default=SALTO_M, help="Metros de salto de coordenadas")
+    parser.add_argument("--base", default=CARPETA_DATASET)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    anomalias, filas = escanear(args.capa, args.base, args.horas_constante, args.salto_m)
+    ruta = guardar_anomalias(anomalias, args.base)
+    imprimir_resumen(anomalias)
+    print(f"✅ {len(anomalias)} tramos de {filas} filas en {time.perf_counter() - inicio:.1f} s: {ruta}")
@@ -0,0 +1,155 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+from almacen import CAPA_CAMBIOS, CAPA_INSTANTES, CARPETA_DATASET, escribir_capa, leer_capa, particiones
+from esquema import COLUMNAS_ESTACION
+from estaciones import actualizar_estaciones, leer_estaciones
+from ingesta import expandir_entradas, extremos_fichero, leer_json_por_bloques
+from instrumentacion import etapa
+
+# Almacenamiento por cambios: de cada estación solo se guarda una fila cuando su estado
+# cambia (o en el primer snapshot del mes), con la fecha desde la que vale. Junto con la
+# lista de fechas de todos los snapshots (capa de instantes) se reconstruye la serie
+# completa: cada cambio se repite hasta el siguiente (run-length). Nombre, dirección y
+# coordenadas están en la tabla de estaciones
+ESTADO = ["activate", "no_available", "light", "reservations_count", "total_bases", "free_bases", "dock_bikes"]
+
+
+def codificar_cambios(df):
+    # df: station_id, timestamp y columnas de ESTADO de un mes. Devuelve las filas en las
+    # que cambia el estado; si una estación falta en algún snapshot se añade una fila con
+    # presente=False en el primero en que falta, para que la reconstrucción sea exacta
+    instantes = np.unique(df["timestamp"].to_numpy())
+    # Un snapshot con algún conteo nulo (desde la ingesta) no es un estado: la estación
+    # queda como ausente en él. El resto vuelve a los enteros del esquema
+    df = df[df[ESTADO].notna().all(axis=1)]
+    df = df.astype({col: COLUMNAS_ESTACION[col] for col in ESTADO})
+    df = df.sort_values(["station_id", "timestamp"], kind="stable")
+    station_id = df["station_id"].to_numpy()
+    posicion = np.searchsorted(instantes, df["timestamp"].to_numpy())
+    estado = df[ESTADO].to_numpy()
+
+    misma = np.r_[False, station_id[1:] == station_id[:-1]]
+    hueco = misma & np.r_[False, np.diff(posicion) > 1]
+    distinto = np.r_[True, (estado[1:] != estado[:-1]).any(axis=1)]
+    cambios = df[~misma | distinto | hueco].assign(presente=True)
+
+    # Ausencias: tras un hueco y tras el último snapshot de cada estación si no es el del mes
+    ultima = np.r_[~misma[1:], True] & (posicion < len(instantes) - 1)
+    tras_hueco = np.flatnonzero(hueco) - 1
+    filas = np.r_[tras_hueco, np.flatnonzero(ultima)]
+    ausencias = pd.DataFrame({
+        "station_id": station_id[filas],
+        "timestamp": instantes[posicion[filas] + 1],
+        **{col: np.zeros(len(filas), dtype=df[col].dtype) for col in ESTADO},
+        "presente": False,
+    })
+    cambios = pd.concat([cambios, ausencias], ignore_index=True) if len(ausencias) else cambios
+    cambios = cambios.sort_values(["station_id", "timestamp"], kind="stable").reset_index(drop=True)
+    return cambios, instantes
+
+
+def reconstruir(cambios, instantes):
+    # Serie completa (una fila por estación y snapshot de `instantes`) a partir de los
+    # cambios. Los cambios anteriores al primer instante valen desde el principio, así
+    # que basta con pasar los instantes del rango que se quiera
+    instantes = np.asarray(instantes)
+    cambios = cambios.sort_values(["station_id", "timestamp"], kind="stable")
+    station_id = cambios["station_id"].to_numpy()
+    inicio = np.searchsorted(instantes, cambios["timestamp"].to_numpy())
+    sigue = np.r_[station_id[1:] == station_id[:-1], False]
+    fin = np.where(sigue, np.r_[inicio[1:], 0], len(instantes))
+    largo = np.maximum(fin - inicio, 0)
+
+    valido = cambios["presente"].to_numpy() & (largo > 0)
+    filas, inicio, largo = np.flatnonzero(valido), inicio[valido], largo[valido]
+    total = int(largo.sum())
+    repetidas = np.repeat(filas, largo)
+    # Posición en `instantes` de cada fila: inicio de su tramo + desplazamiento dentro de él
+    posicion = np.arange(total) - np.repeat(np.cumsum(largo) - largo, largo) + np.repeat(inicio, largo)
+
+    serie = cambios.iloc[repetidas].drop(columns="presente").reset_index(drop=True)
+    serie["timestamp"] = instantes[posicion]
+    return serie
+
+
+def leer_series(desde=None, hasta=None, station_ids=None, base=CARPETA_DATASET):
+    # Reconstruye las series de [desde, hasta) mes a mes, leyendo solo los cambios del
+    # mes (cada mes empieza con el estado completo) anteriores a `hasta`
+    desde = pd.Timestamp(desde) if desde is not None else None
+    hasta = pd.Timestamp(hasta) if hasta is not None else None
+    partes = []
+    for year, month in particiones(CAPA_INSTANTES, base):
+        inicio_mes = pd.Timestamp(year, month, 1)
+        if (hasta is not None and inicio_mes >= hasta) or (desde is not None and inicio_mes + pd.offsets.MonthBegin() <= desde):
+            continue
+        instantes = leer_capa(CAPA_INSTANTES, meses=[(year, month)], base=base)["timestamp"].sort_values().to_numpy()
+        if desde is not None:
+            instantes = instantes[instantes >= desde.to_datetime64()]
+        if hasta is not None:
+            instantes = instantes[instantes < hasta.to_datetime64()]
+        filtro = None
+        if hasta is not None:
+            filtro = ds.field("timestamp") < hasta.to_datetime64()
+        if station_ids is not None:
+            por_estacion = ds.field("station_id").isin(list(station_ids))
+            filtro = por_estacion if filtro is None else filtro & por_estacion
+        cambios = leer_capa(CAPA_CAMBIOS, meses=[(year, month)], filtro=filtro, base=base)
+        partes.append(reconstruir(cambios, instantes))
+    if not partes:
+        return pd.DataFrame(columns=["station_id", "timestamp"] + ESTADO)
+    return pd.concat(partes, ignore_index=True)
+
+
+def _guardar_mes(df, base):
+    with etapa("cambios.codificar", len(df)) as medida:
+        cambios, instantes = codificar_cambios(df)
+        medida.salida(len(cambios))
+    escribir_capa(cambios, CAPA_CAMBIOS, base)
+    escribir_capa(pd.DataFrame({"timestamp": instantes}), CAPA_INSTANTES, base)
+    return len(cambios)
+
+
+def ingestar_cambios(entradas, base=CARPETA_DATASET):
+    # Lee todos los snapshots de los JSON y guarda sus cambios. Los meses se guardan en
+    # cuanto ningún fichero posterior puede tener datos suyos (los ficheros suelen ser mensuales)
+    ficheros = expandir_entradas(entradas)
+    primeras = {f: extremos_fichero(f)[0] for f in ficheros}
+    ficheros = sorted(ficheros, key=lambda f: primeras[f] or pd.Timestamp.max)
+    codigos = leer_estaciones(base).set_index("id")["station_id"]
+    pendientes = {}
+    snapshots = cambios = 0
+
+    for n, input_file in enumerate(ficheros):
+        for bloque in leer_json_por_bloques(input_file):
+            bloque = bloque[bloque["timestamp"].notna()]
+            if not bloque["id"].isin(codigos.index).all():
+                codigos = actualizar_estaciones(bloque, base).set_index("id")["station_id"]
+            compacto = bloque[["timestamp"] + ESTADO].assign(station_id=bloque["id"].map(codigos).astype("int16"))
+            ts = compacto["timestamp"]
+            for mes, parte in compacto.groupby([ts.dt.year, ts.dt.month]):
+                pendientes.setdefault(mes, []).append(parte)
+            snapshots += len(compacto)
+
+        siguiente = primeras[ficheros[n + 1]] if n + 1 < len(ficheros) else None
+        for mes in sorted(pendientes):
+            if siguiente is None or mes < (siguiente.year, siguiente.month):
+                cambios += _guardar_mes(pd.concat(pendientes.pop(mes), ignore_index=True), base)
+                print(f"✅ Cambios de {mes[0]}-{mes[1]:02d} guardados")
+
+    if snapshots:
+        print(f"📊 {snapshots} filas de snapshots -> {cambios} cambios (x{snapshots / max(cambios, 1):.1f} menos)")
+    return {"snapshots": snapshots, "cambios": cambios}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Guarda los snapshots de BiciMAD como cambios de estado")
+    parser.add_argument("entradas", nargs="*", default=["C:/Final_Prog/Input"],
+                        help="Ficheros .json, carpetas o patrones glob")
+    parser.add_argument("--base", default=CARPETA_DATASET)
+    args = parser.parse_args()
+
+    ingestar_cambios(args.entradas, args.base)
@@ -0,0 +1,105 @@
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+
+import numpy as np
+
+from prediccion import ESCENARIOS
+
+# Prueba de carga local del servidor de predicción: varios clientes con conexión
+# persistente lanzan consultas durante un tiempo y se mide latencia y rendimiento
+
+
+def station_ids_servidor(host, puerto):
+    conexion = http.client.HTTPConnection(host, puerto, timeout=30)
+    conexion.request("GET", "/estaciones")
+    station_ids = json.loads(conexion.getresponse().read())["station_ids"]
+    conexion.close()
+    return station_ids
+
+
+def cliente(host, puerto, ruta, station_ids, tam_lote, fin, latencias, errores):
+    conexion = http.client.HTTPConnection(host, puerto, timeout=30)
+    aleatorio = random.Random()
+    while time.perf_counter() < fin:
+        consultas = []
+        for _ in range(tam_lote):
+            temperatura, lluvia, estacion = aleatorio.choice(ESCENARIOS)
+            consultas.append({"station_id": aleatorio.choice(station_ids), "day": aleatorio.randint(1, 31),
+                              "weekday": aleatorio.randint(0, 6), "temperatura": temperatura,
+                              "lluvia": lluvia, "estacion": estacion})
+        cuerpo = json.dumps(consultas[0] if ruta == "/predecir" else {"consultas": consultas})
+        inicio = time.perf_counter()
+        try:
+            conexion.request("POST", ruta, cuerpo, {"Content-Type": "application/json"})
+            respuesta = conexion.getresponse()
+            respuesta.read()
+            if respuesta.status != 200:
+                errores.append(respuesta.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errores.append(str(e))
+            conexion.close()
+            conexion = http.client.HTTPConnection(host, puerto, timeout=30)
+            continue
+        latencias.append(time.perf_counter() - inicio)
+    conexion.close()
+
+
+def prueba_carga(host="127.0.0.1", puerto=8000, clientes=16, segundos=10, tam_lote=1, station_ids=None):
+    ruta = "/predecir" if tam_lote == 1 else "/predecir_lote"
+    station_ids = list(station_ids) if station_ids is not None else station_ids_servidor(host, puerto)
+    latencias, errores = [], []
+    fin = time.perf_counter() + segundos
+    hilos = [threading.Thread(target=cliente, args=(host, puerto, ruta, station_ids, tam_lote, fin, latencias, errores))
+             for _ in range(clientes)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    ms = np.array(latencias) * 1000
+    peticiones = len(latencias)
+    return {
+        "clientes": clientes,
+        "tam_lote": tam_lote,
+        "peticiones": peticiones,
+        "errores": len(errores),
+        "segundos": round(duracion, 2),
+        "peticiones_por_segundo": round(peticiones / duracion, 1),
+        "predicciones_por_segundo": round(peticiones * tam_lote / duracion, 1),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2) if peticiones else None,
+        "p99_ms": round(float(np.percentile(ms, 99)), 2) if peticiones else None,
+        "max_ms": round(float(ms.max()), 2) if peticiones else None,
+    }
+
+
+def imprimir_resultado(resultado):
+    print(f"📊 {resultado['peticiones']} peticiones en {resultado['segundos']} s "
+          f"({resultado['clientes']} clientes, {resultado['tam_lote']} consultas por petición, "
+          f"{resultado['errores']} errores)")
+    print(f"   Rendimiento: {resultado['peticiones_por_segundo']} peticiones/s, "
+          f"{resultado['predicciones_por_segundo']} predicciones/s")
+    print(f"   Latencia: p50 {resultado['p50_ms']} ms, p99 {resultado['p99_ms']} ms, máx {resultado['max_ms']} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga del servidor de predicción")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8000)
+    parser.add_argument("--clientes", type=int, default=16, help="Clientes concurrentes")
+    parser.add_argument("--segundos", type=float, default=10)
+    parser.add_argument("--lote", type=int, default=1, help="Consultas por petición (1 = /predecir)")
+    parser.add_argument("--json", help="Guardar el resultado en este fichero")
+    args = parser.parse_args()
+
+    resultado = prueba_carga(args.host, args.puerto, args.clientes, args.segundos, args.lote)
+    imprimir_resultado(resultado)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
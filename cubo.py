@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from almacen import CARPETA_DATASET
+from estaciones import actualizar_estaciones, leer_estaciones
+from ingesta import expandir_entradas, extremos_fichero, leer_json_por_bloques
+from instrumentacion import etapa
+
+# Cubo estaciones x franjas de tiempo x métricas con todos los snapshots (no solo los de
+# las 14h) remuestreados a una rejilla fija. Se guarda como un array binario que se abre
+# con np.memmap: la serie de una estación o el estado de todas en un instante son vistas
+# del fichero, sin cargar nada en pandas. La fila de cada estación es su station_id
+CARPETA_CUBO = "cubo"
+METRICAS = ("dock_bikes", "free_bases", "in_use")
+FALTA = -1                  # franja sin ningún snapshot
+TIPO = np.int16
+RESERVA_ESTACIONES = 64     # filas libres para estaciones nuevas antes de tener que ampliar
+
+
+def _inicio_mes(fecha):
+    return datetime(fecha.year, fecha.month, 1)
+
+
+def _mes_siguiente(fecha):
+    return datetime(fecha.year + 1, 1, 1) if fecha.month == 12 else datetime(fecha.year, fecha.month + 1, 1)
+
+
+class CuboEstaciones:
+
+    def __init__(self, carpeta, paso_minutos=15, modo="r"):
+        self.carpeta = carpeta
+        self.ruta_meta = os.path.join(carpeta, f"cubo_{paso_minutos}min.json")
+        self.ruta_datos = os.path.join(carpeta, f"cubo_{paso_minutos}min.dat")
+        with open(self.ruta_meta, encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.inicio = np.datetime64(self.meta["inicio"], "m")
+        self.paso = np.timedelta64(self.meta["paso_minutos"], "m")
+        self.datos = np.memmap(self.ruta_datos, dtype=self.meta["tipo"], mode=modo,
+                               shape=(self.meta["capacidad"], self.meta["franjas"], len(self.meta["metricas"])))
+
+    @classmethod
+    def crear(cls, carpeta, inicio, fin, paso_minutos=15, capacidad=RESERVA_ESTACIONES):
+        os.makedirs(carpeta, exist_ok=True)
+        franjas = int((np.datetime64(fin, "m") - np.datetime64(inicio, "m")) // np.timedelta64(paso_minutos, "m"))
+        meta = {"inicio": str(np.datetime64(inicio, "m")), "paso_minutos": paso_minutos, "franjas": franjas,
+                "capacidad": int(capacidad), "metricas": list(METRICAS), "tipo": np.dtype(TIPO).name, "falta": FALTA}
+        ruta_datos = os.path.join(carpeta, f"cubo_{paso_minutos}min.dat")
+        datos = np.memmap(ruta_datos, dtype=TIPO, mode="w+", shape=(capacidad, franjas, len(METRICAS)))
+        for s in range(capacidad):
+            datos[s] = FALTA
+        datos.flush()
+        del datos
+        with open(os.path.join(carpeta, f"cubo_{paso_minutos}min.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        return cls(carpeta, paso_minutos, modo="r+")
+
+    @property
+    def fin(self):
+        return self.inicio + self.paso * self.meta["franjas"]
+
+    def franja(self, fecha):
+        return int((np.datetime64(fecha, "m") - self.inicio) // self.paso)
+
+    def tiempos(self):
+        return self.inicio + self.paso * np.arange(self.meta["franjas"])
+
+    def metrica(self, nombre):
+        return self.meta["metricas"].index(nombre)
+
+    # Vistas sobre el fichero (no copian datos)
+
+    def estacion(self, station_id, desde=None, hasta=None):
+        # (franjas, métricas) de una estación entre dos fechas
+        ini = self.franja(desde) if desde is not None else 0
+        fin = self.franja(hasta) if hasta is not None else self.meta["franjas"]
+        return self.datos[int(station_id), ini:fin]
+
+    def instante(self, fecha):
+        # (estaciones, métricas) de todas las estaciones en la franja de esa fecha
+        return self.datos[:, self.franja(fecha)]
+
+    def serie(self, station_id, metrica="in_use"):
+        return self.datos[int(station_id), :, self.metrica(metrica)]
+
+    def a_dataframe(self, station_id, desde=None, hasta=None):
+        # Copia en formato largo de una estación, para análisis puntuales
+        ini = self.franja(desde) if desde is not None else 0
+        vista = self.estacion(station_id, desde, hasta)
+        df = pd.DataFrame(np.asarray(vista), columns=self.meta["metricas"])
+        df.insert(0, "timestamp", self.tiempos()[ini:ini + len(df)])
+        return df.replace(FALTA, np.nan)
+
+    # Escritura
+
+    def escribir(self, station_ids, fechas, valores):
+        # Cada snapshot va a la franja que lo contiene; si hay varios en la misma franja se
+        # queda el último (los bloques llegan en orden de fecha)
+        franjas = ((fechas.astype("datetime64[m]") - self.inicio) // self.paso).astype(np.int64)
+        dentro = (franjas >= 0) & (franjas < self.meta["franjas"])
+        station_ids, franjas, valores = station_ids[dentro], franjas[dentro], valores[dentro]
+        plano = station_ids.astype(np.int64) * self.meta["franjas"] + franjas
+        _, ultimos = np.unique(plano[::-1], return_index=True)
+        ultimos = len(plano) - 1 - ultimos
+        self.datos[station_ids[ultimos], franjas[ultimos]] = valores[ultimos]
+        return len(ultimos)
+
+    def rellenar_huecos(self, max_franjas=None):
+        # Las franjas sin snapshot toman el último valor conocido de la estación (como
+        # mucho max_franjas seguidas); las anteriores al primer snapshot siguen sin valor
+        posiciones = np.arange(self.meta["franjas"])
+        for s in range(self.meta["capacidad"]):
+            fila = self.datos[s]
+            conocido = fila[:, 0] != FALTA
+            if conocido.all() or not conocido.any():
+                continue
+            origen = np.maximum.accumulate(np.where(conocido, posiciones, 0))
+            if max_franjas is not None:
+                origen = np.where(posiciones - origen <= max_franjas, origen, posiciones)
+            fila[:] = fila[origen]
+
+    def flush(self):
+        self.datos.flush()
+
+    def cerrar(self):
+        # Libera el mapeo del fichero (en Windows no se puede sustituir mientras esté abierto)
+        self.datos.flush()
+        del self.datos
+
+
+def _redimensionar(cubo, capacidad, inicio, fin):
+    # Crea un cubo con más estaciones y/o un rango de fechas mayor y copia el actual
+    # (el rango nuevo siempre incluye el que ya tenía)
+    carpeta, paso = cubo.carpeta, cubo.meta["paso_minutos"]
+    inicio = min(inicio, cubo.inicio.astype(datetime))
+    fin = max(fin, cubo.fin.astype(datetime))
+    capacidad = max(capacidad, cubo.meta["capacidad"])
+    temporal = os.path.join(carpeta, "_nuevo")
+    nuevo = CuboEstaciones.crear(temporal, inicio, fin, paso, capacidad)
+    desplazamiento = nuevo.franja(cubo.inicio.astype(datetime))
+    franjas = cubo.meta["franjas"]
+    for s in range(cubo.meta["capacidad"]):
+        nuevo.datos[s, desplazamiento:desplazamiento + franjas] = cubo.datos[s]
+    nuevo.cerrar()
+    cubo.cerrar()
+    for ruta in (f"cubo_{paso}min.dat", f"cubo_{paso}min.json"):
+        os.replace(os.path.join(temporal, ruta), os.path.join(carpeta, ruta))
+    os.rmdir(temporal)
+    return CuboEstaciones(carpeta, paso, modo="r+")
+
+
+def abrir_o_crear(carpeta, inicio, fin, paso_minutos, estaciones_necesarias):
+    # Abre el cubo si existe, ampliándolo si no cubre las fechas o las estaciones
+    if not os.path.exists(os.path.join(carpeta, f"cubo_{paso_minutos}min.json")):
+        return CuboEstaciones.crear(carpeta, inicio, fin, paso_minutos, estaciones_necesarias + RESERVA_ESTACIONES)
+    cubo = CuboEstaciones(carpeta, paso_minutos, modo="r+")
+    actual_inicio, actual_fin = cubo.inicio.astype(datetime), cubo.fin.astype(datetime)
+    if inicio >= actual_inicio and fin <= actual_fin and estaciones_necesarias <= cubo.meta["capacidad"]:
+        return cubo
+    capacidad = max(cubo.meta["capacidad"], estaciones_necesarias + RESERVA_ESTACIONES)
+    print(f"⚠️ Ampliando el cubo a {capacidad} estaciones y {min(inicio, actual_inicio)} - {max(fin, actual_fin)}")
+    return _redimensionar(cubo, capacidad, inicio, fin)
+
+
+def ingestar_cubo(entradas, base=CARPETA_DATASET, paso_minutos=15):
+    # Lee todos los snapshots de los JSON y los coloca en el cubo de la base
+    ficheros = expandir_entradas(entradas)
+    extremos = [extremos_fichero(f) for f in ficheros]
+    fechas = [fecha for par in extremos for fecha in par if fecha is not None]
+    if not fechas:
+        print(f"❌ No se encontraron snapshots en {entradas}")
+        return None
+    inicio, fin = _inicio_mes(min(fechas)), _mes_siguiente(max(fechas))
+
+    carpeta = os.path.join(base, CARPETA_CUBO)
+    cubo = abrir_o_crear(carpeta, inicio, fin, paso_minutos, len(leer_estaciones(base)))
+    codigos = leer_estaciones(base).set_index("id")["station_id"]
+    escritas = 0
+
+    with etapa(f"cubo.{paso_minutos}min") as medida:
+        for input_file in ficheros:
+            for bloque in leer_json_por_bloques(input_file):
+                bloque = bloque[bloque["timestamp"].notna()]
+                if not bloque["id"].isin(codigos.index).all():
+                    codigos = actualizar_estaciones(bloque, base).set_index("id")["station_id"]
+                    if codigos.max() >= cubo.meta["capacidad"]:
+                        cubo = _redimensionar(cubo, len(codigos) + RESERVA_ESTACIONES, inicio, fin)
+                station_ids = bloque["id"].map(codigos).to_numpy(np.int64)
+                valores = np.column_stack([bloque["dock_bikes"], bloque["free_bases"],
+                                           bloque["total_bases"] - bloque["free_bases"]]
+                                          ).astype(np.float64)
+                # Conteos nulos desde la ingesta: FALTA, como una franja sin snapshot
+                valores = np.where(np.isnan(valores), FALTA, valores).astype(TIPO)
+                escritas += cubo.escribir(station_ids, bloque["timestamp"].to_numpy(), valores)
+            print(f"✅ {os.path.basename(input_file)} añadido al cubo")
+        medida.salida(escritas)
+    cubo.flush()
+    print(f"✅ Cubo {cubo.ruta_datos}: {cubo.datos.shape} ({cubo.datos.nbytes / 1024 ** 2:.0f} MB)")
+    return cubo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingesta de todos los snapshots al cubo estaciones x tiempo")
+    parser.add_argument("entradas", nargs="*", default=["C:/Final_Prog/Input"],
+                        help="Ficheros .json, carpetas o patrones glob")
+    parser.add_argument("--paso", type=int, default=15, help="Minutos de cada franja de la rejilla")
+    parser.add_argument("--rellenar", type=int, metavar="FRANJAS",
+                        help="Rellenar huecos con el último valor conocido (como mucho estas franjas seguidas)")
+    parser.add_argument("--base", default=CARPETA_DATASET)
+    args = parser.parse_args()
+
+    cubo = ingestar_cubo(args.entradas, args.base, args.paso)
+    if cubo is not None and args.rellenar:
+        cubo.rellenar_huecos(args.rellenar)
+        cubo.flush()
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Generador de ficheros JSON-lines con el mismo formato que los de BiciMAD: una línea por
+# snapshot con su "_id" (fecha) y la lista "stations". La ocupación sigue un patrón diario
+# y semanal por estación para que los modelos tengan algo que aprender
+
+CENTRO = (-3.7038, 40.4168)     # Puerta del Sol
+RADIO_GRADOS = 0.05
+
+
+def _meses(desde, n_meses):
+    year, month = desde
+    for _ in range(n_meses):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+class GeneradorEstaciones:
+
+    def __init__(self, n_estaciones=264, semilla=42):
+        rng = np.random.default_rng(semilla)
+        self.rng = rng
+        self.n = n_estaciones
+        self.ids = np.arange(1, n_estaciones + 1)
+        self.total_bases = rng.choice([15, 18, 21, 24, 24, 24, 27, 30], n_estaciones)
+        self.longitude = CENTRO[0] + rng.uniform(-RADIO_GRADOS, RADIO_GRADOS, n_estaciones)
+        self.latitude = CENTRO[1] + rng.uniform(-RADIO_GRADOS, RADIO_GRADOS, n_estaciones)
+        # Ocupación media, amplitud del ciclo diario y hora punta de cada estación
+        self.ocupacion = rng.uniform(0.2, 0.7, n_estaciones)
+        self.amplitud = rng.uniform(0.05, 0.3, n_estaciones)
+        self.hora_punta = rng.uniform(7, 20, n_estaciones)
+
+    def snapshot(self, fecha):
+        hora = fecha.hour + fecha.minute / 60
+        ciclo = np.cos((hora - self.hora_punta) / 24 * 2 * np.pi)
+        fin_de_semana = -0.1 if fecha.weekday() >= 5 else 0.0
+        ocupacion = np.clip(self.ocupacion + self.amplitud * ciclo + fin_de_semana
+                            + self.rng.normal(0, 0.05, self.n), 0, 1)
+        no_available = (self.rng.random(self.n) < 0.01).astype(int)
+        dock_bikes = np.rint(ocupacion * self.total_bases).astype(int)
+        free_bases = np.maximum(self.total_bases - dock_bikes - self.rng.binomial(2, 0.1, self.n), 0)
+        light = np.digitize(ocupacion, [0.25, 0.5, 0.75])
+
+        stations = [{
+            "activate": 1 - int(no_available[i]),
+            "name": f"{i + 1} - Estación {i + 1}",
+            "reservations_count": 0,
+            "light": int(light[i]),
+            "total_bases": int(self.total_bases[i]),
+            "free_bases": int(free_bases[i]),
+            "number": f"{i + 1}",
+            "longitude": f"{self.longitude[i]:.7f}",
+            "no_available": int(no_available[i]),
+            "address": f"Calle Sintética, nº {i + 1}",
+            "latitude": f"{self.latitude[i]:.7f}",
+            "dock_bikes": int(dock_bikes[i]),
+            "id": int(self.ids[i]),
+        } for i in range(self.n)]
+        return {"_id": fecha.isoformat(timespec="microseconds"), "stations": stations}
+
+
+def generar_mes(ruta, generador, year, month, minutos=15):
+    # Un snapshot cada `minutos` minutos (con unos segundos de retraso, como los reales)
+    fecha = datetime(year, month, 1)
+    fin = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    lineas = 0
+    with open(ruta, "w", encoding="utf-8") as f:
+        while fecha < fin:
+            retraso = timedelta(seconds=int(generador.rng.integers(0, 60)),
+                                microseconds=int(generador.rng.integers(0, 1_000_000)))
+            f.write(json.dumps(generador.snapshot(fecha + retraso)) + "\n")
+            fecha += timedelta(minutes=minutos)
+            lineas += 1
+    return lineas
+
+
+def generar(carpeta, n_estaciones=264, minutos=15, n_meses=1, desde=(2022, 5), semilla=42):
+    # Escribe un fichero YYYYMM.json por mes y devuelve sus rutas
+    os.makedirs(carpeta, exist_ok=True)
+    generador = GeneradorEstaciones(n_estaciones, semilla)
+    rutas = []
+    for year, month in _meses(desde, n_meses):
+        ruta = os.path.join(carpeta, f"{year}{month:02d}.json")
+        lineas = generar_mes(ruta, generador, year, month, minutos)
+        print(f"✅ {ruta}: {lineas} snapshots x {n_estaciones} estaciones")
+        rutas.append(ruta)
+    return rutas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera datos sintéticos con el formato de BiciMAD")
+    parser.add_argument("carpeta")
+    parser.add_argument("--estaciones", type=int, default=264)
+    parser.add_argument("--minutos", type=int, default=15, help="Minutos entre snapshots")
+    parser.add_argument("--meses", type=int, default=1)
+    parser.add_argument("--desde", default="2022-05", help="Primer mes (YYYY-MM)")
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    year, month = map(int, args.desde.split("-"))
+    generar(args.carpeta, args.estaciones, args.minutos, args.meses, (year, month), args.semilla)
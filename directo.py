@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from almacen import CAPA_BRUTA, CAPA_LIMPIA, CARPETA_DATASET, CARPETA_SALIDA, EscritorParticionado, leer_capa, particiones
+from estaciones import actualizar_estaciones, leer_estaciones
+from ingesta import (VENTANA_14H, añadir_argumentos_ventana, expandir_entradas, leer_json_por_bloques,
+                     ventana_desde_argumentos)
+from instrumentacion import etapa
+
+# Modo en directo: sigue uno o varios ficheros JSON-lines que van creciendo (o una
+# carpeta en la que van apareciendo ficheros) y procesa solo las líneas nuevas. Los
+# snapshots de la ventana se añaden a la capa bruta y todos actualizan las medias de
+# in_use de cada estación (global y por día de la semana x hora) sumando en su celda,
+# sin recalcular nada. El estado (medias y hasta dónde se ha leído cada fichero) se
+# guarda tras cada sondeo y la app lee de él la media histórica
+ESTADO_PATH = os.path.join(CARPETA_SALIDA, "directo_estado.npz")
+INTERVALO = 5.0     # segundos entre sondeos
+HORAS = 24
+
+
+class MediasEstacion:
+    # Sumas y conteos de in_use por station_id; las medias se calculan al pedirlas
+
+    def __init__(self, capacidad=0):
+        self.suma = np.zeros(capacidad)
+        self.n = np.zeros(capacidad, dtype=np.int64)
+        self.suma_franja = np.zeros((capacidad, 7, HORAS))
+        self.n_franja = np.zeros((capacidad, 7, HORAS), dtype=np.int64)
+        self.nombres = np.full(capacidad, "", dtype=object)
+
+    def _ampliar(self, capacidad):
+        extra = capacidad - len(self.n)
+        if extra <= 0:
+            return
+        self.suma = np.concatenate([self.suma, np.zeros(extra)])
+        self.n = np.concatenate([self.n, np.zeros(extra, dtype=np.int64)])
+        self.suma_franja = np.concatenate([self.suma_franja, np.zeros((extra, 7, HORAS))])
+        self.n_franja = np.concatenate([self.n_franja, np.zeros((extra, 7, HORAS), dtype=np.int64)])
+        self.nombres = np.concatenate([self.nombres, np.full(extra, "", dtype=object)])
+
+    def añadir(self, station_ids, timestamps, in_use, en_ventana=None):
+        # Cada registro suma en la celda de su estación (y de su día de la semana y hora).
+        # La media global solo cuenta los de la ventana, como la del paquete de servicio
+        station_ids = np.asarray(station_ids, dtype=np.intp)
+        in_use = np.asarray(in_use, dtype=np.float64)
+        ts = pd.DatetimeIndex(timestamps)
+        # Snapshots sin conteos (nulos desde la ingesta): no suman ni cuentan
+        validos = ~np.isnan(in_use)
+        if not validos.all():
+            station_ids, in_use, ts = station_ids[validos], in_use[validos], ts[validos]
+            if en_ventana is not None:
+                en_ventana = np.asarray(en_ventana)[validos]
+        if not len(station_ids):
+            return
+        self._ampliar(int(station_ids.max()) + 1)
+        franja = (station_ids, ts.dayofweek.to_numpy(), ts.hour.to_numpy())
+        np.add.at(self.suma_franja, franja, in_use)
+        np.add.at(self.n_franja, franja, 1)
+        if en_ventana is not None:
+            station_ids, in_use = station_ids[en_ventana], in_use[en_ventana]
+        np.add.at(self.suma, station_ids, in_use)
+        np.add.at(self.n, station_ids, 1)
+
+    def poner_nombres(self, estaciones):
+        self._ampliar(int(estaciones["station_id"].max()) + 1)
+        self.nombres[estaciones["station_id"].to_numpy()] = estaciones["name"].astype(str).to_numpy()
+
+    def medias(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.n > 0, self.suma / self.n, np.nan)
+
+    def medias_franja(self):
+        # (estaciones, 7, 24); NaN en las franjas sin ningún registro
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.n_franja > 0, self.suma_franja / self.n_franja, np.nan)
+
+    def media_por_estacion(self):
+        # Igual que mean_usage del paquete: {station_id: media} de las estaciones con datos
+        medias = self.medias()
+        return {int(s): float(medias[s]) for s in np.flatnonzero(~np.isnan(medias))}
+
+    @classmethod
+    def desde_capa(cls, base=CARPETA_DATASET):
+        # Punto de partida: lo que ya hay en la capa limpia
+        medias = cls()
+        if particiones(CAPA_LIMPIA, base):
+            df = leer_capa(CAPA_LIMPIA, columnas=["station_id", "timestamp", "in_use"], base=base)
+            df = df[df["in_use"].notna()]
+            medias.añadir(df["station_id"].to_numpy(), df["timestamp"], df["in_use"].to_numpy())
+        estaciones = leer_estaciones(base)
+        if len(estaciones):
+            medias.poner_nombres(estaciones)
+        return medias
+
+
+def guardar_estado(medias, posiciones, ruta=ESTADO_PATH):
+    # Medias y posiciones en un solo fichero, sustituido de forma atómica: nunca quedan
+    # unas medias que no correspondan a las posiciones guardadas
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = ruta + ".tmp.npz"
+    np.savez(temporal, suma=medias.suma, n=medias.n, suma_franja=medias.suma_franja, n_franja=medias.n_franja,
+             nombres=medias.nombres.astype(str), posiciones=np.array(json.dumps(posiciones)))
+    os.replace(temporal, ruta)
+
+
+def cargar_estado(ruta=ESTADO_PATH):
+    with np.load(ruta) as datos:
+        medias = MediasEstacion()
+        medias.suma, medias.n = datos["suma"], datos["n"]
+        medias.suma_franja, medias.n_franja = datos["suma_franja"], datos["n_franja"]
+        medias.nombres = datos["nombres"].astype(object)
+        return medias, json.loads(str(datos["posiciones"]))
+
+
+def fin_lineas_completas(ruta, posicion):
+    # Posición tras la última línea completa del fichero: una línea a medio escribir
+    # se deja para el siguiente sondeo. Se busca el salto de línea desde el final
+    tamaño = os.path.getsize(ruta)
+    paso = 1 << 16
+    with open(ruta, "rb") as f:
+        fin = tamaño
+        while fin > posicion:
+            inicio = max(posicion, fin - paso)
+            f.seek(inicio)
+            salto = f.read(fin - inicio).rfind(b"\n")
+            if salto >= 0:
+                return inicio + salto + 1
+            fin = inicio
+    return posicion
+
+
+class SeguidorDirecto:
+
+    def __init__(self, entradas, base=CARPETA_DATASET, ventana=VENTANA_14H, estado=ESTADO_PATH, desde_inicio=False):
+        self.entradas = entradas
+        self.base = base
+        self.ventana = ventana
+        self.estado = estado
+        self.registros = 0
+        if os.path.exists(estado):
+            self.medias, self.posiciones = cargar_estado(estado)
+        else:
+            self.medias, self.posiciones = MediasEstacion.desde_capa(base), {}
+            # Al arrancar por primera vez los ficheros que ya existen se siguen desde su
+            # final (su histórico es cosa del pipeline), salvo desde_inicio
+            if not desde_inicio:
+                self.posiciones = {f: os.path.getsize(f) for f in expandir_entradas(entradas)}
+        self.codigos = leer_estaciones(base).set_index("id")["station_id"]
+
+    def _en_ventana(self, timestamps):
+        if self.ventana is None:
+            return np.ones(len(timestamps), dtype=bool)
+        unicos = pd.unique(timestamps)
+        dentro = {t: self.ventana.contiene(pd.Timestamp(t).to_pydatetime()) for t in unicos}
+        return timestamps.map(dentro).to_numpy(dtype=bool)
+
+    def _procesar(self, ruta, inicio, fin):
+        # Los ficheros de la capa se nombran por fichero y posición de inicio: si se cae
+        # antes de guardar el estado, al repetir el tramo se sobrescriben en lugar de duplicarse
+        nombre = os.path.splitext(os.path.basename(ruta))[0]
+        escritor = EscritorParticionado(CAPA_BRUTA, self.base, prefijo=f"directo-{nombre}-{inicio:012d}", limpiar=False)
+        filas = 0
+        for bloque in leer_json_por_bloques(ruta, inicio=inicio, fin=fin):
+            bloque = bloque[bloque["timestamp"].notna()]
+            if not bloque["id"].isin(self.codigos.index).all():
+                estaciones = actualizar_estaciones(bloque, self.base)
+                self.codigos = estaciones.set_index("id")["station_id"]
+                self.medias.poner_nombres(estaciones)
+            en_ventana = self._en_ventana(bloque["timestamp"])
+            self.medias.añadir(bloque["id"].map(self.codigos).to_numpy(), bloque["timestamp"],
+                               bloque["in_use"].to_numpy(np.float64, na_value=np.nan), en_ventana)
+            escritor.escribir(bloque[en_ventana])
+            filas += len(bloque)
+        return filas
+
+    def sondear(self):
+        # Una pasada por todos los ficheros: procesa lo que se haya añadido desde la anterior
+        nuevas = 0
+        for ruta in expandir_entradas(self.entradas):
+            posicion = self.posiciones.get(ruta, 0)
+            if os.path.getsize(ruta) < posicion:
+                print(f"⚠️ {os.path.basename(ruta)} es más corto que la última vez: se vuelve a leer desde el principio")
+                posicion = 0
+            fin = fin_lineas_completas(ruta, posicion)
+            if fin == posicion:
+                continue
+            with etapa("directo.sondeo") as medida:
+                filas = self._procesar(ruta, posicion, fin)
+                medida.salida(filas)
+            self.posiciones[ruta] = fin
+            nuevas += filas
+            print(f"✅ {os.path.basename(ruta)}: {filas} registros nuevos ({fin - posicion} bytes)")
+        if nuevas:
+            guardar_estado(self.medias, self.posiciones, self.estado)
+            self.registros += nuevas
+        return nuevas
+
+    async def seguir(self, intervalo=INTERVALO, una_vez=False):
+        # El parseo y la escritura van en un hilo para no bloquear el bucle de eventos
+        # (p. ej. si se sigue junto a otras tareas asíncronas)
+        while True:
+            inicio = time.perf_counter()
+            nuevas = await asyncio.to_thread(self.sondear)
+            if nuevas:
+                print(f"📊 {nuevas} registros en {(time.perf_counter() - inicio) * 1000:.0f} ms "
+                      f"({self.registros} desde el arranque)")
+            if una_vez:
+                return self.registros
+            await asyncio.sleep(intervalo)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sigue los JSON de BiciMAD según van llegando snapshots")
+    parser.add_argument("entradas", nargs="*", default=["C:/Final_Prog/Input"],
+                        help="Ficheros .json, carpetas o patrones glob a seguir")
+    parser.add_argument("--intervalo", type=float, default=INTERVALO, help="Segundos entre sondeos")
+    parser.add_argument("--desde-inicio", action="store_true",
+                        help="Procesar también lo que ya tienen los ficheros al arrancar por primera vez")
+    parser.add_argument("--una-vez", action="store_true", help="Un solo sondeo y salir")
+    parser.add_argument("--base", default=CARPETA_DATASET)
+    parser.add_argument("--estado", default=ESTADO_PATH)
+    añadir_argumentos_ventana(parser)
+    args = parser.parse_args()
+
+    seguidor = SeguidorDirecto(args.entradas, args.base, ventana_desde_argumentos(args), args.estado, args.desde_inicio)
+    try:
+        asyncio.run(seguidor.seguir(args.intervalo, args.una_vez))
+    except KeyboardInterrupt:
+        print(f"⏹️ Seguimiento detenido tras {seguidor.registros} registros")
@@ -0,0 +1,134 @@
+import argparse
+import os
+import tempfile
+import time
+
+import joblib
+import xgboost as xgb
+
+from almacen import CAPA_BRUTA, CAPA_LIMPIA, CARPETA_DATASET, abrir_capa, leer_capa_por_lotes
+from calidad import EXCLUIR_ENTRENAMIENTO, filtrar_anomalias, leer_anomalias
+from esquema import aplicar_esquema
+from estaciones import leer_estaciones, unir_estaciones
+from instrumentacion import etapa, memoria_pico_mb
+from modelo import FEATURES, MODELO_PATH, OBJETIVO, cargar_hiperparametros
+
+# Entrenamiento fuera de memoria: en lugar de juntar toda la capa en un DataFrame, XGBoost
+# recorre los meses por lotes a través de un DataIter y guarda en disco las páginas ya
+# cuantizadas. Las features se derivan lote a lote, así que sirve para capas con todos
+# los snapshots (p. ej. la bruta ingerida con --todas) y la memoria depende del tamaño
+# del lote, no del de la capa
+TAM_LOTE = 250_000
+RONDAS = 100
+# Columnas que se leen de la capa si las tiene; el resto se deriva en cada lote
+COLUMNAS_ORIGEN = ["timestamp", "station_id", "id", "day", "weekday", "total_bases", "free_bases", "in_use",
+                   "longitude", "latitude"]
+
+
+def derivar_features(df, estaciones, anomalias=None):
+    # Features del modelo a partir de lo que traiga el lote: fechas del timestamp,
+    # station_id y coordenadas de la tabla de estaciones, in_use de las bases libres.
+    # Con anomalias (tramos de calidad.py) se quitan antes las filas que caen en ellos
+    if "station_id" not in df.columns:
+        codigos = estaciones.set_index("id")["station_id"]
+        df["station_id"] = df["id"].map(codigos)
+        df = df[df["station_id"].notna()]
+    # Las capas ya traen day, weekday e in_use de la ingesta; aplicar_esquema solo
+    # calcula los que falten en capas escritas antes del esquema
+    df = aplicar_esquema(df)
+    if anomalias is not None:
+        df = filtrar_anomalias(df, anomalias, anomalias["tipo"].unique())
+    df = unir_estaciones(df, [c for c in FEATURES if c not in df.columns], estaciones)
+    df = df[df[OBJETIVO].notna()]
+    return df[FEATURES].astype("float32"), df[OBJETIVO].astype("float32")
+
+
+class LotesParticiones(xgb.DataIter):
+    # XGBoost llama a next() hasta que devuelve False y a reset() antes de cada pasada
+
+    def __init__(self, capa=CAPA_LIMPIA, base=CARPETA_DATASET, meses=None, tam_lote=TAM_LOTE, cache_prefix=None,
+                 excluir=EXCLUIR_ENTRENAMIENTO):
+        self.capa = capa
+        self.base = base
+        self.meses = meses
+        self.tam_lote = tam_lote
+        self.columnas = [c for c in COLUMNAS_ORIGEN if c in abrir_capa(capa, base).schema.names]
+        self.estaciones = leer_estaciones(base)
+        anomalias = leer_anomalias(base)
+        anomalias = anomalias[anomalias["tipo"].isin(list(excluir or ()))]
+        self.anomalias = anomalias if len(anomalias) else None
+        self.lotes = self.filas = 0         # de la última pasada completa
+        self._pasada = [0, 0]
+        self._lotes = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._lotes is None:
+            self._lotes = leer_capa_por_lotes(self.capa, self.columnas, self.meses, self.tam_lote, self.base)
+        for df in self._lotes:
+            X, y = derivar_features(df, self.estaciones, self.anomalias)
+            if len(X):
+                input_data(data=X, label=y)
+                self._pasada[0] += 1
+                self._pasada[1] += len(X)
+                return True
+        self.lotes, self.filas = self._pasada
+        return False
+
+    def reset(self):
+        self._lotes = None
+        self._pasada = [0, 0]
+
+
+def entrenar_por_lotes(capa=CAPA_LIMPIA, base=CARPETA_DATASET, meses=None, tam_lote=TAM_LOTE, rondas=None,
+                       hilos=None, carpeta_cache=None, excluir=EXCLUIR_ENTRENAMIENTO, **parametros):
+    # Mismos hiperparámetros que entrenar_xgboost (los de ajuste.py si existen); devuelve
+    # un XGBRegressor para que la app, el servidor y el registro lo usen igual que el
+    # entrenado en memoria. xgb.train acepta los nombres de XGBRegressor salvo
+    # n_estimators, que aquí es el número de rondas
+    ajustados = cargar_hiperparametros()
+    arboles = ajustados.pop("n_estimators", RONDAS)
+    rondas = rondas or arboles
+    parametros = {"tree_method": "hist", "seed": 42, "verbosity": 0, **ajustados, **parametros}
+    if hilos:
+        parametros["nthread"] = hilos
+    with tempfile.TemporaryDirectory(prefix="xgb_cache_", dir=carpeta_cache) as cache:
+        lotes = LotesParticiones(capa, base, meses, tam_lote, cache_prefix=os.path.join(cache, "lotes"),
+                                 excluir=excluir)
+        with etapa("entrenamiento.por_lotes") as medida:
+            matriz = xgb.ExtMemQuantileDMatrix(lotes, max_bin=parametros.get("max_bin", 256))
+            booster = xgb.train(parametros, matriz, num_boost_round=rondas)
+            medida.salida(lotes.filas)
+            medida.anotar(lotes=lotes.lotes, tam_lote=tam_lote)
+        del matriz
+    model = xgb.XGBRegressor()
+    model.load_model(bytearray(booster.save_raw("ubj")))
+    return model, lotes.filas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entrenamiento de XGBoost por lotes sin cargar la capa en memoria")
+    parser.add_argument("--capa", default=CAPA_LIMPIA, choices=[CAPA_LIMPIA, CAPA_BRUTA],
+                        help="Capa de la que se leen los lotes (bruta: todos los snapshots ingeridos)")
+    parser.add_argument("--meses", nargs="+", help="Meses a usar (YYYY-MM); por defecto, todos")
+    parser.add_argument("--tam-lote", type=int, default=TAM_LOTE, help="Filas por lote")
+    parser.add_argument("--rondas", type=int, default=None,
+                        help=f"Árboles (por defecto, los de ajuste.py o {RONDAS})")
+    parser.add_argument("--hilos", type=int, default=None)
+    parser.add_argument("--cache", default=None, help="Carpeta para las páginas de XGBoost (por defecto, la temporal)")
+    parser.add_argument("--con-anomalias", action="store_true",
+                        help="No quitar las filas de los tramos anómalos detectados por calidad.py")
+    parser.add_argument("--base", default=CARPETA_DATASET)
+    parser.add_argument("--salida", default=MODELO_PATH)
+    args = parser.parse_args()
+
+    meses = [tuple(map(int, m.split("-"))) for m in args.meses] if args.meses else None
+    inicio = time.perf_counter()
+    model, filas = entrenar_por_lotes(args.capa, args.base, meses, args.tam_lote, args.rondas, args.hilos, args.cache,
+                                      excluir=() if args.con_anomalias else EXCLUIR_ENTRENAMIENTO)
+    os.makedirs(os.path.dirname(args.salida), exist_ok=True)
+    joblib.dump(model, args.salida + ".tmp")
+    os.replace(args.salida + ".tmp", args.salida)
+    pico = memoria_pico_mb()
+    print(f"✅ Modelo entrenado por lotes con {filas} filas en {time.perf_counter() - inicio:.1f} s "
+          f"(memoria pico {f'{pico:.0f} MB' if pico is not None else 'n/d'}): {args.salida}")
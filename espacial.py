@@ -0,0 +1,181 @@
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from almacen import CARPETA_SALIDA
+from prediccion import disponibilidad
+
+# Índice espacial de las estaciones: un KD-tree sobre sus coordenadas (proyectadas a
+# metros) que se construye una vez y responde "qué estaciones hay cerca de este punto".
+# Combinado con las predicciones del modelo da las estaciones más cercanas en las que
+# habrá bicis (o bases libres). El distrito de cada estación se calcula con un cruce
+# espacial contra el shapefile de distritos solo para las estaciones que no están en la
+# caché (nuevas o que han cambiado de coordenadas)
+CARPETA_DISTRITOS = "C:/Final_Prog/Input/dist2023"
+DISTRITOS_PATH = os.path.join(CARPETA_SALIDA, "distritos_estaciones.parquet")
+CODIGO_MADRID = "079"       # CMUN del municipio de Madrid en el shapefile de distritos
+RADIO_TIERRA_M = 6_371_000
+CERCANAS = 5
+
+
+def _proyectar(longitude, latitude, latitud_ref):
+    # Equirectangular alrededor de la latitud media: en el tamaño de una ciudad el error
+    # es despreciable y las distancias euclídeas del árbol quedan en metros
+    x = np.radians(np.asarray(longitude, dtype=np.float64)) * np.cos(latitud_ref) * RADIO_TIERRA_M
+    y = np.radians(np.asarray(latitude, dtype=np.float64)) * RADIO_TIERRA_M
+    return np.column_stack([x, y])
+
+
+class IndiceEstaciones:
+
+    def __init__(self, station_info, distritos=None):
+        # scipy tarda en importarse: solo se carga al construir el índice
+        from scipy.spatial import cKDTree
+
+        self.estaciones = station_info[["station_id", "name", "total_bases", "longitude", "latitude"]].reset_index(drop=True)
+        self.estaciones["distrito"] = (self.estaciones["station_id"].map(distritos)
+                                       if distritos is not None else None)
+        self.latitud_ref = float(np.radians(self.estaciones["latitude"].mean()))
+        self.arbol = cKDTree(_proyectar(self.estaciones["longitude"], self.estaciones["latitude"], self.latitud_ref))
+
+    def __len__(self):
+        return len(self.estaciones)
+
+    def cercanas(self, longitude, latitude, k=CERCANAS, radio_m=None):
+        # Las k estaciones más cercanas al punto (como mucho a radio_m metros), ordenadas por distancia
+        k = min(k, len(self))
+        distancias, filas = self.arbol.query(_proyectar([longitude], [latitude], self.latitud_ref)[0], k=k,
+                                             distance_upper_bound=np.inf if radio_m is None else radio_m)
+        distancias, filas = np.atleast_1d(distancias), np.atleast_1d(filas)
+        validas = np.isfinite(distancias)
+        cercanas = self.estaciones.iloc[filas[validas]].reset_index(drop=True)
+        cercanas.insert(2, "distancia_m", np.rint(distancias[validas]).astype(np.int32))
+        return cercanas
+
+
+def elegir_estaciones(candidatas, pred_ajustada, k=CERCANAS, dejar=False, minimo=1):
+    # Bicis y bases libres previstas (prediccion.disponibilidad, la misma cuenta que la
+    # app y el servidor). Se quedan las k más cercanas con al menos `minimo` bicis (o
+    # bases libres si dejar=True)
+    bicis, bases_libres = disponibilidad(candidatas["total_bases"].to_numpy(), pred_ajustada)
+    candidatas = candidatas.assign(bicis=bicis.astype(np.int16), bases_libres=bases_libres.astype(np.int16))
+    objetivo = candidatas["bases_libres" if dejar else "bicis"]
+    return candidatas[objetivo >= minimo].head(k).reset_index(drop=True)
+
+
+def donde_coger_bici(indice, prediccion, longitude, latitude, k=CERCANAS, dejar=False, minimo=1, radio_m=None):
+    # prediccion(station_ids) -> predicción ajustada de esas estaciones (la tabla
+    # precalculada en la app, el modelo en lotes en el servidor). Se predicen solo las
+    # candidatas más cercanas; si no bastan se amplía la búsqueda a todas
+    candidatas = min(len(indice), max(4 * k, 16))
+    while True:
+        cercanas = indice.cercanas(longitude, latitude, candidatas, radio_m)
+        elegidas = elegir_estaciones(cercanas, prediccion(cercanas["station_id"].to_numpy()), k, dejar, minimo)
+        if len(elegidas) >= k or candidatas >= len(indice) or len(cercanas) < candidatas:
+            return elegidas
+        candidatas = len(indice)
+
+
+def _leer_distritos(ruta_distritos):
+    # Shapefile (o carpeta con uno) de distritos; solo los del municipio de Madrid
+    import geopandas as gpd
+
+    if os.path.isdir(ruta_distritos):
+        shps = sorted(glob.glob(os.path.join(ruta_distritos, "*.shp")))
+        if not shps:
+            raise FileNotFoundError(f"No se encontraron archivos .shp en {ruta_distritos}")
+        ruta_distritos = shps[0]
+    distritos = gpd.read_file(ruta_distritos)
+    if "CMUN" in distritos.columns:
+        distritos = distritos[distritos["CMUN"].astype(str) == CODIGO_MADRID]
+    return distritos
+
+
+def asignar_distritos(estaciones, ruta_distritos=CARPETA_DISTRITOS):
+    # Cruce espacial estación-dentro-de-distrito (el mismo que hacía el EDA), vectorizado
+    import geopandas as gpd
+
+    distritos = _leer_distritos(ruta_distritos)
+    puntos = gpd.GeoDataFrame(
+        estaciones[["station_id", "longitude", "latitude"]].reset_index(drop=True),
+        geometry=gpd.points_from_xy(estaciones["longitude"], estaciones["latitude"]), crs="EPSG:4326")
+    if distritos.crs is not None and puntos.crs != distritos.crs:
+        puntos = puntos.to_crs(distritos.crs)
+    unidos = gpd.sjoin(puntos, distritos[["CDDISTRI", "DSDISTRITO", "geometry"]], how="left", predicate="within")
+    # Una estación en el borde de dos distritos se queda con el primero
+    unidos = unidos[~unidos.index.duplicated(keep="first")]
+    return pd.DataFrame({
+        "station_id": unidos["station_id"].astype("int16").to_numpy(),
+        "longitude": unidos["longitude"].to_numpy(),
+        "latitude": unidos["latitude"].to_numpy(),
+        "cod_distrito": unidos["CDDISTRI"].astype("string").str.zfill(2).to_numpy(),
+        "distrito": unidos["DSDISTRITO"].astype("string").to_numpy(),
+    })
+
+
+def cargar_distritos(estaciones, ruta_distritos=CARPETA_DISTRITOS, cache=DISTRITOS_PATH):
+    # Distrito de cada estación (Serie station_id -> nombre). Solo se cruzan con el
+    # shapefile las estaciones que no están en la caché con las mismas coordenadas; si no
+    # se puede (sin geopandas o sin shapefile) esas estaciones quedan sin distrito
+    guardados = pd.read_parquet(cache) if os.path.exists(cache) else None
+    pendientes = estaciones[["station_id", "longitude", "latitude"]]
+    if guardados is not None:
+        claves = pendientes.merge(guardados[["station_id", "longitude", "latitude"]], how="left", indicator=True)
+        pendientes = pendientes[(claves["_merge"] == "left_only").to_numpy()]
+
+    if len(pendientes):
+        try:
+            inicio = time.perf_counter()
+            nuevos = asignar_distritos(pendientes, ruta_distritos)
+        except (ImportError, OSError) as e:
+            print(f"⚠️ Sin distrito para {len(pendientes)} estaciones: {e}")
+        else:
+            if guardados is not None:
+                guardados = guardados[~guardados["station_id"].isin(nuevos["station_id"])]
+            guardados = pd.concat([guardados, nuevos], ignore_index=True) if guardados is not None else nuevos
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            guardados.to_parquet(cache + ".tmp", index=False)
+            os.replace(cache + ".tmp", cache)
+            print(f"✅ Distrito asignado a {len(nuevos)} estaciones en {time.perf_counter() - inicio:.2f} s: {cache}")
+
+    if guardados is None:
+        return pd.Series(dtype="string")
+    return guardados.drop_duplicates("station_id", keep="last").set_index("station_id")["distrito"]
+
+
+def construir_indice(station_info, ruta_distritos=CARPETA_DISTRITOS, cache=DISTRITOS_PATH):
+    return IndiceEstaciones(station_info, cargar_distritos(station_info, ruta_distritos, cache))
+
+
+if __name__ == "__main__":
+    from modelo import MODELO_PATH
+    from prediccion import PREDICCIONES_PATH, cargar_tabla
+    from servicio import PAQUETE_PATH, cargar_paquete
+
+    parser = argparse.ArgumentParser(description="Estaciones más cercanas con bicis (o bases libres) previstas")
+    parser.add_argument("longitude", type=float)
+    parser.add_argument("latitude", type=float)
+    parser.add_argument("day", type=int)
+    parser.add_argument("weekday", type=int)
+    parser.add_argument("-k", type=int, default=CERCANAS)
+    parser.add_argument("--dejar", action="store_true", help="Buscar bases libres para dejar la bici")
+    parser.add_argument("--radio", type=float, help="Distancia máxima en metros")
+    parser.add_argument("--distritos", default=CARPETA_DISTRITOS, help="Shapefile (o carpeta) de distritos")
+    parser.add_argument("--modelo", default=MODELO_PATH)
+    parser.add_argument("--paquete", default=PAQUETE_PATH)
+    parser.add_argument("--tabla", default=PREDICCIONES_PATH)
+    args = parser.parse_args()
+
+    station_info = cargar_paquete(args.paquete)["station_info"]
+    indice = construir_indice(station_info, args.distritos, os.path.join(os.path.dirname(args.paquete),
+                                                                         os.path.basename(DISTRITOS_PATH)))
+    tabla = cargar_tabla(args.modelo, station_info, args.tabla)
+    inicio = time.perf_counter()
+    elegidas = donde_coger_bici(indice, lambda ids: tabla.predecir_estaciones(ids, args.day, args.weekday)[1],
+                                args.longitude, args.latitude, args.k, args.dejar, radio_m=args.radio)
+    print(elegidas.to_string(index=False))
+    print(f"⏱️ {(time.perf_counter() - inicio) * 1000:.2f} ms")
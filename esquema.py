@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+# Esquema de los snapshots declarado en un solo sitio: tipo de cada columna de una
+# estación tal como sale de la ingesta y columnas derivadas que se calculan en el mismo
+# bloque. Las etapas siguientes reciben ya float32/int16/datetime64 y no convierten nada
+COLUMNAS_ESTACION = {
+    "id": np.int32,
+    "number": object,
+    "name": object,
+    "address": object,
+    "activate": np.int8,
+    "no_available": np.int8,
+    "light": np.int8,
+    "reservations_count": np.int16,
+    "total_bases": np.int16,
+    "free_bases": np.int16,
+    "dock_bikes": np.int16,
+    "longitude": np.float32,
+    "latitude": np.float32,
+}
+
+# Columnas que se calculan en la ingesta: día del mes y de la semana (0=Lunes) del
+# timestamp y bicis en uso (in_use = total_bases - free_bases)
+DERIVADAS = {
+    "day": np.int8,
+    "weekday": np.int8,
+    "in_use": np.int16,
+}
+
+# Conteos que pueden faltar en un snapshot: se guardan como nulos (enteros con máscara)
+# y no como 0, para que el control de calidad (calidad.py) vea que faltan
+CONTEOS_CON_NULOS = ("total_bases", "free_bases", "dock_bikes")
+
+TIPO_TIMESTAMP = "datetime64[us]"
+
+
+def parsear_numeros(valores):
+    # Valores que no entran directamente en su tipo: texto con coma decimal ("-3,70") o
+    # vacíos, que quedan como NaN. Una sola pasada con float() es más rápida que
+    # .str.replace de pandas, que además crea una copia de texto de la columna
+    return np.array([np.nan if v is None or v == "" else float(str(v).replace(",", ".")) for v in valores],
+                    dtype=np.float64)
+
+
+def derivar_columnas(df, columnas=DERIVADAS):
+    # Añade las columnas derivadas pedidas (las de fecha solo donde hay timestamp)
+    ts = df["timestamp"]
+    if "day" in columnas:
+        df["day"] = ts.dt.day.fillna(0).astype(DERIVADAS["day"])
+    if "weekday" in columnas:
+        df["weekday"] = ts.dt.weekday.fillna(0).astype(DERIVADAS["weekday"])
+    if "in_use" in columnas and "total_bases" in df.columns and "free_bases" in df.columns:
+        df["in_use"] = df["total_bases"] - df["free_bases"]
+    return df
+
+
+def _ajustar_numerica(serie, tipo):
+    if serie.dtype == tipo:
+        return serie
+    if not pd.api.types.is_numeric_dtype(serie):
+        serie = pd.Series(parsear_numeros(serie.to_numpy(dtype=object, na_value=None)), index=serie.index)
+    # Los enteros solo si no hay nulos ni decimales (p. ej. in_use de Excel migrados)
+    if np.issubdtype(tipo, np.integer) and (serie.isna().any() or (serie % 1 != 0).any()):
+        return serie.astype(np.float32)
+    return serie.astype(tipo)
+
+
+def aplicar_esquema(df):
+    # Para datos que no vienen de la ingesta (Excel migrados, capas escritas antes del
+    # esquema): convierte solo las columnas cuyo tipo no es el declarado y calcula las
+    # derivadas que falten. Con datos ya ingeridos no hace nada
+    if df["timestamp"].dtype != TIPO_TIMESTAMP:
+        # Texto o datetime con otra resolución
+        df["timestamp"] = pd.to_datetime(df["timestamp"]).astype(TIPO_TIMESTAMP)
+    for col, tipo in COLUMNAS_ESTACION.items():
+        if tipo is not object and col in df.columns:
+            df[col] = _ajustar_numerica(df[col], tipo)
+    # weekday de texto ("Lunes") o columnas a medias (meses con ficheros de antes y de
+    # después del esquema): se vuelven a calcular enteras
+    faltan = [c for c in DERIVADAS
+              if c not in df.columns or not pd.api.types.is_numeric_dtype(df[c]) or df[c].isna().any()]
+    df = derivar_columnas(df, faltan)
+    for col, tipo in DERIVADAS.items():
+        if col in df.columns:
+            df[col] = _ajustar_numerica(df[col], tipo)
+    return df
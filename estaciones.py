@@ -0,0 +1,116 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from almacen import CAPA_LIMPIA, CARPETA_DATASET, abrir_capa, escribir_capa, leer_capa, particiones
+from esquema import aplicar_esquema
+
+# Tabla de estaciones común a todos los meses: cada id de BiciMAD recibe un station_id
+# estable que no cambia al añadir meses. Los datos de cada snapshot solo guardan el
+# station_id y las columnas que varían; nombre, dirección y coordenadas están aquí
+FICHERO_ESTACIONES = "estaciones.parquet"
+COLUMNAS_ESTACION = ["station_id", "id", "number", "name", "address", "longitude", "latitude", "total_bases"]
+# Columnas de la capa limpia que se sacan a la tabla de estaciones
+COLUMNAS_DIMENSION = ["id", "number", "name", "address", "longitude", "latitude"]
+
+
+def ruta_estaciones(base=CARPETA_DATASET):
+    return os.path.join(base, FICHERO_ESTACIONES)
+
+
+def leer_estaciones(base=CARPETA_DATASET):
+    ruta = ruta_estaciones(base)
+    if not os.path.exists(ruta):
+        return pd.DataFrame({col: pd.Series(dtype=tipo) for col, tipo in [
+            ("station_id", "int16"), ("id", "int32"), ("number", "str"), ("name", "str"), ("address", "str"),
+            ("longitude", "float32"), ("latitude", "float32"), ("total_bases", "int16"),
+            ("primera_vez", "datetime64[us]"), ("ultima_vez", "datetime64[us]")]})
+    return pd.read_parquet(ruta)
+
+
+def actualizar_estaciones(df, base=CARPETA_DATASET):
+    # Añade las estaciones nuevas con el siguiente código libre y actualiza los datos de
+    # las existentes con su observación más reciente. Devuelve la tabla actualizada
+    estaciones = leer_estaciones(base)
+    columnas = [c for c in COLUMNAS_ESTACION if c != "station_id" and c in df.columns]
+    ultimas = (df.sort_values("timestamp", kind="stable")
+               .groupby("id", sort=True)
+               .agg(**{c: (c, "last") for c in columnas if c != "id"},
+                    primera_vez=("timestamp", "min"), ultima_vez=("timestamp", "max"))
+               .reset_index())
+
+    # Por estación: primera y última aparición, datos de la observación más reciente y
+    # el station_id que ya tuviera (groupby "first" ignora los nulos de las nuevas)
+    todas = pd.concat([estaciones, ultimas], ignore_index=True).sort_values("ultima_vez", kind="stable")
+    estaciones = (todas.groupby("id", sort=True)
+                  .agg(station_id=("station_id", "first"),
+                       **{c: (c, "last") for c in columnas if c != "id"},
+                       primera_vez=("primera_vez", "min"), ultima_vez=("ultima_vez", "max"))
+                  .reset_index())
+
+    nuevas = estaciones["station_id"].isna()
+    if nuevas.any():
+        siguiente = int(estaciones["station_id"].max()) + 1 if (~nuevas).any() else 0
+        estaciones.loc[nuevas, "station_id"] = np.arange(siguiente, siguiente + nuevas.sum())
+
+    # Una estación nueva cuyos snapshots no traen nunca total_bases (nulo desde la ingesta)
+    estaciones["total_bases"] = estaciones["total_bases"].fillna(0)
+    estaciones = estaciones[COLUMNAS_ESTACION + ["primera_vez", "ultima_vez"]].astype(
+        {"station_id": "int16", "id": "int32", "total_bases": "int16", "longitude": "float32", "latitude": "float32"}
+    ).sort_values("station_id")
+    ruta = ruta_estaciones(base)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    estaciones.to_parquet(ruta + ".tmp", index=False)
+    os.replace(ruta + ".tmp", ruta)
+    if nuevas.any():
+        print(f"✅ {nuevas.sum()} estaciones nuevas en {ruta}")
+    return estaciones.reset_index(drop=True)
+
+
+def codificar(df, estaciones):
+    # Sustituye las columnas de la estación por su station_id estable
+    codigos = pd.Series(estaciones["station_id"].values, index=estaciones["id"].values)
+    df["station_id"] = df["id"].map(codigos).astype("int16")
+    return df.drop(columns=[c for c in COLUMNAS_DIMENSION if c in df.columns])
+
+
+def unir_estaciones(df, columnas=("longitude", "latitude"), estaciones=None, base=CARPETA_DATASET):
+    # Añade a los datos las columnas de la tabla de estaciones que se pidan
+    if estaciones is None:
+        estaciones = leer_estaciones(base)
+    columnas = [c for c in columnas if c not in df.columns]
+    if not columnas:
+        return df
+    tabla = estaciones.set_index("station_id")[columnas]
+    for col in columnas:
+        df[col] = df["station_id"].map(tabla[col])
+    return df
+
+
+def leer_capa_con_estaciones(capa, columnas, base=CARPETA_DATASET, **filtros):
+    # Lee de la capa las columnas pedidas y completa con la tabla de estaciones las que
+    # ya no están en los datos (longitude, latitude, name...)
+    disponibles = set(abrir_capa(capa, base).schema.names)
+    propias = [c for c in columnas if c in disponibles]
+    if "station_id" not in propias:
+        propias.append("station_id")
+    df = leer_capa(capa, columnas=propias, base=base, **filtros)
+    return unir_estaciones(df, [c for c in columnas if c not in disponibles], base=base)[list(columnas)]
+
+
+def recodificar_capa_limpia(base=CARPETA_DATASET):
+    # Pasa a la tabla de estaciones los meses de la capa limpia escritos antes de que
+    # existiera (con LabelEncoder por mes y columnas de texto repetidas)
+    for year, month in particiones(CAPA_LIMPIA, base):
+        df = leer_capa(CAPA_LIMPIA, meses=[(year, month)], base=base)
+        if "id" not in df.columns or df["id"].isna().all():
+            continue
+        estaciones = actualizar_estaciones(df, base)
+        df = codificar(aplicar_esquema(df.drop(columns=["station_id"])), estaciones)
+        escribir_capa(df, CAPA_LIMPIA, base)
+        print(f"✅ Recodificado {year}-{month:02d}")
+
+
+if __name__ == "__main__":
+    recodificar_capa_limpia()
@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from almacen import CAPA_BRUTA, CAPA_GIS, CAPA_LIMPIA, CARPETA_DATASET, leer_capa_por_lotes, particiones, ruta_capa
+from espacial import CARPETA_DISTRITOS, DISTRITOS_PATH, cargar_distritos
+from estaciones import leer_estaciones
+from instrumentacion import etapa
+
+# Exportación GIS de los snapshots: un fichero GeoParquet por mes con la geometría de
+# cada fila como punto WKB. Los puntos se construyen de golpe a partir de los arrays de
+# longitude/latitude (sin shapely ni un Point por fila) y el distrito se cruza una sola
+# vez por estación (caché de espacial.cargar_distritos) y se reparte con un map. Se lee
+# la capa por lotes, así que sirve para todo el histórico de la capa bruta. Para
+# programas que no leen GeoParquet hay salida alternativa a GeoPackage o shapefile
+FORMATOS = {"parquet": None, "gpkg": "GPKG", "shp": "ESRI Shapefile"}
+TAM_LOTE = 500_000
+# Columnas de la tabla de estaciones que se añaden a cada fila si la capa no las tiene
+COLUMNAS_ESTACION = ["name", "longitude", "latitude"]
+# Metadatos GeoParquet: sin "crs" los lectores asumen OGC:CRS84 (longitud/latitud WGS84)
+METADATOS_GEO = {
+    "version": "1.0.0",
+    "primary_column": "geometry",
+    "columns": {"geometry": {"encoding": "WKB", "geometry_types": ["Point"]}},
+}
+# WKB de un punto 2D: orden de bytes (1 = little endian), tipo (1 = Point), x, y
+_PUNTO_WKB = np.dtype([("orden", "u1"), ("tipo", "<u4"), ("x", "<f8"), ("y", "<f8")])
+
+
+def ruta_cache_distritos(base=CARPETA_DATASET):
+    # Junto al dataset: con la base por defecto es la misma caché que usa la app
+    return os.path.join(os.path.dirname(base), os.path.basename(DISTRITOS_PATH))
+
+
+def puntos_wkb(longitude, latitude):
+    # Array binario de pyarrow con un punto WKB por fila; sin coordenadas, geometría nula
+    longitude = np.asarray(longitude, dtype=np.float64)
+    latitude = np.asarray(latitude, dtype=np.float64)
+    n = len(longitude)
+    registros = np.empty(n, dtype=_PUNTO_WKB)
+    registros["orden"] = 1
+    registros["tipo"] = 1
+    registros["x"] = longitude
+    registros["y"] = latitude
+    desplazamientos = np.arange(n + 1, dtype=np.int32) * _PUNTO_WKB.itemsize
+    puntos = pa.Array.from_buffers(pa.binary(), n, [None, pa.py_buffer(desplazamientos),
+                                                    pa.py_buffer(registros.tobytes())])
+    validos = np.isfinite(longitude) & np.isfinite(latitude)
+    if not validos.all():
+        puntos = pc.if_else(pa.array(validos), puntos, pa.scalar(None, pa.binary()))
+    return puntos
+
+
+def _categoria_por_estacion(station_ids, valores):
+    # valores: Serie categórica station_id -> texto. Se reparte por códigos y queda como
+    # diccionario en el Parquet, sin crear un texto por fila
+    codigos = station_ids.map(valores.cat.codes).fillna(-1).astype("int32")
+    return pd.Categorical.from_codes(codigos, valores.cat.categories)
+
+
+def completar_lote(df, estaciones, distritos):
+    # station_id (la capa bruta solo trae el id de BiciMAD), nombre y coordenadas de la
+    # tabla de estaciones si faltan, y el distrito ya calculado de cada estación
+    if "station_id" not in df.columns:
+        df["station_id"] = df["id"].map(estaciones.set_index("id")["station_id"]).astype("Int16")
+    tabla = estaciones.set_index("station_id")
+    for col in COLUMNAS_ESTACION:
+        if col not in df.columns:
+            df[col] = (_categoria_por_estacion(df["station_id"], tabla[col].astype("category"))
+                       if tabla[col].dtype == object or pd.api.types.is_string_dtype(tabla[col])
+                       else df["station_id"].map(tabla[col]))
+    df["distrito"] = _categoria_por_estacion(df["station_id"], distritos)
+    # Las columnas de partición ya van en la ruta
+    return df.drop(columns=[c for c in ("year", "month", "hour") if c in df.columns])
+
+
+def _ruta_salida(capa, year, month, formato, base):
+    carpeta = os.path.join(ruta_capa(CAPA_GIS, base), capa)
+    if formato == "parquet":
+        return os.path.join(carpeta, f"year={year}", f"month={month}", f"{capa}.parquet")
+    return os.path.join(f"{carpeta}_{formato}", f"{capa}_{year}-{month:02d}.{formato}")
+
+
+def _escribir_geoparquet(lotes, ruta):
+    escritor, filas = None, 0
+    try:
+        for df in lotes:
+            tabla = pa.Table.from_pandas(df, preserve_index=False)
+            # Columnas sin ningún valor (distrito sin shapefile): texto nulo, no tipo null
+            for i, campo in enumerate(tabla.schema):
+                tipo = campo.type.value_type if pa.types.is_dictionary(campo.type) else campo.type
+                if pa.types.is_null(tipo):
+                    tabla = tabla.set_column(i, campo.name, pa.nulls(len(tabla), pa.string()))
+            tabla = tabla.append_column("geometry", puntos_wkb(df["longitude"], df["latitude"]))
+            if escritor is None:
+                esquema = tabla.schema.with_metadata({**(tabla.schema.metadata or {}),
+                                                      b"geo": json.dumps(METADATOS_GEO).encode()})
+                escritor = pq.ParquetWriter(ruta + ".tmp", esquema)
+            escritor.write_table(tabla.cast(escritor.schema))
+            filas += len(df)
+    finally:
+        if escritor is not None:
+            escritor.close()
+    if escritor is not None:
+        os.replace(ruta + ".tmp", ruta)
+    return filas
+
+
+def _escribir_ogr(lotes, ruta, formato):
+    # GeoPackage / shapefile con geopandas (dependencia opcional). Se escribe en una
+    # carpeta temporal porque el shapefile son varios ficheros (.shp, .dbf, .shx...)
+    import geopandas as gpd
+
+    temporal = ruta + ".tmp"
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+    fichero = os.path.join(temporal, os.path.basename(ruta))
+    filas = 0
+    for df in lotes:
+        puntos = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df["longitude"], df["latitude"]), crs="EPSG:4326")
+        puntos.to_file(fichero, driver=FORMATOS[formato], mode="a" if filas else "w")
+        filas += len(df)
+    for nombre in os.listdir(temporal):
+        os.replace(os.path.join(temporal, nombre), os.path.join(os.path.dirname(ruta), nombre))
+    shutil.rmtree(temporal)
+    return filas
+
+
+def exportar_mes(capa, year, month, estaciones, distritos, formato="parquet", base=CARPETA_DATASET,
+                 tam_lote=TAM_LOTE):
+    ruta = _ruta_salida(capa, year, month, formato, base)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    lotes = (completar_lote(df, estaciones, distritos)
+             for df in leer_capa_por_lotes(capa, meses=[(year, month)], tam_lote=tam_lote, base=base))
+    with etapa(f"gis.{capa}.{year}-{month:02d}") as medida:
+        filas = _escribir_geoparquet(lotes, ruta) if formato == "parquet" else _escribir_ogr(lotes, ruta, formato)
+        medida.salida(filas)
+    return ruta, filas
+
+
+def _mes_desactualizado(capa, year, month, formato, base):
+    # Sin exportar, o algún fichero del mes de la capa es posterior a la exportación
+    ruta = _ruta_salida(capa, year, month, formato, base)
+    if not os.path.exists(ruta):
+        return True
+    carpeta = os.path.join(ruta_capa(capa, base), f"year={year}", f"month={month}")
+    modificado = max((os.path.getmtime(os.path.join(raiz, f)) for raiz, _, ficheros in os.walk(carpeta)
+                      for f in ficheros), default=0)
+    return modificado > os.path.getmtime(ruta)
+
+
+def exportar_gis(capa=CAPA_LIMPIA, base=CARPETA_DATASET, meses=None, formato="parquet",
+                 ruta_distritos=CARPETA_DISTRITOS, cache_distritos=None, tam_lote=TAM_LOTE):
+    # Exporta los meses indicados (por defecto, los que falten o estén desactualizados).
+    # Devuelve las rutas escritas
+    if meses is None:
+        meses = [mes for mes in particiones(capa, base) if _mes_desactualizado(capa, *mes, formato, base)]
+    if not meses:
+        return []
+    estaciones = leer_estaciones(base)
+    distritos = cargar_distritos(estaciones, ruta_distritos, cache_distritos or ruta_cache_distritos(base)).astype("category")
+    rutas = []
+    for year, month in meses:
+        inicio = time.perf_counter()
+        ruta, filas = exportar_mes(capa, year, month, estaciones, distritos, formato, base, tam_lote)
+        rutas.append(ruta)
+        print(f"✅ GIS {capa} {year}-{month:02d}: {filas} puntos en {time.perf_counter() - inicio:.2f} s -> {ruta}")
+    return rutas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exportación de los snapshots a GeoParquet (o GeoPackage/shapefile)")
+    parser.add_argument("--capa", default=CAPA_LIMPIA, choices=[CAPA_LIMPIA, CAPA_BRUTA],
+                        help="Capa a exportar (bruta: todos los snapshots ingeridos)")
+    parser.add_argument("--formato", default="parquet", choices=list(FORMATOS),
+                        help="gpkg y shp necesitan geopandas")
+    parser.add_argument("--meses", nargs="+", help="Meses a exportar (YYYY-MM); por defecto, los que hayan cambiado")
+    parser.add_argument("--todos", action="store_true", help="Volver a exportar todos los meses")
+    parser.add_argument("--distritos", default=CARPETA_DISTRITOS, help="Shapefile (o carpeta) de distritos")
+    parser.add_argument("--tam-lote", type=int, default=TAM_LOTE, help="Filas por lote")
+    parser.add_argument("--base", default=CARPETA_DATASET)
+    args = parser.parse_args()
+
+    if args.todos:
+        meses = particiones(args.capa, args.base)
+    else:
+        meses = [tuple(map(int, m.split("-"))) for m in args.meses] if args.meses else None
+    inicio = time.perf_counter()
+    try:
+        rutas = exportar_gis(args.capa, args.base, meses, args.formato, args.distritos,
+                             ruta_cache_distritos(args.base), args.tam_lote)
+    except ImportError as e:
+        print(f"❌ El formato {args.formato} necesita geopandas: {e}")
+    else:
+        print(f"⏱️ {len(rutas)} meses exportados en {time.perf_counter() - inicio:.1f} s")
@@ -0,0 +1,365 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from almacen import EscritorParticionado, mover_particiones
+from esquema import COLUMNAS_ESTACION, CONTEOS_CON_NULOS, derivar_columnas, parsear_numeros
+from instrumentacion import etapa, memoria_pico_mb
+
+TAM_BLOQUE = 100_000
+# Tamaño aproximado de cada trozo de fichero que procesa un worker
+TAM_RANGO = 64 * 1024 * 1024
+
+
+def _parsear_fecha(valor):
+    try:
+        return datetime.fromisoformat(str(valor).replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _a_datetime64(fecha):
+    return np.datetime64("NaT", "us") if fecha is None else np.datetime64(fecha, "us")
+
+
+def _extraer_id(line):
+    # Saca el "_id" de la línea sin decodificar el JSON (y con él el array de estaciones)
+    pos = line.find(b'"_id"')
+    pos_stations = line.find(b'"stations"')
+    if pos < 0 or (0 <= pos_stations < pos):
+        return None
+    ini = line.find(b'"', line.find(b":", pos) + 1)
+    fin = line.find(b'"', ini + 1)
+    if ini < 0 or fin < 0:
+        return None
+    return line[ini + 1:fin].decode("latin-1")
+
+
+class VentanaTemporal:
+    # Qué snapshots se ingieren: horas, franjas "HH:MM-HH:MM", días de la semana
+    # (0=Lunes) y fechas [desde, hasta]. Un criterio a None no filtra
+
+    def __init__(self, horas=None, franjas=None, dias_semana=None, desde=None, hasta=None):
+        self.horas = set(horas) if horas is not None else None
+        self.franjas = [self._parsear_franja(f) for f in franjas] if franjas else None
+        self.dias_semana = set(dias_semana) if dias_semana is not None else None
+        self.desde = pd.Timestamp(desde).date() if desde is not None else None
+        self.hasta = pd.Timestamp(hasta).date() if hasta is not None else None
+
+    @staticmethod
+    def _parsear_franja(franja):
+        if isinstance(franja, str):
+            franja = franja.split("-")
+        inicio, fin = franja
+        return tuple(int(h) * 60 + int(m) for h, m in (t.split(":") for t in (inicio, fin)))
+
+    def contiene(self, fecha):
+        if fecha is None:
+            return False
+        if self.horas is not None and fecha.hour not in self.horas:
+            return False
+        if self.franjas is not None:
+            minuto = fecha.hour * 60 + fecha.minute
+            if not any(inicio <= minuto <= fin for inicio, fin in self.franjas):
+                return False
+        if self.dias_semana is not None and fecha.weekday() not in self.dias_semana:
+            return False
+        if self.desde is not None and fecha.date() < self.desde:
+            return False
+        if self.hasta is not None and fecha.date() > self.hasta:
+            return False
+        return True
+
+    def __repr__(self):
+        criterios = {k: sorted(v) if isinstance(v, set) else v for k, v in vars(self).items() if v is not None}
+        return f"VentanaTemporal({criterios})"
+
+
+# Por defecto se ingieren solo los snapshots de las 14h
+VENTANA_14H = VentanaTemporal(horas=[14])
+
+
+def añadir_argumentos_ventana(parser):
+    parser.add_argument("--horas", type=int, nargs="+", help="Horas a ingerir (por defecto, 14)")
+    parser.add_argument("--franjas", nargs="+", help="Franjas horarias HH:MM-HH:MM")
+    parser.add_argument("--dias", type=int, nargs="+", help="Días de la semana (0=Lunes, 6=Domingo)")
+    parser.add_argument("--desde", help="Primera fecha a ingerir (AAAA-MM-DD)")
+    parser.add_argument("--hasta", help="Última fecha a ingerir (AAAA-MM-DD)")
+    parser.add_argument("--todas", action="store_true", help="Ingerir todos los snapshots, sin ventana")
+
+
+def ventana_desde_argumentos(args):
+    if args.todas:
+        return None
+    if args.horas or args.franjas or args.dias or args.desde or args.hasta:
+        return VentanaTemporal(horas=args.horas, franjas=args.franjas, dias_semana=args.dias,
+                               desde=args.desde, hasta=args.hasta)
+    return VENTANA_14H
+
+
+class BufferColumnas:
+    # Columnas preasignadas que se rellenan snapshot a snapshot y se reutilizan entre bloques
+
+    def __init__(self, capacidad=TAM_BLOQUE):
+        self.capacidad = capacidad
+        self.n = 0
+        self.timestamp = np.empty(capacidad, dtype="datetime64[us]")
+        self.entry_id = np.empty(capacidad, dtype=np.int16)
+        self.columnas = {col: np.empty(capacidad, dtype=tipo) for col, tipo in COLUMNAS_ESTACION.items()}
+        # Máscara de conteos que faltan: el buffer entero guarda 0 y la máscara dice que es nulo
+        self.nulos = {col: np.zeros(capacidad, dtype=bool) for col in CONTEOS_CON_NULOS}
+
+    @property
+    def lleno(self):
+        return self.n >= self.capacidad
+
+    def añadir(self, timestamp, stations, inicio=0):
+        # Copia columna a columna las estaciones de un snapshot; si no caben todas
+        # devuelve cuántas se han copiado para continuar tras vaciar el buffer
+        k = min(len(stations) - inicio, self.capacidad - self.n)
+        lote = stations[inicio:inicio + k]
+        i, j = self.n, self.n + k
+        self.timestamp[i:j] = timestamp
+        self.entry_id[i:j] = np.arange(inicio, inicio + k)
+        for col, tipo in COLUMNAS_ESTACION.items():
+            valores = [station.get(col) for station in lote]
+            if tipo is object:
+                self.columnas[col][i:j] = valores
+                continue
+            try:
+                self.columnas[col][i:j] = valores
+                faltan = False
+            except (TypeError, ValueError):
+                # Valores vacíos o con coma decimal
+                numeros = parsear_numeros(valores)
+                faltan = np.isnan(numeros)
+                if np.issubdtype(tipo, np.integer):
+                    numeros[faltan] = 0
+                self.columnas[col][i:j] = numeros.astype(tipo)
+            if col in self.nulos:
+                self.nulos[col][i:j] = faltan
+        self.n = j
+        return k
+
+    def a_dataframe(self):
+        # Se copia cada columna porque los buffers se reutilizan en el siguiente bloque
+        datos = {"timestamp": self.timestamp[:self.n].copy(), "entry_id": self.entry_id[:self.n].copy()}
+        for col, valores in self.columnas.items():
+            datos[col] = valores[:self.n].copy()
+            if col in self.nulos and self.nulos[col][:self.n].any():
+                datos[col] = pd.arrays.IntegerArray(datos[col], self.nulos[col][:self.n].copy())
+        df = derivar_columnas(pd.DataFrame(datos))
+        self.n = 0
+        return df
+
+
+def leer_json_por_bloques(input_file, tam_bloque=TAM_BLOQUE, inicio=0, fin=None, ventana=None):
+    # Recorre el fichero JSON-lines (o solo los bytes [inicio, fin), que deben empezar en
+    # un inicio de línea) y va devolviendo DataFrames de como mucho tam_bloque filas.
+    # Con ventana, los snapshots de fuera se descartan antes de decodificar sus estaciones
+    buffer = BufferColumnas(tam_bloque)
+    with open(input_file, "rb") as f:
+        f.seek(inicio)
+        while fin is None or f.tell() < fin:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            fecha = None
+            if ventana is not None:
+                id_linea = _extraer_id(line)
+                if id_linea is not None:
+                    fecha = _parsear_fecha(id_linea)
+                    if not ventana.contiene(fecha):
+                        continue
+            record = json.loads(line.decode("latin-1"))
+            if fecha is None:
+                fecha = _parsear_fecha(record["_id"])
+                if ventana is not None and not ventana.contiene(fecha):
+                    continue
+            timestamp = _a_datetime64(fecha)
+            stations = record["stations"]
+            hechas = 0
+            while hechas < len(stations):
+                hechas += buffer.añadir(timestamp, stations, hechas)
+                if buffer.lleno:
+                    yield buffer.a_dataframe()
+    if buffer.n:
+        yield buffer.a_dataframe()
+
+
+def rangos_de_bytes(input_file, tam_rango=TAM_RANGO):
+    # Parte el fichero en trozos de unos tam_rango bytes que empiezan y acaban en un salto de línea
+    tamaño = os.path.getsize(input_file)
+    cortes = [0]
+    with open(input_file, "rb") as f:
+        while cortes[-1] + tam_rango < tamaño:
+            f.seek(cortes[-1] + tam_rango)
+            f.readline()
+            if f.tell() >= tamaño:
+                break
+            cortes.append(f.tell())
+    cortes.append(tamaño)
+    return list(zip(cortes[:-1], cortes[1:]))
+
+
+def _ultima_linea(f, tamaño):
+    # Las líneas pueden ocupar decenas de KB: se retrocede hasta tener una línea completa
+    paso = 1 << 16
+    while True:
+        inicio = max(0, tamaño - paso)
+        f.seek(inicio)
+        if inicio > 0:
+            f.readline()
+        lineas = [linea for linea in f.read().splitlines() if linea.strip()]
+        if lineas or inicio == 0:
+            return lineas[-1] if lineas else b""
+        paso *= 2
+
+
+def extremos_fichero(input_file):
+    # Primera y última fecha de un fichero leyendo solo su primera y su última línea
+    with open(input_file, "rb") as f:
+        primera = f.readline()
+        ultima = _ultima_linea(f, os.path.getsize(input_file))
+    fechas = [_parsear_fecha(_extraer_id(linea)) for linea in (primera, ultima)]
+    return fechas[0], fechas[1]
+
+
+def expandir_entradas(entradas):
+    # Acepta ficheros, carpetas (todos sus .json) y patrones glob
+    ficheros = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            ficheros.extend(glob.glob(os.path.join(entrada, "*.json")))
+        elif any(c in entrada for c in "*?["):
+            ficheros.extend(glob.glob(entrada))
+        else:
+            ficheros.append(entrada)
+    return sorted(set(ficheros))
+
+class EscritorCSV:
+    # Vuelca cada bloque al final de un CSV, escribiendo la cabecera solo una vez
+
+    def __init__(self, output_csv):
+        self.output_csv = output_csv
+        self._cabecera = True
+
+    def escribir(self, df):
+        df.to_csv(self.output_csv, mode="w" if self._cabecera else "a", header=self._cabecera,
+                  index=False, encoding="utf-8")
+        self._cabecera = False
+
+    def cerrar(self):
+        pass
+
+
+def ingestar_json(input_file, destino, tam_bloque=TAM_BLOQUE, inicio=0, fin=None, ventana=None):
+    # Lee el JSON por bloques y los va escribiendo en destino; la memoria depende solo de tam_bloque
+    t0 = time.perf_counter()
+    filas = 0
+    escritura = 0.0
+    try:
+        for bloque in leer_json_por_bloques(input_file, tam_bloque, inicio, fin, ventana):
+            t_escritura = time.perf_counter()
+            destino.escribir(bloque)
+            escritura += time.perf_counter() - t_escritura
+            filas += len(bloque)
+    finally:
+        destino.cerrar()
+    segundos = time.perf_counter() - t0
+    return {
+        "fichero": os.path.basename(input_file),
+        "filas": filas,
+        "segundos": round(segundos, 3),
+        # Parseo (JSON, fechas, días de la semana) frente a escritura de cada bloque
+        "segundos_lectura": round(segundos - escritura, 3),
+        "segundos_escritura": round(escritura, 3),
+        "filas_por_segundo": round(filas / segundos) if segundos > 0 else None,
+        "memoria_pico_mb": memoria_pico_mb(),
+    }
+
+
+def _ingestar_rango(tarea):
+    # Worker: ingiere un trozo de un fichero en la carpeta temporal del lote
+    input_file, n_rango, inicio, fin, capa, base_tmp, tam_bloque, ventana = tarea
+
+    # Con el hash de la ruta completa: dos ficheros que se llaman igual en carpetas
+    # distintas no se pisan las partes
+    ruta = hashlib.sha256(os.path.abspath(input_file).encode()).hexdigest()[:8]
+    nombre = f"{os.path.splitext(os.path.basename(input_file))[0]}-{ruta}"
+    escritor = EscritorParticionado(capa, base_tmp, prefijo=f"{nombre}-{n_rango:04d}", limpiar=False)
+    stats = ingestar_json(input_file, escritor, tam_bloque, inicio, fin, ventana)
+    stats["input_file"] = input_file
+    stats["meses"] = sorted(escritor.meses)
+    return stats
+
+
+def ingestar_lote(entradas, capa, base, procesos=None, tam_bloque=TAM_BLOQUE, tam_rango=TAM_RANGO, ventana=None):
+    # Ingiere varios ficheros mensuales repartiendo trozos de cada uno entre procesos.
+    # Cada worker escribe en una carpeta temporal y al final se sustituyen los meses
+    # afectados de la capa, de modo que el resultado es el mismo que en serie
+    ficheros = expandir_entradas(entradas)
+    if not ficheros:
+        print(f"❌ No se encontraron ficheros JSON en {entradas}")
+        return {"fichero": "0 ficheros", "ficheros": 0, "filas": 0, "segundos": 0.0, "filas_por_segundo": None,
+                "memoria_pico_mb": memoria_pico_mb(), "meses": [], "meses_por_fichero": {}}
+
+    base_tmp = os.path.join(base, f"_tmp_ingesta_{uuid.uuid4().hex[:8]}")
+    tareas = []
+    for input_file in ficheros:
+        for n_rango, (inicio, fin) in enumerate(rangos_de_bytes(input_file, tam_rango)):
+            tareas.append((input_file, n_rango, inicio, fin, capa, base_tmp, tam_bloque, ventana))
+
+    t0 = time.perf_counter()
+    with etapa(f"ingesta.{capa}") as medida:
+        try:
+            if procesos == 1 or len(tareas) == 1:
+                resultados = [_ingestar_rango(tarea) for tarea in tareas]
+            else:
+                with ProcessPoolExecutor(max_workers=procesos) as pool:
+                    resultados = list(pool.map(_ingestar_rango, tareas))
+            meses = sorted({mes for r in resultados for mes in r["meses"]})
+            mover_particiones(capa, base_tmp, base, meses)
+        finally:
+            shutil.rmtree(base_tmp, ignore_errors=True)
+        medida.salida(sum(r["filas"] for r in resultados))
+        # Segundos sumados de todos los trozos (con varios procesos superan al tiempo real)
+        medida.anotar(ficheros=len(ficheros), trozos=len(tareas),
+                      segundos_lectura=round(sum(r["segundos_lectura"] for r in resultados), 3),
+                      segundos_escritura=round(sum(r["segundos_escritura"] for r in resultados), 3))
+    segundos = time.perf_counter() - t0
+
+    meses_por_fichero = {input_file: set() for input_file in ficheros}
+    for r in resultados:
+        meses_por_fichero[r["input_file"]].update(r["meses"])
+    filas = sum(r["filas"] for r in resultados)
+    picos = [r["memoria_pico_mb"] for r in resultados + [{"memoria_pico_mb": memoria_pico_mb()}]]
+    picos = [p for p in picos if p is not None]
+    return {
+        "fichero": f"{len(ficheros)} ficheros / {len(tareas)} trozos",
+        "ficheros": len(ficheros),
+        "filas": filas,
+        "segundos": round(segundos, 3),
+        "filas_por_segundo": round(filas / segundos) if segundos > 0 else None,
+        "memoria_pico_mb": max(picos) if picos else None,
+        "meses": meses,
+        "meses_por_fichero": {f: sorted(m) for f, m in meses_por_fichero.items()},
+    }
+
+
+def imprimir_estadisticas(stats):
+    pico = stats["memoria_pico_mb"]
+    pico_txt = f"{pico:.0f} MB" if pico is not None else "n/d"
+    print(f"📊 {stats['fichero']}: {stats['filas']} filas en {stats['segundos']} s "
+          f"({stats['filas_por_segundo']} filas/s, memoria pico {pico_txt})")
@@ -0,0 +1,274 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+
+# Instrumentación de las etapas: tiempo, filas de entrada y salida, filas por segundo y
+# memoria pico de cada una, con perfilado opcional (cProfile) de las etapas que se pidan.
+# El pico de cada etapa es el de ella misma: en Linux se reinicia el contador del proceso
+# (VmHWM) al entrar; donde no se puede, solo se anota el pico del proceso hasta ese momento.
+# Está desactivada por defecto; entonces `etapa()` devuelve siempre el mismo objeto vacío
+# y medir no cuesta más que una llamada a función
+#
+#   with etapa("limpieza.fechas", len(df)) as e:
+#       ...
+#       e.salida(len(df))
+
+
+# Pico del proceso antes del último reinicio del contador (ru_maxrss también se reinicia)
+_pico_reiniciado_mb = 0.0
+
+
+def memoria_pico_mb():
+    # Memoria residente máxima del proceso desde que arrancó (None si no se puede medir)
+    try:
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux lo da en KB y macOS en bytes
+        return max(pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024, _pico_reiniciado_mb)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+def _pico_actual_mb():
+    # VmHWM: memoria residente máxima desde el último reinicio (solo Linux)
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reiniciar_pico():
+    # Escribir "5" en clear_refs pone VmHWM a la memoria residente actual. Devuelve el
+    # pico que había antes del reinicio, o None si no se puede reiniciar
+    global _pico_reiniciado_mb
+    pico = _pico_actual_mb()
+    if pico is None:
+        return None
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return None
+    _pico_reiniciado_mb = max(_pico_reiniciado_mb, pico)
+    return pico
+
+
+class _EtapaInactiva:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def salida(self, filas):
+        pass
+
+    def anotar(self, **datos):
+        pass
+
+
+_INACTIVA = _EtapaInactiva()
+
+
+class Etapa:
+
+    def __init__(self, registro, nombre, filas_entrada):
+        self.registro = registro
+        self.nombre = nombre
+        self.filas_entrada = filas_entrada
+        self.filas_salida = None
+        self.perfil = None
+        self.datos = {}
+        self.pico = None        # pico de la etapa, con el de las subetapas ya terminadas
+
+    def salida(self, filas):
+        self.filas_salida = filas
+
+    def anotar(self, **datos):
+        # Medidas propias de la etapa que se añaden a su registro
+        self.datos.update(datos)
+
+    def __enter__(self):
+        # Se registra al entrar para que el informe quede en orden de inicio
+        self.medida = {"etapa": self.nombre, "nivel": self.registro.nivel}
+        self.registro.etapas.append(self.medida)
+        self.registro.nivel += 1
+        # Antes de reiniciar el contador, el pico hasta ahora pasa a la etapa que la contiene
+        padre = self.registro.pila[-1] if self.registro.pila else None
+        previo = _reiniciar_pico()
+        if previo is not None:
+            self.pico = 0.0
+            if padre is not None and padre.pico is not None:
+                padre.pico = max(padre.pico, previo)
+        self.registro.pila.append(self)
+        # Solo puede haber un cProfile activo: las subetapas ya quedan dentro del perfil de la etapa
+        if self.registro.perfil_activo is None and self.registro.perfilar(self.nombre):
+            self.perfil = self.registro.perfil_activo = cProfile.Profile()
+            self.perfil.enable()
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        segundos = time.perf_counter() - self.inicio
+        if self.perfil is not None:
+            self.perfil.disable()
+            self.registro.perfil_activo = None
+        self.registro.nivel -= 1
+        self.registro.pila.pop()
+        if self.pico is not None:
+            self.pico = max(self.pico, _pico_actual_mb())
+            padre = self.registro.pila[-1] if self.registro.pila else None
+            if padre is not None and padre.pico is not None:
+                padre.pico = max(padre.pico, self.pico)
+        filas = self.filas_salida if self.filas_salida is not None else self.filas_entrada
+        medida = self.medida
+        medida.update({
+            "segundos": round(segundos, 4),
+            "filas_entrada": self.filas_entrada,
+            "filas_salida": self.filas_salida,
+            "filas_por_segundo": round(filas / segundos) if filas and segundos > 0 else None,
+            "memoria_pico_mb": round(self.pico, 1) if self.pico is not None else None,
+            "memoria_pico_proceso_mb": memoria_pico_mb(),
+            **self.datos,
+        })
+        if tipo is not None:
+            medida["error"] = f"{tipo.__name__}: {valor}"
+        if self.perfil is not None:
+            medida["perfil"] = self.registro.guardar_perfil(self.nombre, self.perfil)
+        return False
+
+
+class Registro:
+
+    def __init__(self, perfilar=(), carpeta_perfiles=None, lineas_perfil=20):
+        self.etapas = []
+        self.nivel = 0
+        self.pila = []
+        self.perfil_activo = None
+        self.inicio = time.time()
+        self._perfilar = set(perfilar)
+        self.carpeta_perfiles = carpeta_perfiles
+        self.lineas_perfil = lineas_perfil
+
+    def perfilar(self, nombre):
+        # Se perfila la etapa pedida y también las que cuelgan de ella ("limpieza" -> "limpieza.fechas")
+        return any(nombre == p or nombre.startswith(p + ".") for p in self._perfilar)
+
+    def guardar_perfil(self, nombre, perfil):
+        texto = io.StringIO()
+        pstats.Stats(perfil, stream=texto).sort_stats("cumulative").print_stats(self.lineas_perfil)
+        resultado = {"resumen": texto.getvalue()}
+        if self.carpeta_perfiles:
+            os.makedirs(self.carpeta_perfiles, exist_ok=True)
+            ruta = os.path.join(self.carpeta_perfiles, f"{nombre}_{len(self.etapas)}.prof")
+            perfil.dump_stats(ruta)
+            resultado["fichero"] = ruta
+        return resultado
+
+
+_registro = None
+
+
+def activar(perfilar=(), carpeta_perfiles=None):
+    global _registro
+    _registro = Registro(perfilar, carpeta_perfiles)
+    return _registro
+
+
+def desactivar():
+    global _registro
+    _registro = None
+
+
+def activa():
+    return _registro is not None
+
+
+def etapa(nombre, filas_entrada=None):
+    if _registro is None:
+        return _INACTIVA
+    return Etapa(_registro, nombre, filas_entrada)
+
+
+def informe():
+    if _registro is None:
+        return None
+    return {
+        "inicio": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(_registro.inicio)),
+        "segundos": round(time.time() - _registro.inicio, 3),
+        "memoria_pico_mb": memoria_pico_mb(),
+        "etapas": _registro.etapas,
+    }
+
+
+def guardar_informe(ruta):
+    datos = informe()
+    os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(datos, f, indent=2, ensure_ascii=False)
+    os.replace(ruta + ".tmp", ruta)
+    print(f"✅ Informe de rendimiento guardado en {ruta}")
+
+
+def imprimir_resumen():
+    datos = informe()
+    if not datos:
+        return
+    print(f"\n📊 Rendimiento por etapa ({datos['segundos']} s en total):")
+    for medida in datos["etapas"]:
+        sangria = "  " * (medida["nivel"] + 1)
+        if "segundos" not in medida:
+            print(f"{sangria}{medida['etapa']}: sin terminar")
+            continue
+        entrada, salida = medida["filas_entrada"], medida["filas_salida"]
+        if entrada is not None and salida is not None:
+            filas = f", filas {entrada} -> {salida}"
+        elif entrada is not None or salida is not None:
+            filas = f", {entrada if entrada is not None else salida} filas"
+        else:
+            filas = ""
+        velocidad = f", {medida['filas_por_segundo']} filas/s" if medida["filas_por_segundo"] else ""
+        if medida["memoria_pico_mb"] is not None:
+            pico = f", pico {medida['memoria_pico_mb']:.0f} MB"
+        elif medida["memoria_pico_proceso_mb"] is not None:
+            pico = f", pico del proceso {medida['memoria_pico_proceso_mb']:.0f} MB"
+        else:
+            pico = ""
+        error = f" ❌ {medida['error']}" if "error" in medida else ""
+        print(f"{sangria}{medida['etapa']}: {medida['segundos']:.3f} s{filas}{velocidad}{pico}{error}")
+
+
+def añadir_argumentos_instrumentacion(parser):
+    parser.add_argument("--informe-rendimiento", metavar="RUTA",
+                        help="Medir cada etapa y guardar el informe JSON en esta ruta")
+    parser.add_argument("--perfilar", nargs="+", default=[], metavar="ETAPA",
+                        help="Perfilar con cProfile estas etapas (activa también el informe)")
+
+
+def activar_desde_argumentos(args):
+    if args.informe_rendimiento or args.perfilar:
+        carpeta = os.path.dirname(os.path.abspath(args.informe_rendimiento)) if args.informe_rendimiento else None
+        activar(args.perfilar, carpeta)
+
+
+def cerrar_desde_argumentos(args):
+    if activa():
+        imprimir_resumen()
+        if args.informe_rendimiento:
+            guardar_informe(args.informe_rendimiento)
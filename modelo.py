@@ -0,0 +1,44 @@
+import json
+import os
+
+from almacen import CARPETA_SALIDA
+from instrumentacion import etapa
+
+# Variables predictoras y objetivo del modelo que usa la app
+FEATURES = ['day', 'weekday', 'total_bases', 'longitude', 'latitude', 'station_id']
+OBJETIVO = 'in_use'
+
+MODELO_PATH = os.path.join(CARPETA_SALIDA, "modelo_xgboost_entrenado.joblib")
+# Mejor configuración encontrada por ajuste.py; si no existe se usan los valores por defecto
+HIPERPARAMETROS_PATH = os.path.join(CARPETA_SALIDA, "hiperparametros_xgboost.json")
+
+
+def cargar_hiperparametros(ruta=HIPERPARAMETROS_PATH):
+    # Parámetros de XGBRegressor (incluido n_estimators) de la última búsqueda, o {}
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)["parametros"]
+
+
+def entrenar_xgboost(df, **parametros):
+    # xgboost tarda más de un segundo en importarse: solo se carga al entrenar
+    from xgboost import XGBRegressor
+
+    parametros = {**cargar_hiperparametros(), **parametros}
+    model = XGBRegressor(random_state=42, verbosity=0, **parametros)
+    with etapa("entrenamiento.xgboost", len(df)):
+        model.fit(df[FEATURES], df[OBJETIVO])
+    return model
+
+
+def actualizar_xgboost(model, df, rondas=50):
+    # Sigue añadiendo árboles al modelo existente usando solo los datos nuevos
+    from xgboost import XGBRegressor
+
+    parametros = {k: v for k, v in model.get_params().items() if v is not None}
+    parametros.update(n_estimators=rondas)
+    nuevo = XGBRegressor(**parametros)
+    with etapa("entrenamiento.actualizacion", len(df)):
+        nuevo.fit(df[FEATURES], df[OBJETIVO], xgb_model=model.get_booster())
+    return nuevo
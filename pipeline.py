@@ -0,0 +1,460 @@
+import argparse
+import ast
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import sys
+
+import joblib
+import pandas as pd
+
+from agregados import actualizar_agregados
+from almacen import CAPA_BRUTA, CAPA_FILTRADA, CAPA_LIMPIA, CARPETA_DATASET, escribir_capa, leer_capa, particiones, ruta_capa
+from calidad import EXCLUIR_ENTRENAMIENTO, HORAS_CONSTANTE, SALTO_M, escanear, guardar_anomalias, imprimir_resumen, leer_entrenamiento, ruta_anomalias
+from estaciones import leer_estaciones, ruta_estaciones
+from exportar_gis import COLUMNAS_ESTACION as COLUMNAS_GIS
+from exportar_gis import exportar_gis
+from ingesta import VENTANA_14H, añadir_argumentos_ventana, expandir_entradas, extremos_fichero, imprimir_estadisticas, ingestar_lote, ventana_desde_argumentos
+from instrumentacion import activar_desde_argumentos, añadir_argumentos_instrumentacion, cerrar_desde_argumentos
+from instrumentacion import etapa as medir
+from modelo import FEATURES, MODELO_PATH, OBJETIVO, cargar_hiperparametros, entrenar_xgboost
+from prediccion import PREDICCIONES_PATH, publicar_tabla
+from servicio import PAQUETE_PATH, cargar_paquete, publicar_paquete
+
+# Pipeline incremental: ingesta -> filtrado -> limpieza -> entrenamiento / agregados -> paquete ->
+# predicciones -> servicio, limpieza -> gis (exportación GeoParquet por mes) y
+# limpieza -> calidad -> entrenamiento (tramos anómalos que no se usan para entrenar).
+# El manifiesto guarda, por etapa y partición, la huella de sus entradas, parámetros y
+# código; solo se vuelve a ejecutar lo que ha cambiado desde la última ejecución
+
+CARPETA_CODIGO = os.path.dirname(os.path.abspath(__file__))
+MANIFIESTO = "manifiesto.json"
+
+
+def modulos_locales(ficheros):
+    # Los ficheros de una etapa y todos los módulos del proyecto que importan, directa o
+    # indirectamente (también los imports dentro de funciones): cambiar cualquiera de
+    # ellos invalida la etapa. pipeline.py no cuenta, solo orquesta
+    pendientes, vistos = list(ficheros), set()
+    while pendientes:
+        fichero = pendientes.pop()
+        if fichero in vistos or fichero == os.path.basename(__file__):
+            continue
+        vistos.add(fichero)
+        with open(os.path.join(CARPETA_CODIGO, fichero), encoding="utf-8") as f:
+            arbol = ast.parse(f.read())
+        for nodo in ast.walk(arbol):
+            if isinstance(nodo, ast.Import):
+                nombres = [alias.name for alias in nodo.names]
+            elif isinstance(nodo, ast.ImportFrom) and not nodo.level and nodo.module:
+                nombres = [nodo.module]
+            else:
+                continue
+            for nombre in nombres:
+                modulo = nombre.split(".")[0] + ".py"
+                if os.path.exists(os.path.join(CARPETA_CODIGO, modulo)):
+                    pendientes.append(modulo)
+    return sorted(vistos)
+
+
+def cargar_etapa(fichero):
+    # Los scripts numerados (01_Filtrado.py...) no se pueden importar con un import normal
+    nombre = "etapa_" + os.path.splitext(fichero)[0].lower()
+    if nombre not in sys.modules:
+        spec = importlib.util.spec_from_file_location(nombre, os.path.join(CARPETA_CODIGO, fichero))
+        modulo = importlib.util.module_from_spec(spec)
+        sys.modules[nombre] = modulo
+        spec.loader.exec_module(modulo)
+    return sys.modules[nombre]
+
+
+def _sha256_texto(*partes):
+    return hashlib.sha256("|".join(partes).encode("utf-8")).hexdigest()
+
+
+def _clave_mes(year, month):
+    return f"{year}-{month:02d}"
+
+
+def _mes_de_clave(clave):
+    year, month = clave.split("-")
+    return int(year), int(month)
+
+
+class Manifiesto:
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.datos = {"ficheros": {}, "etapas": {}}
+        if os.path.exists(ruta):
+            with open(ruta, "r", encoding="utf-8") as f:
+                self.datos = json.load(f)
+
+    def huella_fichero(self, ruta):
+        # Hash del contenido; solo se recalcula si cambian el tamaño o la fecha de modificación
+        ruta = os.path.abspath(ruta)
+        st = os.stat(ruta)
+        cache = self.datos["ficheros"].get(ruta)
+        if cache and cache["tamaño"] == st.st_size and cache["mtime_ns"] == st.st_mtime_ns:
+            return cache["sha256"]
+        h = hashlib.sha256()
+        with open(ruta, "rb") as f:
+            for trozo in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(trozo)
+        self.datos["ficheros"][ruta] = {"tamaño": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": h.hexdigest()}
+        return h.hexdigest()
+
+    def huella_carpeta(self, carpeta):
+        partes = []
+        for raiz, _, ficheros in os.walk(carpeta):
+            for fichero in ficheros:
+                ruta = os.path.join(raiz, fichero)
+                partes.append(f"{os.path.relpath(ruta, carpeta)}={self.huella_fichero(ruta)}")
+        return _sha256_texto(*sorted(partes))
+
+    def huella_codigo(self, ficheros):
+        return _sha256_texto(*[self.huella_fichero(os.path.join(CARPETA_CODIGO, f)) for f in modulos_locales(ficheros)])
+
+    def registro(self, etapa, clave):
+        return self.datos["etapas"].get(etapa, {}).get(clave)
+
+    def registrar(self, etapa, clave, huella, **extra):
+        self.datos["etapas"].setdefault(etapa, {})[clave] = {"huella": huella, **extra}
+
+    def guardar(self):
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        temporal = self.ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(self.datos, f, indent=1, ensure_ascii=False)
+        os.replace(temporal, self.ruta)
+
+
+def _entradas_meses(ctx, capa):
+    # Cada mes de la capa anterior es una partición; su huella es la de sus ficheros
+    ruta = ruta_capa(capa, ctx["base"])
+    return {
+        _clave_mes(year, month): ctx["manifiesto"].huella_carpeta(os.path.join(ruta, f"year={year}", f"month={month}"))
+        for year, month in particiones(capa, ctx["base"])
+    }
+
+
+# --- Ingesta: cada fichero JSON de entrada es una partición ---
+
+def _entradas_ingesta(ctx):
+    return {os.path.abspath(f): ctx["manifiesto"].huella_fichero(f) for f in expandir_entradas(ctx["entradas"])}
+
+
+def _meses_fichero(ruta):
+    # Meses entre la primera y la última fecha del fichero (sin leerlo entero)
+    primera, ultima = extremos_fichero(ruta)
+    if primera is None or ultima is None:
+        return set()
+    return {(p.year, p.month) for p in pd.period_range(primera, ultima, freq="M")}
+
+
+def _ejecutar_ingesta(ctx, claves):
+    # Un mes de la capa bruta se reescribe entero, así que hay que volver a ingerir
+    # también los ficheros que aportaron datos a los mismos meses. Los de los ficheros
+    # nuevos o cambiados salen de sus fechas (uno nuevo no tiene meses registrados) y de
+    # lo registrado antes; cada fichero que se añade puede traer meses nuevos, así que se
+    # repite hasta que no entra ninguno más
+    registrados = {clave: {tuple(m) for m in registro.get("meses", [])}
+                   for clave, registro in ctx["manifiesto"].datos["etapas"].get("ingesta", {}).items()
+                   if os.path.exists(clave)}
+    meses = set()
+    for clave in claves:
+        meses |= _meses_fichero(clave) | registrados.get(clave, set())
+    ficheros = set(claves)
+    while True:
+        nuevos = {clave for clave, suyos in registrados.items() if clave not in ficheros and meses & suyos}
+        if not nuevos:
+            break
+        ficheros |= nuevos
+        for clave in nuevos:
+            meses |= registrados[clave]
+    stats = ingestar_lote(sorted(ficheros), CAPA_BRUTA, ctx["base"], procesos=ctx["procesos"], ventana=ctx["ventana"])
+    imprimir_estadisticas(stats)
+    return {f: {"meses": m} for f, m in stats["meses_por_fichero"].items()}
+
+
+# --- Filtrado y limpieza: una partición por mes ---
+
+def _ejecutar_filtrado(ctx, claves):
+    filtrado = cargar_etapa("01_Filtrado.py")
+    for clave in claves:
+        df = leer_capa(CAPA_BRUTA, meses=[_mes_de_clave(clave)], base=ctx["base"])
+        escribir_capa(filtrado.exportar_columnas_reducidas(df), CAPA_FILTRADA, ctx["base"])
+
+
+def _ejecutar_limpieza(ctx, claves):
+    limpieza = cargar_etapa("02_Cleaning.py")
+    for clave in claves:
+        df = leer_capa(CAPA_FILTRADA, meses=[_mes_de_clave(clave)], base=ctx["base"])
+        escribir_capa(limpieza.limpiar(df, ctx["base"]), CAPA_LIMPIA, ctx["base"])
+
+
+def _ejecutar_agregados(ctx, claves):
+    actualizar_agregados(ctx["base"], [_mes_de_clave(clave) for clave in claves])
+
+
+def _entradas_gis(ctx):
+    # Cada mes limpio y, de la tabla de estaciones, solo lo que va en cada punto: la
+    # tabla entera cambia con cada mes limpiado (ultima_vez) y obligaría a exportarlo todo
+    filas = pd.util.hash_pandas_object(leer_estaciones(ctx["base"])[["station_id"] + COLUMNAS_GIS], index=False)
+    estaciones = hashlib.sha256(filas.to_numpy().tobytes()).hexdigest()
+    return {clave: _sha256_texto(huella, estaciones) for clave, huella in _entradas_meses(ctx, CAPA_LIMPIA).items()}
+
+
+def _ejecutar_gis(ctx, claves):
+    exportar_gis(CAPA_LIMPIA, ctx["base"], [_mes_de_clave(clave) for clave in claves])
+
+
+# --- Calidad: una sola tabla de tramos anómalos de toda la capa bruta ---
+
+def _entradas_calidad(ctx):
+    # Los tramos pueden cruzar meses, así que cualquier mes nuevo o cambiado rehace la
+    # tabla (el escaneo es vectorizado y tarda segundos). La tabla de estaciones traduce
+    # el id de BiciMAD a station_id
+    huellas = _entradas_meses(ctx, CAPA_BRUTA)
+    huellas["estaciones"] = ctx["manifiesto"].huella_fichero(ruta_estaciones(ctx["base"]))
+    return {"tabla": _sha256_texto(*[f"{k}={v}" for k, v in sorted(huellas.items())])}
+
+
+def _ejecutar_calidad(ctx, claves):
+    anomalias, _ = escanear(CAPA_BRUTA, ctx["base"])
+    guardar_anomalias(anomalias, ctx["base"])
+    imprimir_resumen(anomalias)
+
+
+# --- Entrenamiento, paquete y servicio ---
+
+def _ruta_modelo_candidato(ctx):
+    return os.path.join(ctx["base"], "modelos", os.path.basename(MODELO_PATH))
+
+
+def _entradas_capa_limpia(ctx, clave, **extra):
+    # Una única partición que depende de todos los meses limpios
+    huellas = _entradas_meses(ctx, CAPA_LIMPIA)
+    huellas.update(extra)
+    # Las coordenadas de las features salen de la tabla de estaciones
+    huellas["estaciones"] = ctx["manifiesto"].huella_fichero(ruta_estaciones(ctx["base"]))
+    return {clave: _sha256_texto(*[f"{k}={v}" for k, v in sorted(huellas.items())])}
+
+
+def _ejecutar_entrenamiento(ctx, claves):
+    if ctx["tam_lote"]:
+        # Por lotes: la capa limpia no llega a estar entera en memoria
+        from entrenamiento_lotes import entrenar_por_lotes
+
+        model, _ = entrenar_por_lotes(CAPA_LIMPIA, ctx["base"], tam_lote=ctx["tam_lote"])
+    else:
+        df = leer_entrenamiento(FEATURES + [OBJETIVO], base=ctx["base"])
+        model = entrenar_xgboost(df)
+    ruta = _ruta_modelo_candidato(ctx)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    joblib.dump(model, ruta)
+
+
+def _ruta_paquete_candidato(ctx):
+    return os.path.join(ctx["base"], "modelos", os.path.basename(PAQUETE_PATH))
+
+
+def _ejecutar_paquete(ctx, claves):
+    publicar_paquete(_ruta_paquete_candidato(ctx), ctx["base"])
+
+
+def _ruta_predicciones_candidata(ctx):
+    return os.path.join(ctx["base"], "modelos", os.path.basename(PREDICCIONES_PATH))
+
+
+def _entradas_predicciones(ctx):
+    rutas = [_ruta_modelo_candidato(ctx), _ruta_paquete_candidato(ctx)]
+    if not all(os.path.exists(ruta) for ruta in rutas):
+        return {}
+    return {"tabla": _sha256_texto(*[ctx["manifiesto"].huella_fichero(ruta) for ruta in rutas])}
+
+
+def _ejecutar_predicciones(ctx, claves):
+    estaciones = cargar_paquete(_ruta_paquete_candidato(ctx))["station_info"]
+    publicar_tabla(_ruta_modelo_candidato(ctx), estaciones, _ruta_predicciones_candidata(ctx))
+
+
+def _artefactos_servicio(ctx):
+    # Artefacto: (candidato generado por el pipeline, ruta de la que lo lee la app)
+    return {
+        "modelo": (_ruta_modelo_candidato(ctx), ctx["modelo_path"]),
+        "paquete": (_ruta_paquete_candidato(ctx), ctx["paquete_path"]),
+        "predicciones": (_ruta_predicciones_candidata(ctx), ctx["predicciones_path"]),
+    }
+
+
+def _entradas_servicio(ctx):
+    return {clave: ctx["manifiesto"].huella_fichero(origen)
+            for clave, (origen, _) in _artefactos_servicio(ctx).items() if os.path.exists(origen)}
+
+
+def _ejecutar_servicio(ctx, claves):
+    # Publicar los artefactos donde los lee la app, sustituyéndolos de forma atómica
+    artefactos = _artefactos_servicio(ctx)
+    for clave in claves:
+        origen, destino = artefactos[clave]
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        shutil.copyfile(origen, destino + ".tmp")
+        os.replace(destino + ".tmp", destino)
+
+
+ETAPAS = {
+    "ingesta": {
+        "depende_de": [],
+        "codigo": ["ingesta.py", "esquema.py", "almacen.py"],
+        "parametros": lambda ctx: {"ventana": repr(ctx["ventana"])},
+        "entradas": _entradas_ingesta,
+        "ejecutar": _ejecutar_ingesta,
+    },
+    "filtrado": {
+        "depende_de": ["ingesta"],
+        "codigo": ["01_Filtrado.py", "almacen.py"],
+        "parametros": lambda ctx: {},
+        "entradas": lambda ctx: _entradas_meses(ctx, CAPA_BRUTA),
+        "ejecutar": _ejecutar_filtrado,
+    },
+    "limpieza": {
+        "depende_de": ["filtrado"],
+        "codigo": ["02_Cleaning.py", "esquema.py", "almacen.py", "estaciones.py"],
+        "parametros": lambda ctx: {},
+        "entradas": lambda ctx: _entradas_meses(ctx, CAPA_FILTRADA),
+        "ejecutar": _ejecutar_limpieza,
+    },
+    "calidad": {
+        "depende_de": ["limpieza"],
+        "codigo": ["calidad.py", "almacen.py"],
+        "parametros": lambda ctx: {"horas_constante": HORAS_CONSTANTE, "salto_m": SALTO_M,
+                                   "excluir": EXCLUIR_ENTRENAMIENTO},
+        "entradas": _entradas_calidad,
+        "ejecutar": _ejecutar_calidad,
+    },
+    "entrenamiento": {
+        "depende_de": ["limpieza", "calidad"],
+        "codigo": ["modelo.py", "entrenamiento_lotes.py", "calidad.py"],
+        "parametros": lambda ctx: {"features": FEATURES, "objetivo": OBJETIVO,
+                                   **({"tam_lote": ctx["tam_lote"]} if ctx["tam_lote"] else {}),
+                                   **({"hiperparametros": h} if (h := cargar_hiperparametros()) else {})},
+        "entradas": lambda ctx: _entradas_capa_limpia(
+            ctx, "modelo", anomalias=ctx["manifiesto"].huella_fichero(ruta_anomalias(ctx["base"]))),
+        "ejecutar": _ejecutar_entrenamiento,
+    },
+    "agregados": {
+        "depende_de": ["limpieza"],
+        "codigo": ["agregados.py"],
+        "parametros": lambda ctx: {},
+        "entradas": lambda ctx: _entradas_meses(ctx, CAPA_LIMPIA),
+        "ejecutar": _ejecutar_agregados,
+    },
+    "gis": {
+        "depende_de": ["limpieza"],
+        "codigo": ["exportar_gis.py", "espacial.py"],
+        "parametros": lambda ctx: {},
+        "entradas": _entradas_gis,
+        "ejecutar": _ejecutar_gis,
+    },
+    "paquete": {
+        "depende_de": ["agregados"],
+        "codigo": ["servicio.py", "agregados.py"],
+        "parametros": lambda ctx: {},
+        "entradas": lambda ctx: _entradas_capa_limpia(ctx, "paquete"),
+        "ejecutar": _ejecutar_paquete,
+    },
+    "predicciones": {
+        "depende_de": ["entrenamiento", "paquete"],
+        "codigo": ["prediccion.py"],
+        "parametros": lambda ctx: {},
+        "entradas": _entradas_predicciones,
+        "ejecutar": _ejecutar_predicciones,
+    },
+    "servicio": {
+        "depende_de": ["entrenamiento", "paquete", "predicciones"],
+        "codigo": [],
+        "parametros": lambda ctx: {clave: destino for clave, (_, destino) in _artefactos_servicio(ctx).items()},
+        "entradas": _entradas_servicio,
+        "ejecutar": _ejecutar_servicio,
+    },
+}
+
+
+def orden_etapas(etapas, hasta=None):
+    # Orden topológico del DAG; con hasta, solo esa etapa y las que necesita
+    orden = []
+
+    def visitar(nombre, camino=()):
+        if nombre in camino:
+            raise ValueError(f"Ciclo en el pipeline: {' -> '.join(camino + (nombre,))}")
+        if nombre in orden:
+            return
+        for dependencia in etapas[nombre]["depende_de"]:
+            visitar(dependencia, camino + (nombre,))
+        orden.append(nombre)
+
+    for nombre in ([hasta] if hasta else etapas):
+        visitar(nombre)
+    return orden
+
+
+def ejecutar_pipeline(entradas, base=CARPETA_DATASET, procesos=None, ventana=VENTANA_14H, hasta=None, forzar=(),
+                      modelo_path=MODELO_PATH, paquete_path=PAQUETE_PATH, predicciones_path=PREDICCIONES_PATH,
+                      tam_lote=None):
+    manifiesto = Manifiesto(os.path.join(base, MANIFIESTO))
+    ctx = {"entradas": entradas, "base": base, "procesos": procesos, "ventana": ventana, "tam_lote": tam_lote,
+           "modelo_path": modelo_path, "paquete_path": paquete_path,
+           "predicciones_path": predicciones_path, "manifiesto": manifiesto}
+    resumen = {}
+
+    for nombre in orden_etapas(ETAPAS, hasta):
+        etapa = ETAPAS[nombre]
+        huella_etapa = _sha256_texto(manifiesto.huella_codigo(etapa["codigo"]),
+                                     json.dumps(etapa["parametros"](ctx), sort_keys=True, default=str))
+        huellas = {clave: _sha256_texto(h, huella_etapa) for clave, h in etapa["entradas"](ctx).items()}
+        pendientes = sorted(clave for clave, h in huellas.items()
+                            if nombre in forzar or (manifiesto.registro(nombre, clave) or {}).get("huella") != h)
+
+        if not pendientes:
+            print(f"⏭️  {nombre}: sin cambios ({len(huellas)} particiones al día)")
+            resumen[nombre] = []
+            continue
+
+        print(f"▶️  {nombre}: {len(pendientes)} de {len(huellas)} particiones -> {pendientes}")
+        with medir(f"pipeline.{nombre}") as medida:
+            extra = etapa["ejecutar"](ctx, pendientes) or {}
+            medida.anotar(particiones=pendientes)
+        for clave in pendientes:
+            manifiesto.registrar(nombre, clave, huellas[clave], **extra.get(clave, {}))
+        # Los ficheros que se han vuelto a ingerir por compartir meses también quedan al día
+        for clave in extra:
+            if clave not in pendientes and clave in huellas:
+                manifiesto.registrar(nombre, clave, huellas[clave], **extra[clave])
+        manifiesto.guardar()
+        resumen[nombre] = pendientes
+        print(f"✅ {nombre}: completada")
+
+    return resumen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline incremental de BiciMAD")
+    parser.add_argument("entradas", nargs="*", default=["C:/Final_Prog/Input"],
+                        help="Ficheros .json, carpetas o patrones glob")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos en paralelo para la ingesta")
+    parser.add_argument("--hasta-etapa", choices=list(ETAPAS), help="Ejecutar solo hasta esta etapa")
+    parser.add_argument("--forzar", nargs="+", default=[], choices=list(ETAPAS),
+                        help="Etapas a ejecutar aunque no haya cambios")
+    parser.add_argument("--entrenar-por-lotes", type=int, metavar="FILAS",
+                        help="Entrenar por lotes de estas filas sin cargar la capa limpia en memoria")
+    añadir_argumentos_ventana(parser)
+    añadir_argumentos_instrumentacion(parser)
+    args = parser.parse_args()
+    activar_desde_argumentos(args)
+
+    ejecutar_pipeline(args.entradas, procesos=args.procesos, ventana=ventana_desde_argumentos(args),
+                      hasta=args.hasta_etapa, forzar=args.forzar, tam_lote=args.entrenar_por_lotes)
+    cerrar_desde_argumentos(args)
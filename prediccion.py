@@ -0,0 +1,178 @@
+import hashlib
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+
+from almacen import CARPETA_SALIDA
+from modelo import FEATURES
+
+# Tabla de predicciones precalculada: todas las estaciones x días del mes x días de la
+# semana x escenarios de factores externos, calculada con una sola llamada al modelo
+PREDICCIONES_PATH = os.path.join(CARPETA_SALIDA, "tabla_predicciones.npz")
+
+# Opciones de los factores externos de la app ("" = sin seleccionar)
+TEMPERATURAS = ["", "Normal (10-30°C)", "Menor a 10°C", "Mayor a 30°C"]
+LLUVIAS = ["", "Sin lluvia", "Lluvia leve", "Lluvia intensa"]
+ESTACIONES_AÑO = ["", "Primavera o verano", "Otoño o invierno"]
+ESCENARIOS = list(itertools.product(TEMPERATURAS, LLUVIAS, ESTACIONES_AÑO))
+INDICE_ESCENARIO = {escenario: i for i, escenario in enumerate(ESCENARIOS)}
+
+DIAS = np.arange(1, 32)
+WEEKDAYS = np.arange(7)
+
+
+def tipo_de_dia(weekday):
+    return "Laborable" if weekday <= 4 else "Fin de semana"
+
+
+def factor_ajuste(tipo_dia, temperatura="", lluvia="", estacion=""):
+    # Calcular ajustes solo si se ha seleccionado una opción
+    factor = 1.0
+
+    if tipo_dia == "Fin de semana":
+        factor *= 0.90
+    elif tipo_dia == "Laborable":
+        factor *= 0.95
+
+    if temperatura == "Menor a 10°C":
+        factor *= 0.80
+    elif temperatura == "Mayor a 30°C":
+        factor *= 0.85
+
+    if lluvia == "Lluvia leve":
+        factor *= 0.75
+    elif lluvia == "Lluvia intensa":
+        factor *= 0.60
+
+    if estacion == "Primavera o verano":
+        factor *= 0.85
+    elif estacion == "Otoño o invierno":
+        factor *= 0.95
+
+    return factor
+
+
+def disponibilidad(total_bases, pred_ajustada):
+    # El modelo predice in_use = total_bases - free_bases: las bases ocupadas, es decir,
+    # las bicis ancladas que se pueden coger; el resto son las bases libres para dejarla.
+    # Devuelve (bicis, bases_libres) acotadas a la capacidad de la estación
+    total = np.asarray(total_bases)
+    bicis = np.clip(np.asarray(pred_ajustada), 0, total)
+    return bicis, total - bicis
+
+
+def matriz_features(estaciones, dias=DIAS, weekdays=WEEKDAYS):
+    # Todas las combinaciones estación x día x día de la semana, en ese orden
+    n_est, n_dias, n_wd = len(estaciones), len(dias), len(weekdays)
+    repetir = n_dias * n_wd
+    return pd.DataFrame({
+        'day': np.tile(np.repeat(dias, n_wd), n_est),
+        'weekday': np.tile(weekdays, n_est * n_dias),
+        'total_bases': np.repeat(estaciones['total_bases'].to_numpy(), repetir),
+        'longitude': np.repeat(estaciones['longitude'].to_numpy(), repetir),
+        'latitude': np.repeat(estaciones['latitude'].to_numpy(), repetir),
+        'station_id': np.repeat(estaciones['station_id'].to_numpy(), repetir),
+    })[FEATURES]
+
+
+def predecir_lote(model, estaciones, dias=DIAS, weekdays=WEEKDAYS):
+    # Devuelve las predicciones con forma (estaciones, días, días de la semana)
+    pred = model.predict(matriz_features(estaciones, dias, weekdays))
+    return np.asarray(pred).reshape(len(estaciones), len(dias), len(weekdays))
+
+
+def factores_escenarios(weekdays=WEEKDAYS):
+    # Factor de ajuste por día de la semana (tipo de día) y escenario: forma (días de la semana, escenarios)
+    return np.array([[factor_ajuste(tipo_de_dia(w), *escenario) for escenario in ESCENARIOS] for w in weekdays])
+
+
+def huella_modelo(modelo_path):
+    with open(modelo_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def huella_tabla(modelo_path, estaciones):
+    # Modelo y estaciones de las que sale la tabla: con estaciones nuevas o renumeradas
+    # (paquete republicado) las filas ya no corresponden y hay que recalcularla
+    h = hashlib.sha256(huella_modelo(modelo_path).encode())
+    for col in ("station_id", "total_bases", "longitude", "latitude"):
+        h.update(np.ascontiguousarray(estaciones[col].to_numpy()).tobytes())
+    return h.hexdigest()
+
+
+class TablaPredicciones:
+
+    def __init__(self, station_ids, total_bases, base, ajustada, huella):
+        self.station_ids = station_ids
+        self.total_bases = total_bases
+        self.base = base            # (estaciones, 31, 7) predicción del modelo redondeada
+        self.ajustada = ajustada    # (estaciones, 31, 7, escenarios) con los factores aplicados
+        self.huella = huella        # hash del modelo y las estaciones con los que se calculó
+        self._fila = {int(s): i for i, s in enumerate(station_ids)}
+
+    @classmethod
+    def construir(cls, model, estaciones, huella=""):
+        pred = predecir_lote(model, estaciones)
+        base = np.rint(pred).astype(np.int16)
+        ajustada = np.rint(base[..., None] * factores_escenarios()[None, None, :, :]).astype(np.int16)
+        return cls(estaciones['station_id'].to_numpy(np.int16), estaciones['total_bases'].to_numpy(np.int16),
+                   base, ajustada, huella)
+
+    def predecir(self, station_id, day, weekday, temperatura="", lluvia="", estacion=""):
+        # Predicción base y ajustada de una estación, igual que en la app pero sin llamar al modelo
+        i = self._fila[int(station_id)]
+        escenario = INDICE_ESCENARIO[(temperatura, lluvia, estacion)]
+        return int(self.base[i, day - 1, weekday]), int(self.ajustada[i, day - 1, weekday, escenario])
+
+    def predecir_estaciones(self, station_ids, day, weekday, temperatura="", lluvia="", estacion=""):
+        # Lo mismo para varias estaciones a la vez: arrays de predicción base y ajustada
+        filas = np.array([self._fila[int(s)] for s in station_ids], dtype=np.intp)
+        escenario = INDICE_ESCENARIO[(temperatura, lluvia, estacion)]
+        return self.base[filas, day - 1, weekday], self.ajustada[filas, day - 1, weekday, escenario]
+
+    def a_dataframe(self):
+        # Formato largo (station_id, day, weekday, escenario) para consultas o exportación
+        n_est, n_dias, n_wd, n_esc = self.ajustada.shape
+        return pd.DataFrame({
+            'station_id': np.repeat(self.station_ids, n_dias * n_wd * n_esc),
+            'day': np.tile(np.repeat(DIAS, n_wd * n_esc), n_est),
+            'weekday': np.tile(np.repeat(WEEKDAYS, n_esc), n_est * n_dias),
+            'escenario': np.tile(np.arange(n_esc), n_est * n_dias * n_wd),
+            'pred_base': np.repeat(self.base.ravel(), n_esc),
+            'pred_ajustada': self.ajustada.ravel(),
+        })
+
+    def guardar(self, ruta=PREDICCIONES_PATH):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = ruta + ".tmp.npz"
+        np.savez_compressed(temporal, station_ids=self.station_ids, total_bases=self.total_bases,
+                            base=self.base, ajustada=self.ajustada, huella=np.array(self.huella))
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta=PREDICCIONES_PATH):
+        with np.load(ruta) as datos:
+            return cls(datos["station_ids"], datos["total_bases"], datos["base"], datos["ajustada"],
+                       str(datos["huella"]))
+
+
+def publicar_tabla(modelo_path, estaciones, destino=PREDICCIONES_PATH):
+    import joblib
+
+    model = joblib.load(modelo_path)
+    tabla = TablaPredicciones.construir(model, estaciones, huella_tabla(modelo_path, estaciones))
+    tabla.guardar(destino)
+    print(f"✅ Tabla de predicciones publicada: {destino} {tabla.ajustada.shape}")
+    return tabla
+
+
+def cargar_tabla(modelo_path, estaciones, ruta=PREDICCIONES_PATH):
+    # La tabla solo vale para el modelo y las estaciones con los que se calculó: si ha
+    # cambiado cualquiera de los dos se reconstruye
+    if os.path.exists(ruta):
+        tabla = TablaPredicciones.cargar(ruta)
+        if tabla.huella == huella_tabla(modelo_path, estaciones):
+            return tabla
+    return publicar_tabla(modelo_path, estaciones, ruta)
@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import joblib
+
+from almacen import CAPA_LIMPIA, CARPETA_DATASET, CARPETA_SALIDA, particiones
+from calidad import leer_entrenamiento
+from modelo import FEATURES, MODELO_PATH, OBJETIVO, actualizar_xgboost, entrenar_xgboost
+
+# Registro de versiones del modelo: cada entrenamiento (completo o incremental) deja su
+# modelo y sus metadatos en una carpeta vXXXX; la versión activa es la que se publica en
+# MODELO_PATH, sustituyendo el fichero de forma atómica para que la app cambie de modelo
+# sin dejar de servir. Las actualizaciones mensuales siguen el boosting del modelo activo
+# solo con los meses nuevos
+CARPETA_REGISTRO = os.path.join(CARPETA_SALIDA, "registro_modelos")
+INDICE = "registro.json"
+FRACCION_VALIDACION = 0.2
+RONDAS_ACTUALIZACION = 50
+
+
+def _clave_mes(mes):
+    return f"{mes[0]}-{mes[1]:02d}"
+
+
+class RegistroModelos:
+
+    def __init__(self, carpeta=CARPETA_REGISTRO):
+        self.carpeta = carpeta
+        self.ruta_indice = os.path.join(carpeta, INDICE)
+        if os.path.exists(self.ruta_indice):
+            with open(self.ruta_indice, encoding="utf-8") as f:
+                self.indice = json.load(f)
+        else:
+            self.indice = {"activa": None, "versiones": []}
+
+    def _guardar_indice(self):
+        os.makedirs(self.carpeta, exist_ok=True)
+        with open(self.ruta_indice + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.indice, f, indent=2, ensure_ascii=False)
+        os.replace(self.ruta_indice + ".tmp", self.ruta_indice)
+
+    def ruta_modelo(self, version):
+        return os.path.join(self.carpeta, version, "modelo.joblib")
+
+    def version(self, version):
+        for meta in self.indice["versiones"]:
+            if meta["version"] == version:
+                return meta
+        raise KeyError(f"Versión desconocida: {version}")
+
+    @property
+    def activa(self):
+        return self.version(self.indice["activa"]) if self.indice["activa"] else None
+
+    def cargar(self, version=None):
+        return joblib.load(self.ruta_modelo(version or self.indice["activa"]))
+
+    def registrar(self, model, **meta):
+        version = f"v{len(self.indice['versiones']) + 1:04d}"
+        ruta = self.ruta_modelo(version)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        joblib.dump(model, ruta)
+        meta = {"version": version, "creado": time.strftime("%Y-%m-%d %H:%M:%S"), **meta}
+        with open(os.path.join(os.path.dirname(ruta), "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2, ensure_ascii=False)
+        self.indice["versiones"].append(meta)
+        self._guardar_indice()
+        print(f"✅ Modelo {version} registrado ({meta.get('tipo')}, validación {meta.get('validacion')})")
+        return version
+
+    def activar(self, version, destino=MODELO_PATH):
+        # Publica la versión donde la lee la app (copia + os.replace: nunca hay un fichero a medias)
+        self.version(version)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        shutil.copyfile(self.ruta_modelo(version), destino + ".tmp")
+        os.replace(destino + ".tmp", destino)
+        self.indice["activa"] = version
+        self._guardar_indice()
+        print(f"✅ Versión {version} activa en {destino}")
+
+    def rollback(self, destino=MODELO_PATH):
+        # Vuelve a la versión de la que partió la activa (o a la anterior si fue un entrenamiento completo)
+        activa = self.activa
+        if activa is None:
+            raise ValueError("No hay ninguna versión activa")
+        anterior = activa.get("padre")
+        if anterior is None:
+            versiones = [m["version"] for m in self.indice["versiones"]]
+            posicion = versiones.index(activa["version"])
+            if posicion == 0:
+                raise ValueError(f"{activa['version']} es la primera versión: no hay a dónde volver")
+            anterior = versiones[posicion - 1]
+        self.activar(anterior, destino)
+        return anterior
+
+
+def _dividir(df):
+    # Validación: una parte fija (misma semilla) de los meses con los que se entrena
+    validacion = df.sample(frac=FRACCION_VALIDACION, random_state=42)
+    return df.drop(validacion.index), validacion
+
+
+def _puntuar(model, df):
+    from sklearn.metrics import mean_squared_error, r2_score
+
+    pred = model.predict(df[FEATURES])
+    return {"MSE": round(float(mean_squared_error(df[OBJETIVO], pred)), 4),
+            "R2": round(float(r2_score(df[OBJETIVO], pred)), 4), "filas": len(df)}
+
+
+def entrenar_completo(registro, base=CARPETA_DATASET, activar=True, destino=MODELO_PATH):
+    meses = particiones(CAPA_LIMPIA, base)
+    df = leer_entrenamiento(FEATURES + [OBJETIVO], base=base)
+    entrenamiento, validacion = _dividir(df)
+    inicio = time.perf_counter()
+    model = entrenar_xgboost(entrenamiento)
+    version = registro.registrar(
+        model, tipo="completo", padre=None, meses=[_clave_mes(m) for m in meses], meses_nuevos=[_clave_mes(m) for m in meses],
+        filas=len(entrenamiento), rondas=model.get_booster().num_boosted_rounds(),
+        segundos=round(time.perf_counter() - inicio, 3), validacion=_puntuar(model, validacion))
+    if activar:
+        registro.activar(version, destino)
+    return version
+
+
+def actualizar(registro, base=CARPETA_DATASET, meses=None, rondas=RONDAS_ACTUALIZACION, activar=True,
+               destino=MODELO_PATH, forzar=False):
+    # Continúa el boosting del modelo activo con los meses que aún no ha visto. La versión
+    # nueva solo se activa si no empeora al modelo del que parte en la validación de esos
+    # meses (salvo forzar=True); si empeora queda registrada para revisarla
+    activa = registro.activa
+    if activa is None:
+        print("No hay modelo activo: se entrena uno completo")
+        return entrenar_completo(registro, base, activar, destino)
+    vistos = set(activa["meses"])
+    if meses is None:
+        meses = [m for m in particiones(CAPA_LIMPIA, base) if _clave_mes(m) not in vistos]
+    if not meses:
+        print(f"⏭️  {activa['version']} ya incluye todos los meses de la capa limpia")
+        return None
+
+    df = leer_entrenamiento(FEATURES + [OBJETIVO], base=base, meses=meses)
+    entrenamiento, validacion = _dividir(df)
+    anterior = registro.cargar(activa["version"])
+    inicio = time.perf_counter()
+    model = actualizar_xgboost(anterior, entrenamiento, rondas)
+    nuevos = [_clave_mes(m) for m in meses]
+    puntuacion, puntuacion_padre = _puntuar(model, validacion), _puntuar(anterior, validacion)
+    version = registro.registrar(
+        model, tipo="incremental", padre=activa["version"], meses=sorted(vistos | set(nuevos)), meses_nuevos=nuevos,
+        filas=len(entrenamiento), rondas=model.get_booster().num_boosted_rounds(),
+        segundos=round(time.perf_counter() - inicio, 3), validacion=puntuacion, validacion_padre=puntuacion_padre)
+    if activar and (forzar or puntuacion["MSE"] <= puntuacion_padre["MSE"]):
+        registro.activar(version, destino)
+    elif activar:
+        print(f"⚠️ {version} no mejora a {activa['version']} en los meses nuevos "
+              f"(MSE {puntuacion['MSE']} frente a {puntuacion_padre['MSE']}): sigue activa {activa['version']}")
+    return version
+
+
+def imprimir_registro(registro):
+    for meta in registro.indice["versiones"]:
+        marca = "▶" if meta["version"] == registro.indice["activa"] else " "
+        validacion = meta.get("validacion") or {}
+        print(f"{marca} {meta['version']} {meta['creado']} {meta['tipo']:<11} padre={meta.get('padre')} "
+              f"meses nuevos={meta['meses_nuevos']} rondas={meta['rondas']} {meta['segundos']} s "
+              f"MSE={validacion.get('MSE')} R2={validacion.get('R2')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Registro de versiones del modelo")
+    parser.add_argument("accion", choices=["completo", "actualizar", "listar", "activar", "rollback"])
+    parser.add_argument("version", nargs="?", help="Versión para 'activar' (p. ej. v0003)")
+    parser.add_argument("--meses", nargs="+", help="Meses para 'actualizar' (YYYY-MM); por defecto, los no vistos")
+    parser.add_argument("--rondas", type=int, default=RONDAS_ACTUALIZACION, help="Árboles nuevos por actualización")
+    parser.add_argument("--no-activar", action="store_true", help="Registrar la versión sin publicarla")
+    parser.add_argument("--forzar", action="store_true", help="Activar la actualización aunque no mejore a la anterior")
+    parser.add_argument("--base", default=CARPETA_DATASET)
+    parser.add_argument("--registro", default=CARPETA_REGISTRO)
+    parser.add_argument("--destino", default=MODELO_PATH, help="Ruta de la que lee el modelo la app")
+    args = parser.parse_args()
+
+    registro = RegistroModelos(args.registro)
+    if args.accion == "completo":
+        entrenar_completo(registro, args.base, not args.no_activar, args.destino)
+    elif args.accion == "actualizar":
+        meses = [tuple(map(int, m.split("-"))) for m in args.meses] if args.meses else None
+        actualizar(registro, args.base, meses, args.rondas, not args.no_activar, args.destino, args.forzar)
+    elif args.accion == "activar":
+        if not args.version:
+            parser.error("'activar' necesita una versión")
+        try:
+            registro.activar(args.version, args.destino)
+        except KeyError as e:
+            parser.error(e.args[0])
+    elif args.accion == "rollback":
+        try:
+            registro.rollback(args.destino)
+        except ValueError as e:
+            parser.error(str(e))
+    imprimir_registro(registro)
@@ -0,0 +1,61 @@
+import os
+import time
+
+import joblib
+
+from almacen import CARPETA_SALIDA
+
+# Paquete de servicio: lo que necesita la interfaz para arrancar (tabla de estaciones y
+# medias históricas), precalculado por el pipeline y guardado junto al modelo
+PAQUETE_PATH = os.path.join(CARPETA_SALIDA, "paquete_servicio.joblib")
+VERSION_PAQUETE = 2
+
+
+def construir_paquete(base=None):
+    # Import diferido: la app solo necesita leer el paquete, no el dataset
+    from agregados import actualizar_agregados, cargar_agregados, rollup
+    from almacen import CARPETA_DATASET
+    from estaciones import leer_estaciones
+
+    base = base or CARPETA_DATASET
+    estaciones = leer_estaciones(base)
+    # Media de in_use por station_id a partir del cubo de agregados (solo se agregan los
+    # meses que falten), sin releer la capa limpia: suma / conteo de todas sus celdas,
+    # así que cada snapshot pesa lo mismo
+    actualizar_agregados(base)
+    media_estacion = rollup(cargar_agregados(base), ["station_id"])["media"].dropna()
+
+    # Una fila por nombre, igual que el selector de la app
+    station_info = (estaciones.sort_values("station_id")
+                    .groupby("name", sort=True)
+                    .agg(station_id=("station_id", "first"), total_bases=("total_bases", "first"),
+                         longitude=("longitude", "first"), latitude=("latitude", "first"))
+                    .reset_index())
+    mean_usage = {int(station_id): float(media) for station_id, media in media_estacion.items()}
+
+    return {
+        "version": VERSION_PAQUETE,
+        "creado": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "station_info": station_info,
+        "mean_usage": mean_usage,
+    }
+
+
+def publicar_paquete(destino=PAQUETE_PATH, base=None):
+    paquete = construir_paquete(base)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    joblib.dump(paquete, destino + ".tmp", compress=3)
+    os.replace(destino + ".tmp", destino)
+    print(f"✅ Paquete de servicio publicado: {destino} ({len(paquete['station_info'])} estaciones)")
+    return paquete
+
+
+def cargar_paquete(ruta=PAQUETE_PATH):
+    paquete = joblib.load(ruta)
+    if paquete.get("version") != VERSION_PAQUETE:
+        raise ValueError(f"Versión de paquete no soportada: {paquete.get('version')}")
+    return paquete
+
+
+if __name__ == "__main__":
+    publicar_paquete()
@@ -0,0 +1,214 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from espacial import CERCANAS, construir_indice, donde_coger_bici
+from modelo import FEATURES, MODELO_PATH
+from prediccion import ESCENARIOS, disponibilidad, factor_ajuste, tipo_de_dia
+from servicio import PAQUETE_PATH, cargar_paquete
+
+# Servidor HTTP de predicción: carga el modelo una vez y agrupa las peticiones que
+# llegan a la vez en un solo model.predict (micro-lotes)
+#   POST /predecir       {"station_id": 3, "day": 15, "weekday": 2, "temperatura": "", ...}
+#   POST /predecir_lote  {"consultas": [{...}, {...}]}
+#   POST /cercanas       {"longitude": -3.70, "latitude": 40.42, "day": 15, "weekday": 2, "k": 5, "dejar": false, ...}
+#   GET  /estaciones, /salud
+
+ESPERA_MAX_MS = 5
+MAX_LOTE = 1024
+OPCIONALES = ("temperatura", "lluvia", "estacion")
+
+
+class ErrorConsulta(ValueError):
+    pass
+
+
+class Predictor:
+
+    def __init__(self, model, station_info, espera_max_ms=ESPERA_MAX_MS, max_lote=MAX_LOTE):
+        self.model = model
+        self.estaciones = station_info.set_index("station_id")[["total_bases", "longitude", "latitude"]]
+        self.espera_max = espera_max_ms / 1000
+        self.max_lote = max_lote
+        self.lotes = 0
+        self.consultas = 0
+        self._cola = queue.Queue()
+        threading.Thread(target=self._bucle, daemon=True).start()
+
+    def _validar(self, consulta):
+        try:
+            station_id = int(consulta["station_id"])
+            day = int(consulta["day"])
+            weekday = int(consulta["weekday"])
+        except (KeyError, TypeError, ValueError):
+            raise ErrorConsulta("Se necesitan station_id, day y weekday enteros")
+        if station_id not in self.estaciones.index:
+            raise ErrorConsulta(f"Estación desconocida: {station_id}")
+        if not 1 <= day <= 31 or not 0 <= weekday <= 6:
+            raise ErrorConsulta("day debe estar entre 1 y 31 y weekday entre 0 y 6")
+        escenario = tuple(consulta.get(c, "") or "" for c in OPCIONALES)
+        if escenario not in ESCENARIOS:
+            raise ErrorConsulta(f"Factores externos no válidos: {escenario}")
+        return station_id, day, weekday, escenario
+
+    def encolar(self, consulta):
+        futuro = Future()
+        self._cola.put((self._validar(consulta), futuro))
+        return futuro
+
+    def _bucle(self):
+        # Espera la primera consulta y junta las que lleguen en los siguientes milisegundos
+        while True:
+            lote = [self._cola.get()]
+            limite = time.monotonic() + self.espera_max
+            while len(lote) < self.max_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(self._cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+            try:
+                self._procesar(lote)
+            except Exception as e:
+                for _, futuro in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+
+    def _procesar(self, lote):
+        station_ids = np.array([c[0] for c, _ in lote])
+        estaciones = self.estaciones.loc[station_ids]
+        X = pd.DataFrame({
+            "day": [c[1] for c, _ in lote],
+            "weekday": [c[2] for c, _ in lote],
+            "total_bases": estaciones["total_bases"].to_numpy(),
+            "longitude": estaciones["longitude"].to_numpy(),
+            "latitude": estaciones["latitude"].to_numpy(),
+            "station_id": station_ids,
+        })[FEATURES]
+        predicciones = self.model.predict(X)
+
+        for ((station_id, day, weekday, escenario), futuro), pred, total_bases in zip(
+                lote, predicciones, estaciones["total_bases"].to_numpy()):
+            pred_base = int(round(float(pred)))
+            tipo_dia = tipo_de_dia(weekday)
+            pred_ajustada = int(round(pred_base * factor_ajuste(tipo_dia, *escenario)))
+            bicis, bases_libres = disponibilidad(total_bases, pred_ajustada)
+            futuro.set_result({
+                "station_id": station_id,
+                "tipo_dia": tipo_dia,
+                "pred_base": pred_base,
+                "pred_ajustada": pred_ajustada,
+                "total_bases": int(total_bases),
+                "disponibles": int(bicis),
+                "bases_libres": int(bases_libres),
+                "supera_capacidad": bool(pred_ajustada > total_bases),
+            })
+        self.lotes += 1
+        self.consultas += len(lote)
+
+
+def buscar_cercanas(predictor, indice, consulta, timeout):
+    # Estaciones más cercanas al punto con bicis (o bases libres si dejar) previstas; las
+    # candidatas se predicen como consultas normales, así que entran en los micro-lotes
+    try:
+        longitude, latitude = float(consulta["longitude"]), float(consulta["latitude"])
+        k = int(consulta.get("k", CERCANAS))
+        radio_m = float(consulta["radio_m"]) if consulta.get("radio_m") is not None else None
+    except (KeyError, TypeError, ValueError):
+        raise ErrorConsulta("Se necesitan longitude y latitude numéricos (y k entero)")
+    if k < 1:
+        raise ErrorConsulta("k debe ser al menos 1")
+
+    def prediccion(station_ids):
+        futuros = [predictor.encolar({**consulta, "station_id": int(s)}) for s in station_ids]
+        return np.array([f.result(timeout)["pred_ajustada"] for f in futuros])
+
+    cercanas = donde_coger_bici(indice, prediccion, longitude, latitude, k, bool(consulta.get("dejar")),
+                                radio_m=radio_m)
+    return {"estaciones": cercanas.astype(object).where(cercanas.notna(), None).to_dict("records")}
+
+
+def crear_manejador(predictor, timeout, indice=None):
+
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _responder(self, codigo, datos):
+            cuerpo = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def do_GET(self):
+            if self.path == "/estaciones":
+                return self._responder(200, {"station_ids": predictor.estaciones.index.astype(int).tolist()})
+            if self.path != "/salud":
+                return self._responder(404, {"error": "Ruta no encontrada"})
+            media = predictor.consultas / predictor.lotes if predictor.lotes else 0
+            self._responder(200, {"estado": "ok", "lotes": predictor.lotes, "consultas": predictor.consultas,
+                                  "tamaño_medio_lote": round(media, 2)})
+
+        def do_POST(self):
+            try:
+                longitud = int(self.headers.get("Content-Length", 0))
+                datos = json.loads(self.rfile.read(longitud) or b"{}")
+                if self.path == "/predecir":
+                    self._responder(200, predictor.encolar(datos).result(timeout))
+                elif self.path == "/predecir_lote":
+                    futuros = [predictor.encolar(c) for c in datos.get("consultas", [])]
+                    self._responder(200, {"predicciones": [f.result(timeout) for f in futuros]})
+                elif self.path == "/cercanas" and indice is not None:
+                    self._responder(200, buscar_cercanas(predictor, indice, datos, timeout))
+                else:
+                    self._responder(404, {"error": "Ruta no encontrada"})
+            except (ErrorConsulta, json.JSONDecodeError, AttributeError) as e:
+                self._responder(400, {"error": str(e)})
+            except Exception as e:
+                self._responder(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Manejador
+
+
+def arrancar(modelo_path=MODELO_PATH, paquete_path=PAQUETE_PATH, host="127.0.0.1", puerto=8000,
+             espera_max_ms=ESPERA_MAX_MS, max_lote=MAX_LOTE, timeout=10):
+    model = joblib.load(modelo_path)
+    station_info = cargar_paquete(paquete_path)["station_info"]
+    predictor = Predictor(model, station_info, espera_max_ms, max_lote)
+    servidor = ThreadingHTTPServer((host, puerto), crear_manejador(predictor, timeout, construir_indice(station_info)))
+    servidor.daemon_threads = True
+    print(f"✅ Servidor de predicción en http://{host}:{puerto} (micro-lotes de hasta {max_lote} en {espera_max_ms} ms)")
+    return servidor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor HTTP de predicción de BiciMAD")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Interfaz en la que escuchar (0.0.0.0 para exponerlo en todas)")
+    parser.add_argument("--puerto", type=int, default=8000)
+    parser.add_argument("--modelo", default=MODELO_PATH)
+    parser.add_argument("--paquete", default=PAQUETE_PATH)
+    parser.add_argument("--espera-ms", type=float, default=ESPERA_MAX_MS,
+                        help="Tiempo máximo que espera una consulta a que se llene su lote")
+    parser.add_argument("--max-lote", type=int, default=MAX_LOTE)
+    args = parser.parse_args()
+
+    servidor = arrancar(args.modelo, args.paquete, args.host, args.puerto, args.espera_ms, args.max_lote)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        servidor.server_close()